@@ -1,5 +1,8 @@
 import hydra
 from omegaconf import OmegaConf
+import sqlalchemy.orm as sa_orm
+
+from hydra_orm import db, orm, utils
 
 import cs
 
@@ -7,13 +10,18 @@ import cs
 @hydra.main(version_base=None, config_name='Config')
 def main(cfg):
     print(OmegaConf.to_yaml(cfg, sort_keys=True))
-    engine = cs.sa.create_engine('sqlite+pysqlite:///runs.sqlite')
-    cs.create_all(engine)
-    with cs.orm.Session(engine, expire_on_commit=False) as session:
-        sc = cs.instantiate_and_insert_config(session, OmegaConf.to_container(cfg))
-        session.commit()
-        sc = cs.detach_config_from_session(sc, session)
-        print('end')
+    engine = db.create_engine('sqlite+pysqlite:///runs.sqlite')
+    orm.create_all(db.writing(engine))
+
+    def insert():
+        with sa_orm.Session(db.writing(engine), expire_on_commit=False) as session:
+            sc = orm.instantiate_and_insert_config(session, OmegaConf.to_container(cfg))
+            session.commit()
+            return orm.detach_config_from_session(sc, session)
+
+    # a new Config whose generated alt_id was saved already is inserted again
+    sc = utils.retry_on_unique_violation(insert, cs.Config, cs.Config.alt_id.key)
+    print('end')
     print(sc)
 
 
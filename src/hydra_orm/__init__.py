@@ -0,0 +1,3 @@
+def main(argv=None):
+    from hydra_orm import maintenance
+    return maintenance.main(argv)
@@ -0,0 +1,110 @@
+import random
+import time
+
+from hydra.core.hydra_config import HydraConfig
+import sqlalchemy as sa
+import sqlalchemy.pool
+
+
+# WAL lets readers go on while a job writes, and synchronous=NORMAL only
+# syncs the WAL at checkpoints, which is still safe against corruption.
+# busy_timeout makes a connection wait for the write lock instead of failing
+# at once. A negative cache_size is in KiB.
+SQLITE_PRAGMAS = dict(
+    journal_mode='WAL',
+    synchronous='NORMAL',
+    busy_timeout=30_000,
+    cache_size=-64_000,
+    temp_store='MEMORY',
+)
+# the launchers that run every job in the process of the sweep, which can
+# keep its connections open between jobs
+IN_PROCESS_LAUNCHERS = ('basic',)
+# the execution option that makes the transactions of a connection of
+# create_engine begin with BEGIN IMMEDIATE
+BEGIN_IMMEDIATE_OPTION = 'hydra_orm_begin_immediate'
+LOCKED_ERROR_MESSAGES = ('database is locked', 'database is busy', 'database table is locked')
+
+
+def _hydra_launcher():
+    if not HydraConfig.initialized():
+        return None
+    return HydraConfig.get().runtime.choices.get('hydra/launcher')
+
+
+def _pool_options(url, launcher):
+    if url.database in (None, '', ':memory:'):
+        return {}
+    if launcher is None or launcher in IN_PROCESS_LAUNCHERS:
+        return {}
+    # jobs of other launchers run in worker processes, which must neither
+    # share the connections of a forked parent nor keep idle ones open
+    return dict(poolclass=sqlalchemy.pool.NullPool)
+
+
+def _listen_sqlite(engine, pragmas):
+    @sa.event.listens_for(engine, 'connect')
+    def _connect(dbapi_connection, connection_record):
+        # pysqlite would only begin the transaction at the first write, so
+        # the transactions are begun by _begin instead
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for k, v in pragmas.items():
+            cursor.execute(f'PRAGMA {k}={v}')
+        cursor.close()
+
+    @sa.event.listens_for(engine, 'begin')
+    def _begin(connection):
+        # a deferred transaction that read before writing fails at once when
+        # another one took the write lock meanwhile, so writing transactions
+        # take it when they begin. Reading ones stay deferred, so that readers
+        # go on while a job writes.
+        if connection.get_execution_options().get(BEGIN_IMMEDIATE_OPTION, False):
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+        else:
+            connection.exec_driver_sql('BEGIN')
+
+
+def writing(bind):
+    # The engine or connection to give sessions that write: on an engine of
+    # create_engine for SQLite, their transactions begin with BEGIN
+    # IMMEDIATE, so that waiting for the write lock is left to busy_timeout.
+    # Other backends ignore the option.
+    return bind.execution_options(**{BEGIN_IMMEDIATE_OPTION: True})
+
+
+def create_engine(db_url, launcher=None, pragmas=None, begin_immediate=False, **kwargs):
+    # Creates an engine for jobs writing to one database concurrently. On
+    # SQLite, every connection sets SQLITE_PRAGMAS updated by pragmas, and
+    # the transactions of sessions bound to writing(engine) take the write
+    # lock when they begin, as do all transactions with begin_immediate. Jobs
+    # of launchers other than the basic one get no connection pool. launcher
+    # is the name of the hydra/launcher choice, taken from the running Hydra
+    # job by default. Other kwargs are passed to sqlalchemy.create_engine.
+    url = sa.engine.make_url(db_url)
+    if url.get_backend_name() != 'sqlite':
+        return sa.create_engine(url, **kwargs)
+    if launcher is None:
+        launcher = _hydra_launcher()
+    engine = sa.create_engine(url, **{**_pool_options(url, launcher), **kwargs})
+    _listen_sqlite(engine, {**SQLITE_PRAGMAS, **(pragmas or {})})
+    return writing(engine) if begin_immediate else engine
+
+
+def is_locked_error(e):
+    return isinstance(e, sa.exc.OperationalError) and any(m in str(e.orig) for m in LOCKED_ERROR_MESSAGES)
+
+
+def retry_on_lock(func, max_attempts=8, initial_delay=0.05, max_delay=2., sleep=time.sleep):
+    # Calls func until it does not fail because the database is locked,
+    # waiting exponentially longer with jitter in between. func should run a
+    # whole transaction, as the failed one is rolled back.
+    delay = initial_delay
+    for attempt in range(max_attempts):
+        try:
+            return func()
+        except sa.exc.OperationalError as e:
+            if not is_locked_error(e) or attempt == max_attempts - 1:
+                raise
+        sleep(random.uniform(0, delay))
+        delay = min(2 * delay, max_delay)
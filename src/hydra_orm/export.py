@@ -0,0 +1,163 @@
+import contextlib
+import enum
+import itertools
+import json
+import pathlib
+
+import sqlalchemy as sa
+
+from hydra_orm import orm
+
+
+EXPORT_CHUNK_SIZE = 1000
+
+
+def _target(table):
+    return f'{table.__module__}.{table.__qualname__}'
+
+
+def _export_value(value):
+    if isinstance(value, enum.Enum):
+        return value.name
+    return value
+
+
+def flatten_config(row, prefix=''):
+    # one-to-many fields become dotted keys and many-to-many fields become
+    # lists of flattened configs, each with its _target_
+    plan = row.__table_plan__
+    record = {f'{prefix}_target_': _target(row.__class__)}
+    for k in plan.columns:
+        record[f'{prefix}{k}'] = _export_value(getattr(row, k))
+    for k in plan.one_to_many:
+        v = getattr(row, k)
+        if v is None:
+            record[f'{prefix}{k}'] = None
+        else:
+            record.update(flatten_config(v, prefix=f'{prefix}{k}.'))
+    for k in plan.many_to_many:
+        record[f'{prefix}{k}'] = [flatten_config(v) for v in getattr(row, k)]
+    return record
+
+
+def _prune(cfg):
+    # Parquet pads the configs of a chunk to the same columns with nulls, so
+    # nulls of fields that the config's table does not have are dropped.
+    if cfg.get('_target_') is None:
+        return None
+    plan = orm.locate_table(cfg['_target_']).__table_plan__
+    return {k: v for k, v in cfg.items() if k == '_target_' or k in plan.fields or v is not None}
+
+
+def unflatten_config(record):
+    cfg = {}
+    for key, value in record.items():
+        *path, k = key.split('.')
+        values = cfg
+        for kk in path:
+            if not isinstance(values.get(kk), dict):
+                values[kk] = {}
+            values = values[kk]
+        if isinstance(values.get(k), dict):
+            continue
+        values[k] = [unflatten_config(v) if isinstance(v, dict) else v for v in value] if isinstance(value, list) else value
+    return _unflattened(cfg)
+
+
+def _unflattened(cfg):
+    cfg = {k: _unflattened(v) if isinstance(v, dict) else v for k, v in cfg.items()}
+    return _prune(cfg)
+
+
+@contextlib.contextmanager
+def _jsonl_writer(path):
+    with open(path, 'w') as f:
+        def write(records):
+            for record in records:
+                f.write(json.dumps(record))
+                f.write('\n')
+        yield write
+
+
+@contextlib.contextmanager
+def _parquet_writer(path):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError('Exporting configs to Parquet requires pyarrow.') from e
+
+    # one file per chunk, since the columns of a chunk depend on the
+    # polymorphic subclasses that are in it
+    path.mkdir(parents=True, exist_ok=False)
+    part_indices = itertools.count()
+
+    def write(records):
+        keys = list(dict.fromkeys(k for record in records for k in record))
+        pq.write_table(pa.table({k: [record.get(k) for record in records] for k in keys}), path/f'part-{next(part_indices):05d}.parquet')
+    yield write
+
+
+def _read_jsonl(path, batch_size):
+    with open(path) as f:
+        batch = []
+        for line in f:
+            batch.append(json.loads(line))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+
+def _read_parquet(path, batch_size):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError('Importing configs from Parquet requires pyarrow.') from e
+    for part in sorted(path.glob('part-*.parquet')):
+        for batch in pq.ParquetFile(part).iter_batches(batch_size=batch_size):
+            yield batch.to_pylist()
+
+
+EXPORT_FORMATS = {
+    '.jsonl': (_jsonl_writer, _read_jsonl),
+    '.parquet': (_parquet_writer, _read_parquet),
+}
+
+
+def _export_format(path):
+    if path.suffix not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown export format of {path}, expected one of the suffixes {sorted(EXPORT_FORMATS)}.')
+    return EXPORT_FORMATS[path.suffix]
+
+
+def export_configs(session, statement, path, chunk_size=EXPORT_CHUNK_SIZE):
+    # statement is a table or a select of one, like orm.select_configs(...).
+    # The rows are streamed chunk by chunk, and only the configs of one
+    # chunk are kept in memory.
+    path = pathlib.Path(path)
+    writer, _ = _export_format(path)
+    if isinstance(statement, orm.TableMetaclass):
+        statement = sa.select(statement)
+    n_configs = 0
+    with writer(path) as write:
+        result = session.scalars(statement.execution_options(yield_per=chunk_size))
+        for rows in result.partitions():
+            orm.load_configs(session, rows)
+            write([flatten_config(row) for row in rows])
+            n_configs += len(rows)
+    return n_configs
+
+
+def import_configs(session, path, batch_size=EXPORT_CHUNK_SIZE, upsert=False):
+    # the configs go through the deduplication of instantiate_and_insert_configs,
+    # so importing into a database that has some of them inserts only the others.
+    # Exported values are already transformed, so transform_* hooks are skipped.
+    path = pathlib.Path(path)
+    _, reader = _export_format(path)
+    n_configs = 0
+    for records in reader(path, batch_size):
+        orm.instantiate_and_insert_configs(session, [unflatten_config(record) for record in records], upsert=upsert, transform=False)
+        n_configs += len(records)
+    return n_configs
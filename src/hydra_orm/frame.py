@@ -0,0 +1,180 @@
+import dataclasses
+from dataclasses import dataclass
+import enum
+import typing
+
+import sqlalchemy as sa
+import sqlalchemy.orm as sa_orm
+
+from hydra_orm import orm
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError('Loading sweep frames requires numpy, which the frame extra installs: pip install hydra-orm[frame].') from e
+
+
+@dataclass
+class SweepFrame:
+    ids: np.ndarray
+    # dotted field name -> one value per row, NaN or None where a
+    # one-to-many field has no row
+    columns: typing.Dict[str, np.ndarray]
+    # dotted field name -> the names that the codes of an enum column index,
+    # code -1 is a missing value
+    categories: typing.Dict[str, typing.Tuple[str, ...]]
+    # dotted field name -> (offsets, ids), the ids of the rows related to
+    # row i are ids[offsets[i]:offsets[i + 1]]
+    many_to_many: typing.Dict[str, typing.Tuple[np.ndarray, np.ndarray]]
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _is_single_table(mapper):
+    return all(m.local_table is mapper.local_table for m in mapper.self_and_descendants)
+
+
+def _entity(table):
+    mapper = sa.inspect(table)
+    if len(list(mapper.self_and_descendants)) > 1 and not _is_single_table(mapper):
+        return sa_orm.with_polymorphic(table, '*', aliased=True, flat=True)
+    return sa_orm.aliased(table)
+
+
+def _entity_attr(entity, mapper, m, k):
+    # attributes of polymorphic subclasses are reached through the subclass
+    # on the with_polymorphic entity. The columns of single-table subclasses
+    # are taken from the aliased root table, as the subclass would restrict
+    # the rows to its own.
+    if m is mapper:
+        return getattr(entity, k)
+    if m.local_table is mapper.local_table:
+        return sa.inspect(entity).selectable.c[m.attrs[k].columns[0].key]
+    return getattr(getattr(entity, m.class_.__name__), k)
+
+
+def _onclause(entity, mapper, m, k, target_entity):
+    if m is not mapper and m.local_table is mapper.local_table:
+        (column, _), = m.attrs[k].local_remote_pairs
+        return _entity_attr(entity, mapper, m, column.key) == target_entity.id
+    return _entity_attr(entity, mapper, m, k).of_type(target_entity)
+
+
+def _frame_fields(table):
+    mapper = sa.inspect(table)
+    columns = {}
+    one_to_many = {}
+    many_to_many = {}
+    for m in mapper.self_and_descendants:
+        for f in dataclasses.fields(m.class_):
+            if orm.SQLALCHEMY_DATACLASS_METADATA_KEY not in f.metadata or f.metadata.get('omegaconf_ignore', False):
+                continue
+            prop = m.attrs[f.name]
+            if prop.parent is not m:
+                continue
+            kind = f.metadata.get(orm.RELATION_METADATA_KEY, orm.COLUMN)
+            fields = dict(column=columns, one_to_many=one_to_many, many_to_many=many_to_many)[kind]
+            fields.setdefault(f.name, []).append((m, prop))
+    return mapper, columns, one_to_many, many_to_many
+
+
+class _FrameQuery:
+    def __init__(self, table):
+        self.entity = _entity(table)
+        self.columns = {}
+        self.enums = {}
+        self.joins = []
+        self.many_to_many = {}
+        self._add(table, self.entity, '', (table,))
+
+    def _add(self, table, entity, prefix, path):
+        mapper, columns, one_to_many, many_to_many = _frame_fields(table)
+        if len(list(mapper.self_and_descendants)) > 1:
+            self.columns[f'{prefix}_target_'] = _entity_attr(entity, mapper, mapper, mapper.polymorphic_on.key)
+            self.enums[f'{prefix}_target_'] = tuple(m.polymorphic_identity for m in mapper.self_and_descendants)
+        for k, props in columns.items():
+            # subclasses of a single-table hierarchy share columns of the same name
+            attrs = list({id(a): a for a in (_entity_attr(entity, mapper, m, k) for m, _ in props)}.values())
+            self.columns[f'{prefix}{k}'] = attrs[0] if len(attrs) == 1 else sa.func.coalesce(*attrs)
+            column_type = props[0][1].columns[0].type
+            if isinstance(column_type, sa.Enum):
+                self.enums[f'{prefix}{k}'] = tuple(column_type.enums)
+        for k, props in many_to_many.items():
+            for m, prop in props:
+                self.many_to_many[f'{prefix}{k}'] = (_entity_attr(entity, mapper, m, 'id'), prop)
+        for k, props in one_to_many.items():
+            for m, prop in props:
+                target = prop.mapper.class_
+                # references back to a table of the path would be expanded forever
+                if any(issubclass(target, t) or issubclass(t, target) for t in path):
+                    continue
+                target_entity = _entity(target)
+                self.joins.append((target_entity, _onclause(entity, mapper, m, k, target_entity)))
+                self._add(target, target_entity, f'{prefix}{k}.', (*path, target))
+
+    def _select(self, root_ids, *columns):
+        statement = sa.select(*columns).select_from(self.entity)
+        for target_entity, onclause in self.joins:
+            statement = statement.outerjoin(target_entity, onclause)
+        return statement.where(self.entity.id.in_(root_ids))
+
+    def select(self, root_ids):
+        return self._select(
+            root_ids,
+            self.entity.id,
+            *(c.label(k) for k, c in self.columns.items()),
+            *(owner_id.label(f'{k}.owner_id') for k, (owner_id, _) in self.many_to_many.items()),
+        ).order_by(self.entity.id)
+
+    def select_many_to_many(self, root_ids, k):
+        owner_id, prop = self.many_to_many[k]
+        owner_column = prop.synchronize_pairs[0][1]
+        member_column = prop.secondary_synchronize_pairs[0][1]
+        return (
+            sa.select(owner_column, member_column)
+            .where(owner_column.in_(self._select(root_ids, owner_id)))
+            .order_by(owner_column, member_column)
+        )
+
+
+def _to_array(values, categories=None):
+    if categories is not None:
+        codes = {name: i for i, name in enumerate(categories)}
+        return np.array([-1 if v is None else codes[v.name if isinstance(v, enum.Enum) else v] for v in values], dtype=np.int64)
+    if any(v is None for v in values):
+        if all(v is None or isinstance(v, (int, float)) for v in values):
+            return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        return np.array(values, dtype=object)
+    return np.array(values)
+
+
+def load_sweep_frame(session, statement):
+    # statement is a table or a select of one, like orm.select_configs(...).
+    # Columns of the table and of the tables reached through its
+    # OneToManyField chains are loaded with one query, and each
+    # ManyToManyField with one more. Fields without a column and fields
+    # with omegaconf_ignore are left out.
+    if isinstance(statement, orm.TableMetaclass):
+        statement = sa.select(statement)
+    table = statement.column_descriptions[0]['entity']
+    root_ids = statement.with_only_columns(table.id).order_by(None)
+
+    frame_query = _FrameQuery(table)
+    rows = session.execute(frame_query.select(root_ids)).all()
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    columns = {
+        k: _to_array([row[1 + i] for row in rows], frame_query.enums.get(k))
+        for i, k in enumerate(frame_query.columns)
+    }
+    many_to_many = {}
+    for i, k in enumerate(frame_query.many_to_many, start=1 + len(frame_query.columns)):
+        members = {}
+        for owner_id, member_id in session.execute(frame_query.select_many_to_many(root_ids, k)):
+            members.setdefault(owner_id, []).append(member_id)
+        counts = [len(members.get(row[i], ())) for row in rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        member_ids = np.array([member_id for row in rows for member_id in members.get(row[i], ())], dtype=np.int64)
+        many_to_many[k] = (offsets, member_ids)
+    return SweepFrame(ids=ids, columns=columns, categories=dict(frame_query.enums), many_to_many=many_to_many)
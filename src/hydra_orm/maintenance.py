@@ -0,0 +1,643 @@
+import argparse
+from dataclasses import dataclass, field
+import importlib
+import typing
+
+import sqlalchemy as sa
+import sqlalchemy.orm as sa_orm
+
+from hydra_orm import db, orm
+
+
+def _mappers():
+    # tables in the order they were defined, which mostly puts referenced
+    # tables first, and the classes of a hierarchy from the root down
+    tables = {t: i for i, t in enumerate(orm.mapper_registry.metadata.tables.values())}
+    return sorted(
+        (m for m in orm.mapper_registry.mappers if hasattr(m.class_, '__table_plan__')),
+        key=lambda m: (tables[m.base_mapper.local_table], len(list(m.iterate_to_root())), m.class_.__name__),
+    )
+
+
+def _hierarchy_tables(mapper):
+    return list(dict.fromkeys(m.local_table for m in mapper.base_mapper.self_and_descendants))
+
+
+def _table_mappers():
+    return {m.local_table: m.base_mapper for m in orm.mapper_registry.mappers}
+
+
+def _references(mapper):
+    # the foreign key columns of other rows that point at rows of the
+    # hierarchy of mapper, without the ids of joined-inheritance subclasses
+    tables = _hierarchy_tables(mapper)
+    return [
+        c for t in orm.mapper_registry.metadata.tables.values() for c in t.columns
+        if any(fk.column.table in tables for fk in c.foreign_keys) and not (c.primary_key and t in tables)
+    ]
+
+
+def _chunks(values):
+    values = list(values)
+    for chunk_start in range(0, len(values), orm.BULK_QUERY_CHUNK_SIZE):
+        yield values[chunk_start:chunk_start + orm.BULK_QUERY_CHUNK_SIZE]
+
+
+def _many_to_many_members(session, table, row_ids):
+    # row id -> the sorted ids of the many-to-many rows of each field, as
+    # saved in the association tables
+    mapper = sa.inspect(table)
+    members = {row_id: {k: [] for k in table.__table_plan__.many_to_many} for row_id in row_ids}
+    for k in table.__table_plan__.many_to_many:
+        prop = mapper.relationships[k]
+        owner_column, member_column = prop.synchronize_pairs[0][1], prop.secondary_synchronize_pairs[0][1]
+        for chunk in _chunks(row_ids):
+            for owner_id, member_id in session.execute(sa.select(owner_column, member_column).where(owner_column.in_(chunk))):
+                members[owner_id][k].append(member_id)
+    return {row_id: tuple(tuple(sorted(ids)) for ids in v.values()) for row_id, v in members.items()}
+
+
+def _duplicate_groups(session, table):
+    # rows are duplicates when they have the same values in the columns that
+    # the inserts deduplicate by: the columns, the ids of one-to-many rows,
+    # the digests of many-to-many rows and the polymorphic identity. Stored
+    # digests can be stale, so the candidates are split by the many-to-many
+    # rows they have in the association tables.
+    columns = [getattr(table, k) for k in orm.deduplication_column_names(table)]
+    statement = sa.select(table.id, *columns, sa.func.count().over(partition_by=columns).label('n'))
+    if (polymorphic_identity := table.__table_plan__.polymorphic_identity) is not None:
+        statement = statement.where(getattr(table, f'{orm.SQLALCHEMY_DATACLASS_METADATA_KEY}_inheritance') == polymorphic_identity)
+    counted = statement.subquery()
+    candidates = session.execute(sa.select(*list(counted.c)[:-1]).where(counted.c.n > 1).order_by(counted.c.id)).all()
+    members = _many_to_many_members(session, table, [row_id for row_id, *_ in candidates])
+    groups = {}
+    for row_id, *values in candidates:
+        groups.setdefault((tuple(values), members[row_id]), []).append(row_id)
+    return [(ids[0], ids[1:]) for ids in groups.values() if len(ids) > 1]
+
+
+def find_duplicates(session):
+    # table name -> (kept id, duplicate ids) of every group of duplicate rows,
+    # with one query per table. Rows that only become duplicates once the
+    # rows they reference are merged are found by merge_duplicates.
+    duplicates = {}
+    for mapper in _mappers():
+        if len(groups := _duplicate_groups(session, mapper.class_)) > 0:
+            duplicates[mapper.class_.__name__] = groups
+    return duplicates
+
+
+def _add(counts, k, n):
+    if n > 0:
+        counts[k] = counts.get(k, 0) + n
+
+
+@dataclass
+class MergeReport:
+    # table name -> (kept id, merged ids) of every group of duplicate rows
+    duplicates: typing.Dict[str, typing.List[typing.Tuple[int, typing.List[int]]]] = field(default_factory=dict)
+    # 'table.column' -> number of rows whose foreign key was repointed to a kept row
+    repointed: typing.Dict[str, int] = field(default_factory=dict)
+    # table name -> number of deleted rows
+    deleted: typing.Dict[str, int] = field(default_factory=dict)
+    # table name -> number of rows whose many-to-many digests or fingerprint were recomputed
+    rehashed: typing.Dict[str, int] = field(default_factory=dict)
+
+
+def _many_to_many_digests():
+    # association table -> (owner mapper, field name, owner column, member column)
+    digests = {}
+    for mapper in _mappers():
+        for k in mapper.class_.__table_plan__.many_to_many:
+            prop = mapper.relationships[k]
+            if prop.parent is mapper:
+                digests[prop.secondary] = (mapper, k, prop.synchronize_pairs[0][1], prop.secondary_synchronize_pairs[0][1])
+    return digests
+
+
+def _set_digests(session, association_table, owner_ids, digests):
+    # sets the many-to-many digests of the owner rows from the rows they have
+    # in the association table, like the inserts compute them
+    mapper, k, owner_column, member_column = digests[association_table]
+    digest_column = mapper.columns[f'{k}_digest']
+    for chunk in _chunks(owner_ids):
+        members = {owner_id: [] for owner_id in chunk}
+        for owner_id, member_id in session.execute(sa.select(owner_column, member_column).where(owner_column.in_(chunk))):
+            members[owner_id].append(member_id)
+        session.execute(
+            sa.update(digest_column.table)
+            .where(digest_column.table.c.id.in_(chunk))
+            .values({digest_column.key: sa.case({owner_id: orm.ids_digest(ids) for owner_id, ids in members.items()}, value=digest_column.table.c.id)})
+        )
+
+
+def _update_digests(session, association_table, owner_ids, report, stale, digests):
+    mapper = digests[association_table][0]
+    _set_digests(session, association_table, owner_ids, digests)
+    _add(report.rehashed, mapper.class_.__name__, len(owner_ids))
+    stale.setdefault(mapper.base_mapper, set()).update(owner_ids)
+
+
+def _repoint_association(session, column, merged_ids, report, stale, digests):
+    association_table = column.table
+    other_column, = (c for c in association_table.primary_key.columns if c is not column)
+    changed_owner_ids = set()
+    for chunk in _chunks(merged_ids):
+        pairs = session.execute(sa.select(other_column, column).where(column.in_(chunk))).all()
+        if len(pairs) == 0:
+            continue
+        session.execute(sa.delete(association_table).where(column.in_(chunk)))
+        # a row that had both a kept row and its duplicate keeps one association
+        repointed = {(other_id, merged_ids[row_id]) for other_id, row_id in pairs}
+        existing = set(session.execute(
+            sa.select(other_column, column)
+            .where(other_column.in_({other_id for other_id, _ in repointed}))
+            .where(column.in_({kept_id for _, kept_id in repointed}))
+        ).all())
+        inserts = [{other_column.key: other_id, column.key: kept_id} for other_id, kept_id in repointed - existing]
+        if len(inserts) > 0:
+            session.execute(sa.insert(association_table), inserts)
+        _add(report.repointed, f'{association_table.name}.{column.name}', len(inserts))
+        _add(report.deleted, association_table.name, len(pairs) - len(inserts))
+        changed_owner_ids.update(other_id for other_id, _ in pairs)
+    _, _, owner_column, _ = digests[association_table]
+    if other_column is owner_column and len(changed_owner_ids) > 0:
+        _update_digests(session, association_table, changed_owner_ids, report, stale, digests)
+
+
+def _repoint_column(session, column, merged_ids, report, stale, table_mappers):
+    table = column.table
+    for chunk in _chunks(merged_ids):
+        row_ids = session.scalars(sa.select(table.c.id).where(column.in_(chunk))).all()
+        if len(row_ids) == 0:
+            continue
+        session.execute(
+            sa.update(table)
+            .where(column.in_(chunk))
+            .values({column.key: sa.case({merged_id: merged_ids[merged_id] for merged_id in chunk}, value=column)})
+        )
+        _add(report.repointed, f'{table.name}.{column.name}', len(row_ids))
+        stale.setdefault(table_mappers[table], set()).update(row_ids)
+
+
+def _merge(session, mapper, groups, report, stale, digests, table_mappers):
+    merged_ids = {merged_id: kept_id for kept_id, ids in groups for merged_id in ids}
+    for column in _references(mapper):
+        if column.primary_key:
+            _repoint_association(session, column, merged_ids, report, stale, digests)
+        else:
+            _repoint_column(session, column, merged_ids, report, stale, table_mappers)
+    for table in reversed(_hierarchy_tables(mapper)):
+        for chunk in _chunks(merged_ids):
+            _add(report.deleted, table.name, session.execute(sa.delete(table).where(table.c.id.in_(chunk))).rowcount)
+    report.duplicates.setdefault(mapper.class_.__name__, []).extend(groups)
+
+
+def _update_fingerprints(session, stale, report):
+    session.expire_all()
+    for mapper, row_ids in stale.items():
+        table = mapper.class_
+        if not table.__table_options__['fingerprint']:
+            continue
+        fingerprint_column = table.__table__.c[orm.FINGERPRINT_COLUMN_NAME]
+        fingerprints = {}
+        for chunk in _chunks(sorted(row_ids)):
+            for row in session.scalars(sa.select(table).where(table.id.in_(chunk))):
+                if (new_fingerprint := orm.row_fingerprint(row)) != getattr(row, orm.FINGERPRINT_COLUMN_NAME):
+                    fingerprints[row.id] = new_fingerprint
+        # placeholders first, so that no row takes the old fingerprint of another one in between
+        for values in ({row_id: f'merging-{row_id}' for row_id in fingerprints}, fingerprints):
+            for chunk in _chunks(values):
+                session.execute(
+                    sa.update(table.__table__)
+                    .where(table.__table__.c.id.in_(chunk))
+                    .values({fingerprint_column.key: sa.case({row_id: values[row_id] for row_id in chunk}, value=table.__table__.c.id)})
+                )
+        _add(report.rehashed, table.__name__, len(fingerprints))
+    session.expire_all()
+
+
+def merge_duplicates(session):
+    # Merges every group of duplicate rows into the row with the smallest id:
+    # foreign keys and association rows pointing at the other rows are
+    # repointed to it, and the other rows are deleted. Repointing can make
+    # the referencing rows duplicates in turn, so tables are merged until no
+    # duplicates are left. Many-to-many digests and fingerprints of the
+    # repointed rows are recomputed. The caller commits.
+    report = MergeReport()
+    stale = {}
+    mappers = _mappers()
+    # the mapped classes do not change during a run
+    digests = _many_to_many_digests()
+    table_mappers = _table_mappers()
+    while True:
+        merged = False
+        for mapper in mappers:
+            if len(groups := _duplicate_groups(session, mapper.class_)) > 0:
+                _merge(session, mapper, groups, report, stale, digests, table_mappers)
+                merged = True
+        if not merged:
+            break
+    _update_fingerprints(session, stale, report)
+    return report
+
+
+GARBAGE_COLLECTION_BATCH_SIZE = 10_000
+
+
+def _outgoing(mapper):
+    # (column, owner column, target base mapper) of the foreign keys and
+    # association tables by which rows of the hierarchy of mapper reference
+    # other rows, without the ids of joined-inheritance subclasses
+    tables = _hierarchy_tables(mapper)
+    table_mappers = _table_mappers()
+    outgoing = [
+        (c, t.c.id, table_mappers[fk.column.table])
+        for t in tables for c in t.columns for fk in c.foreign_keys
+        if not (c.primary_key and fk.column.table in tables)
+    ]
+    for association_table, (owner, _, owner_column, member_column) in _many_to_many_digests().items():
+        if owner.base_mapper is mapper.base_mapper:
+            fk, = member_column.foreign_keys
+            outgoing.append((member_column, owner_column, table_mappers[fk.column.table]))
+    return outgoing
+
+
+def _reachable_mappers(roots):
+    reachable = {}
+    frontier = [sa.inspect(table).base_mapper for table in roots]
+    while len(frontier) > 0:
+        mapper = frontier.pop()
+        if mapper not in reachable:
+            reachable[mapper] = outgoing = _outgoing(mapper)
+            frontier.extend(target for _, _, target in outgoing)
+    return reachable
+
+
+def _reachable_ids(session, roots, outgoing):
+    # every row of the root tables is reachable, and so is every row that a
+    # reachable row references. Rows of the tables that are not collected
+    # are kept, so the rows they reference are reachable too. Only the newly
+    # reached ids of a hierarchy are followed, so every reference is queried
+    # once.
+    reachable = {mapper: set() for mapper in outgoing}
+    frontier = {}
+    for table in roots:
+        mapper = sa.inspect(table).base_mapper
+        frontier.setdefault(mapper, set()).update(session.scalars(sa.select(mapper.local_table.c.id)))
+    for mapper in dict.fromkeys(m.base_mapper for m in _mappers()):
+        if mapper in outgoing:
+            continue
+        for column, _, target in _outgoing(mapper):
+            if target in outgoing:
+                frontier.setdefault(target, set()).update(session.scalars(sa.select(column).where(column.is_not(None)).distinct()))
+    while len(frontier) > 0:
+        mapper, row_ids = frontier.popitem()
+        row_ids -= reachable[mapper]
+        reachable[mapper] |= row_ids
+        for column, owner_column, target in outgoing[mapper]:
+            for chunk in _chunks(row_ids):
+                target_ids = set(session.scalars(sa.select(column).where(owner_column.in_(chunk)).where(column.is_not(None))))
+                if len(target_ids := target_ids - reachable[target]) > 0:
+                    frontier.setdefault(target, set()).update(target_ids)
+    return reachable
+
+
+@dataclass
+class GarbageReport:
+    # root class name -> number of rows of its hierarchy that no root row reaches
+    unreachable: typing.Dict[str, int] = field(default_factory=dict)
+    # table name -> number of deleted rows, empty on a dry run
+    deleted: typing.Dict[str, int] = field(default_factory=dict)
+
+
+def _deletion_order(outgoing):
+    # hierarchies before the ones they reference through foreign keys or
+    # association tables, whatever order their classes were defined in. The
+    # references closing a cycle are left out, like in metadata.sorted_tables.
+    ordered = []
+    visited = set()
+
+    def visit(mapper):
+        if mapper in visited:
+            return
+        visited.add(mapper)
+        for _, _, target in outgoing[mapper]:
+            visit(target)
+        ordered.append(mapper)
+
+    for mapper in _mappers():
+        if mapper in outgoing:
+            visit(mapper)
+    return ordered[::-1]
+
+
+def _delete_rows(session, mapper, row_ids, report, digests):
+    for association_table, (owner, _, owner_column, _) in digests.items():
+        if owner.base_mapper is mapper:
+            _add(report.deleted, association_table.name, session.execute(sa.delete(association_table).where(owner_column.in_(row_ids))).rowcount)
+    # subclass tables first, as their ids reference the tables of their parents
+    for table in reversed(_hierarchy_tables(mapper)):
+        _add(report.deleted, table.name, session.execute(sa.delete(table).where(table.c.id.in_(row_ids))).rowcount)
+
+
+def collect_garbage(session, roots, dry_run=False, batch_size=GARBAGE_COLLECTION_BATCH_SIZE):
+    # Deletes the rows that cannot be reached from the rows of the root
+    # tables through one-to-many and many-to-many fields, like sub-configs
+    # whose configs were deleted. Only the tables that the root tables can
+    # reference are collected, and rows that other tables reference are
+    # kept. Each batch of rows is deleted and committed in
+    # its own transaction; no jobs should insert configs meanwhile, as they
+    # could reuse a row that is about to be deleted.
+    report = GarbageReport()
+    outgoing = _reachable_mappers(roots)
+    reachable = _reachable_ids(session, roots, outgoing)
+    root_mappers = {sa.inspect(table).base_mapper for table in roots}
+    digests = _many_to_many_digests()
+    # referencing rows are deleted before the rows they reference: tables in
+    # dependency order, and newer rows of a table first
+    for mapper in [m for m in _deletion_order(outgoing) if m not in root_mappers]:
+        row_ids = set(session.scalars(sa.select(mapper.local_table.c.id))) - reachable[mapper]
+        _add(report.unreachable, mapper.class_.__name__, len(row_ids))
+        if dry_run:
+            continue
+        row_ids = sorted(row_ids, reverse=True)
+        for batch_start in range(0, len(row_ids), batch_size):
+            for chunk in _chunks(row_ids[batch_start:batch_start + batch_size]):
+                _delete_rows(session, mapper, chunk, report, digests)
+            session.commit()
+    if not dry_run and (row_cache := session.info.get(orm.ROW_CACHE_SESSION_INFO_KEY)) is not None:
+        row_cache.clear()
+    return report
+
+
+def _column_fields(table):
+    # column -> [(mapper, field name)] of the columns of table that the
+    # fields of the classes saved in it define. The subclasses of a
+    # single-table hierarchy can share a column.
+    fields = {}
+    for mapper in orm.mapper_registry.mappers:
+        if mapper.local_table is not table or not hasattr(mapper.class_, '__table_plan__'):
+            continue
+        plan = mapper.class_.__table_plan__
+        for k in plan.persisted:
+            if mapper.attrs[k].parent is not mapper:
+                continue
+            column_key = dict(column=k, one_to_many=f'{k}_id', many_to_many=f'{k}_digest')[plan.kinds[k]]
+            fields.setdefault(mapper.columns[column_key], []).append((mapper, k))
+    return fields
+
+
+def _default_row(session, value):
+    return value if value is None or orm.is_row(value) else orm.instantiate_and_insert_config(session, value)
+
+
+def _add_column(connection, column, default):
+    dialect = connection.dialect
+    preparer = dialect.identifier_preparer
+    spec = [preparer.format_column(column), column.type.compile(dialect=dialect)]
+    if default is not None:
+        spec.append(f"DEFAULT {sa.literal(default, column.type).compile(dialect=dialect, compile_kwargs=dict(literal_binds=True))}")
+    if not column.nullable:
+        spec.append('NOT NULL')
+    for fk in column.foreign_keys:
+        spec.append(f'REFERENCES {preparer.format_table(fk.column.table)} ({preparer.format_column(fk.column)})')
+    connection.exec_driver_sql(f"ALTER TABLE {preparer.format_table(column.table)} ADD COLUMN {' '.join(spec)}")
+
+
+def _is_single_table_subclass(mapper):
+    return mapper.local_table is mapper.base_mapper.local_table and mapper is not mapper.base_mapper
+
+
+def _class_rows(mapper):
+    # the ids of the rows of the class of mapper and its subclasses
+    statement = sa.select(mapper.local_table.c.id)
+    if mapper.polymorphic_on is not None and _is_single_table_subclass(mapper):
+        statement = statement.where(mapper.polymorphic_on.in_([m.polymorphic_identity for m in mapper.self_and_descendants]))
+    return statement
+
+
+def _has_saved_association(mapper, k, report):
+    # whether the association table of a many-to-many field was there before
+    # its digest column, as in databases of versions without digest columns
+    plan = mapper.class_.__table_plan__
+    return plan.kinds[k] == orm.MANY_TO_MANY and mapper.relationships[k].secondary.name not in report.created_tables
+
+
+def _column_default(session, column, mapper, k, report):
+    # the value of column for the saved rows of the class of mapper, and the
+    # rows of the default of a many-to-many field. The saved rows of a field
+    # with a saved association table keep their many-to-many rows, and only
+    # the rows without any take the digest of an empty list.
+    table = mapper.class_
+    kind = table.__table_plan__.kinds[k]
+    if _has_saved_association(mapper, k, report):
+        return orm.ids_digest([]), []
+    value = orm.field_default(session, table, k)
+    rows = []
+    if kind == orm.ONE_TO_MANY:
+        value = None if (row := _default_row(session, value)) is None else row.id
+    elif kind == orm.MANY_TO_MANY:
+        rows = [_default_row(session, v) for v in value]
+        value = orm.many_to_many_digest(rows)
+    if value is None and not column.nullable:
+        raise ValueError(f'Cannot add the column {column.table.name}.{column.name} to saved rows, as the field {table.__name__}.{k} has no default.')
+    return value, rows
+
+
+def _add_field_column(session, column, fields, report, rehashed_mappers):
+    defaults = [(mapper, k, *_column_default(session, column, mapper, k, report)) for mapper, k in fields]
+    session.flush()
+    if _is_single_table_subclass(fields[0][0]):
+        # the column is shared with the rows of the other classes saved in the
+        # table, which keep NULL, so only the rows of the classes of the
+        # fields take their defaults
+        _add_column(session.connection(), column, None)
+        for mapper, _, value, _ in defaults:
+            if value is not None:
+                session.execute(sa.update(column.table).where(column.table.c.id.in_(_class_rows(mapper))).values({column.key: value}))
+    else:
+        _add_column(session.connection(), column, defaults[0][2])
+    report.added_columns.append(f'{column.table.name}.{column.name}')
+    for mapper, k, _, rows in defaults:
+        if _has_saved_association(mapper, k, report):
+            digests = _many_to_many_digests()
+            association_table = mapper.relationships[k].secondary
+            _, _, owner_column, _ = digests[association_table]
+            _set_digests(session, association_table, session.scalars(sa.select(owner_column).distinct()).all(), digests)
+        if len(rows) > 0:
+            prop = mapper.relationships[k]
+            owner_column = prop.synchronize_pairs[0][1]
+            member_column = prop.secondary_synchronize_pairs[0][1]
+            for row in rows:
+                session.execute(sa.insert(prop.secondary).from_select(
+                    [owner_column, member_column], _class_rows(mapper).add_columns(sa.literal(row.id)),
+                ))
+        if mapper.class_.__table_options__['fingerprint']:
+            rehashed_mappers.append(mapper)
+
+
+FINGERPRINT_BATCH_SIZE = 10_000
+
+
+def _rehash_class_rows(session, mapper, report, batch_size):
+    # Recomputes the fingerprints of the rows of the class of mapper and its
+    # subclasses, which loads every row through Python. Rows are read in id
+    # order, batch_size at a time, and every batch is updated and committed
+    # on its own, so neither the rows nor the transaction grow with the
+    # table. A new column adds a key to the hashed values, so a new
+    # fingerprint never equals the old one of another row, and each one is
+    # written once.
+    table = mapper.class_
+    root_table = mapper.base_mapper.local_table
+    fingerprint_column = root_table.c[orm.FINGERPRINT_COLUMN_NAME]
+    last_id = 0
+    while len(rows := session.scalars(sa.select(table).where(table.id > last_id).order_by(table.id).limit(batch_size)).all()) > 0:
+        last_id = rows[-1].id
+        fingerprints = {row.id: f for row in rows if (f := orm.row_fingerprint(row)) != getattr(row, orm.FINGERPRINT_COLUMN_NAME)}
+        for chunk in _chunks(fingerprints):
+            session.execute(
+                sa.update(root_table)
+                .where(root_table.c.id.in_(chunk))
+                .values({fingerprint_column.key: sa.case({row_id: fingerprints[row_id] for row_id in chunk}, value=root_table.c.id)})
+            )
+        _add(report.rehashed, mapper.base_mapper.class_.__name__, len(fingerprints))
+        session.commit()
+
+
+@dataclass
+class SchemaSyncReport:
+    created_tables: typing.List[str] = field(default_factory=list)
+    # 'table.column' of the added columns
+    added_columns: typing.List[str] = field(default_factory=list)
+    created_indexes: typing.List[str] = field(default_factory=list)
+    # table name -> number of rows whose fingerprint changed with the added columns
+    rehashed: typing.Dict[str, int] = field(default_factory=dict)
+
+
+def sync_schema(session, batch_size=FINGERPRINT_BATCH_SIZE):
+    # Brings the database up to date with the tables defined in Python, in
+    # place: missing tables are created, including the association tables of
+    # new many-to-many fields, and the columns of new fields are added with
+    # ALTER TABLE ADD COLUMN. A new column gets the field's default as its
+    # server default, so saved rows take the value that a config without the
+    # field saves, and the lookups of such configs keep finding them. The
+    # defaults of new one-to-many and many-to-many fields are inserted first.
+    # The digest columns of many-to-many fields whose association tables are
+    # saved, like in databases of versions without digest columns, are
+    # computed from the saved many-to-many rows instead.
+    # Missing indexes are created, and indexes whose columns changed are
+    # recreated. Columns are never dropped or changed. The fingerprints of
+    # the rows of fingerprinted classes with new columns are recomputed last,
+    # which reads the whole table through Python and commits every
+    # batch_size rows, the schema changes with the first batch. The caller
+    # commits the rest.
+    report = SchemaSyncReport()
+    rehashed_mappers = []
+    connection = session.connection()
+    inspector = sa.inspect(connection)
+    # tables in the order they were defined, so that the rows of the defaults
+    # of one-to-many fields are inserted into up-to-date tables
+    for table in orm.mapper_registry.metadata.tables.values():
+        if not inspector.has_table(table.name):
+            table.create(connection)
+            report.created_tables.append(table.name)
+            continue
+        column_names = {c['name'] for c in inspector.get_columns(table.name)}
+        column_fields = _column_fields(table)
+        for column in table.columns:
+            if column.name in column_names:
+                continue
+            if column not in column_fields:
+                raise ValueError(f'Cannot add the column {table.name}.{column.name} to saved rows, as no field with a default defines it.')
+            _add_field_column(session, column, column_fields[column], report, rehashed_mappers)
+        indexes = {i['name']: i['column_names'] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if indexes.get(index.name) == [c.name for c in index.columns]:
+                continue
+            if index.name in indexes:
+                connection.execute(sa.schema.DropIndex(index))
+            index.create(connection)
+            report.created_indexes.append(index.name)
+    # the rows of subclasses are rehashed with the rows of their parents
+    for mapper in dict.fromkeys(rehashed_mappers):
+        if not any(m in rehashed_mappers for m in mapper.iterate_to_root() if m is not mapper):
+            _rehash_class_rows(session, mapper, report, batch_size)
+    return report
+
+
+def _print_counts(title, counts):
+    for k, n in counts.items():
+        print(f'{title} {k}: {n}')
+
+
+def _duplicates_command(session, args):
+    if not args.merge:
+        duplicates = find_duplicates(session)
+        for k, groups in duplicates.items():
+            print(f'{k}: {sum(len(ids) for _, ids in groups)} duplicates in {len(groups)} groups')
+        return 1 if len(duplicates) > 0 else 0
+    report = merge_duplicates(session)
+    session.commit()
+    for k, groups in report.duplicates.items():
+        print(f'{k}: merged {sum(len(ids) for _, ids in groups)} duplicates into {len(groups)} rows')
+    _print_counts('repointed', report.repointed)
+    _print_counts('deleted', report.deleted)
+    _print_counts('rehashed', report.rehashed)
+    return 0
+
+
+def _gc_command(session, args):
+    report = collect_garbage(session, [orm.locate_table(root) for root in args.roots], dry_run=args.dry_run)
+    for k, n in report.unreachable.items():
+        print(f'{k}: {n} unreachable rows')
+    _print_counts('deleted', report.deleted)
+    return 0
+
+
+def _sync_schema_command(session, args):
+    report = sync_schema(session)
+    session.commit()
+    for title, names in (('created table', report.created_tables), ('added column', report.added_columns), ('created index', report.created_indexes)):
+        for name in names:
+            print(f'{title} {name}')
+    _print_counts('rehashed', report.rehashed)
+    return 0
+
+
+def _writes(args):
+    # the commands that only report read in deferred transactions, which do
+    # not wait for the jobs writing meanwhile
+    if args.command is _duplicates_command:
+        return args.merge
+    if args.command is _gc_command:
+        return not args.dry_run
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='hydra-orm', description='Maintenance of hydra-orm databases.')
+    parser.add_argument('--import', dest='modules', action='append', default=[], help='module defining tables, can be repeated')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    duplicates_parser = subparsers.add_parser('duplicates', help='report duplicate rows, exits with 1 if there are any')
+    duplicates_parser.add_argument('db_url')
+    duplicates_parser.add_argument('--merge', action='store_true', help='merge the duplicates instead of reporting them')
+    duplicates_parser.set_defaults(command=_duplicates_command)
+    gc_parser = subparsers.add_parser('gc', help='delete the rows that the rows of the root tables do not reach')
+    gc_parser.add_argument('db_url')
+    gc_parser.add_argument('--root', dest='roots', action='append', required=True, help='root table like cs.Config, can be repeated')
+    gc_parser.add_argument('--dry-run', action='store_true', help='only report the unreachable rows')
+    gc_parser.set_defaults(command=_gc_command)
+    sync_schema_parser = subparsers.add_parser('sync-schema', help='add the missing tables, columns and indexes in place')
+    sync_schema_parser.add_argument('db_url')
+    sync_schema_parser.set_defaults(command=_sync_schema_command)
+    args = parser.parse_args(argv)
+
+    for module in args.modules:
+        importlib.import_module(module)
+    engine = db.create_engine(args.db_url)
+    try:
+        with sa_orm.Session(db.writing(engine) if _writes(args) else engine) as session:
+            return args.command(session, args)
+    finally:
+        engine.dispose()
@@ -1,12 +1,24 @@
+import collections
+import contextlib
 import dataclasses
 from dataclasses import dataclass, field
 import enum
 import functools
+import hashlib
+import inspect
+import json
+import threading
+import time
+import types
 import typing
+import weakref
 
 import hydra
+from hydra.core.override_parser.overrides_parser import OverridesParser
 import omegaconf
 import sqlalchemy as sa
+import sqlalchemy.dialects.postgresql
+import sqlalchemy.dialects.sqlite
 import sqlalchemy.orm as sa_orm
 
 
@@ -16,6 +28,9 @@ mapper_registry = sa_orm.registry()
 SQLALCHEMY_DATACLASS_METADATA_KEY = 'sa'
 
 
+FINGERPRINT_COLUMN_NAME = f'{SQLALCHEMY_DATACLASS_METADATA_KEY}_fingerprint'
+
+
 ColumnRequired = functools.partial(sa.Column, nullable=False)
 
 
@@ -52,21 +67,107 @@ class ManyToManyField:
     m2m_table_name: str = None
 
 
+RELATION_METADATA_KEY = 'relation'
+
+
+COLUMN = 'column'
+ONE_TO_MANY = 'one_to_many'
+MANY_TO_MANY = 'many_to_many'
+NONPERSISTED = 'nonpersisted'
+
+
+@dataclass(frozen=True)
+class TablePlan:
+    fields: typing.Dict[str, dataclasses.Field]
+    kinds: typing.Dict[str, str]
+    transforms: typing.Dict[str, typing.Callable]
+    batch_transforms: typing.Dict[str, typing.Callable]
+    polymorphic_identity: typing.Optional[str]
+    columns: typing.Tuple[str, ...]
+    one_to_many: typing.Tuple[str, ...]
+    many_to_many: typing.Tuple[str, ...]
+    persisted: typing.Tuple[str, ...]
+
+    @classmethod
+    def from_table(cls, table):
+        fields = {}
+        kinds = {}
+        for f in dataclasses.fields(table):
+            if not f.init or f.name in ('_target_', 'defaults'):
+                continue
+            fields[f.name] = f
+            if SQLALCHEMY_DATACLASS_METADATA_KEY not in f.metadata:
+                kinds[f.name] = NONPERSISTED
+            else:
+                kinds[f.name] = f.metadata.get(RELATION_METADATA_KEY, COLUMN)
+        transforms = {
+            k: getattr(table, f'transform_{k}') for k, kind in kinds.items()
+            if kind != NONPERSISTED and callable(getattr(table, f'transform_{k}', None))
+        }
+        batch_transforms = {
+            k: getattr(table, f'transform_many_{k}') for k, kind in kinds.items()
+            if kind != NONPERSISTED and callable(getattr(table, f'transform_many_{k}', None))
+        }
+        for k in transforms.keys() & batch_transforms.keys():
+            raise ValueError(f'The table {table.__name__} defines both transform_{k} and transform_many_{k}, please define only one of them.')
+        return cls(
+            fields=fields,
+            kinds=kinds,
+            transforms=transforms,
+            batch_transforms=batch_transforms,
+            polymorphic_identity=table.__mapper__.polymorphic_identity,
+            columns=tuple(k for k, kind in kinds.items() if kind == COLUMN),
+            one_to_many=tuple(k for k, kind in kinds.items() if kind == ONE_TO_MANY),
+            many_to_many=tuple(k for k, kind in kinds.items() if kind == MANY_TO_MANY),
+            persisted=tuple(k for k, kind in kinds.items() if kind != NONPERSISTED),
+        )
+
+
 def _db_row_hash(row):
     return hash(row.id)
 
 
+JOINED_TABLE_INHERITANCE = 'joined'
+SINGLE_TABLE_INHERITANCE = 'single'
+
+
+TABLE_OPTION_DEFAULTS = dict(
+    fingerprint=False,
+    indexes=True,
+    inheritance=JOINED_TABLE_INHERITANCE,
+)
+
+
+# table name of every table class, since the subclasses of single-table
+# hierarchies are saved in the table of their root
+_TABLE_NAMES = {}
+
+
+# tables with transform_many_* hooks. Configs are only searched for the
+# values of these hooks when there are any.
+_BATCH_TRANSFORM_TABLES = set()
+
+
 class TableMetaclass(type):
-    def __new__(cls, clsname, bases, attrs):
+    def __new__(cls, clsname, bases, attrs, **table_options):
         if len(bases) == 0:
             return super().__new__(cls, clsname, bases, attrs)
 
         if '__annotations__' not in attrs:
             _set_attribute(attrs, '__annotations__', {})
         attrs['__sa_dataclass_metadata_key__'] = SQLALCHEMY_DATACLASS_METADATA_KEY
-        _set_attribute(attrs, '__tablename__', clsname)
+        table_options = _resolve_table_options(clsname, bases, table_options)
+        _set_attribute(attrs, '__table_options__', table_options)
+        single_table = _is_single_table_subclass(bases)
+        tablename = bases[0].__table__.name if single_table else clsname
+        if not single_table:
+            _set_attribute(attrs, '__tablename__', clsname)
+        if _is_hierarchy_root(bases) and '__table_args__' not in attrs:
+            # ids are not reused after deletes, and IdAllocator reserves its
+            # blocks in the sqlite_sequence entry of AUTOINCREMENT tables
+            _set_attribute(attrs, '__table_args__', dict(sqlite_autoincrement=True))
         _set_typed_attribute(attrs, '_target_', str, field(default=f"{attrs['__module__']}.{clsname}", repr=False))
-        if 'id' not in attrs:
+        if 'id' not in attrs and not single_table:
             _set_typed_attribute(
                 attrs, 'id', int,
                 field(init=False, metadata={
@@ -75,6 +176,14 @@ class TableMetaclass(type):
                 })
             )
         _set_attribute(attrs, '__hash__', _db_row_hash)
+        if table_options['fingerprint'] and _is_hierarchy_root(bases):
+            _set_typed_attribute(
+                attrs, FINGERPRINT_COLUMN_NAME, str,
+                field(init=False, repr=False, metadata={
+                    SQLALCHEMY_DATACLASS_METADATA_KEY: ColumnRequired(sa.String(64), index=True, unique=True),
+                    'omegaconf_ignore': True,
+                })
+            )
 
         for k, v in list(attrs.items()):
             if isinstance(v, OneToManyField):
@@ -86,13 +195,22 @@ class TableMetaclass(type):
                         ' Please consider adding another table for an indirect reference.'
                     )
                 config_id_column = ColumnRequired if v.required else sa.Column
+                v_tablename = _TABLE_NAMES.get(v_config_name, v_config_name)
                 attrs[f'{k}_id'] = field(init=False, repr=False, metadata={
-                    SQLALCHEMY_DATACLASS_METADATA_KEY: config_id_column(v_config_name if v.column_name is None else v.column_name, sa.ForeignKey(f'{v_config_name}.id')),
+                    SQLALCHEMY_DATACLASS_METADATA_KEY: config_id_column(v_config_name if v.column_name is None else v.column_name, sa.ForeignKey(f'{v_tablename}.id')),
                     'omegaconf_ignore': True,
                 })
                 attrs['__annotations__'][f'{k}_id'] = int
 
-                config_field_kwargs = dict(metadata={SQLALCHEMY_DATACLASS_METADATA_KEY: sa_orm.relationship(v_config_name, foreign_keys=[attrs[f'{k}_id'].metadata[SQLALCHEMY_DATACLASS_METADATA_KEY]])})
+                relationship_kwargs = dict(foreign_keys=[attrs[f'{k}_id'].metadata[SQLALCHEMY_DATACLASS_METADATA_KEY]])
+                if v_tablename == tablename:
+                    # a reference to another class of the same single-table
+                    # hierarchy is a reference to the own table
+                    relationship_kwargs['remote_side'] = f'{v_config_name}.id'
+                config_field_kwargs = dict(metadata={
+                    SQLALCHEMY_DATACLASS_METADATA_KEY: sa_orm.relationship(v_config_name, **relationship_kwargs),
+                    RELATION_METADATA_KEY: ONE_TO_MANY,
+                })
                 if v.default_factory is not None and v.default is not None:
                     raise ValueError(f'For the {OneToManyField.__name__} field {clsname}.{k}, specify exactly one of default={v.default} or default_factory={v.default_factory}, not both.')
                 if v.default_factory is not None:
@@ -114,10 +232,15 @@ class TableMetaclass(type):
                 m2m_table = sa.Table(
                     f'{clsname}__{v_config_name}' if v.m2m_table_name is None else v.m2m_table_name,
                     mapper_registry.metadata,
-                    sa.Column(clsname, sa.ForeignKey(f'{clsname}.id'), primary_key=True),
-                    sa.Column(v_config_name, sa.ForeignKey(f'{v_config_name}.id'), primary_key=True),
+                    sa.Column(clsname, sa.ForeignKey(f'{tablename}.id'), primary_key=True),
+                    sa.Column(v_config_name, sa.ForeignKey(f'{_TABLE_NAMES.get(v_config_name, v_config_name)}.id'), primary_key=True),
                 )
-                config_field_kwargs = dict(metadata={SQLALCHEMY_DATACLASS_METADATA_KEY: sa_orm.relationship(v_config_name, secondary=m2m_table)})
+                if table_options['indexes']:
+                    sa.Index(f'ix_{m2m_table.name}_{v_config_name}', m2m_table.c[v_config_name])
+                config_field_kwargs = dict(metadata={
+                    SQLALCHEMY_DATACLASS_METADATA_KEY: sa_orm.relationship(v_config_name, secondary=m2m_table),
+                    RELATION_METADATA_KEY: MANY_TO_MANY,
+                })
                 if v.default_factory is not None and v.default is not None:
                     raise ValueError(f'For the {ManyToManyField.__name__} field {clsname}.{k}, specify exactly one of default={v.default} or default_factory={v.default_factory}, not both.')
                 if v.default_factory is not None:
@@ -126,11 +249,36 @@ class TableMetaclass(type):
                     config_field_kwargs['default'] = v.default
                 attrs[k] = field(**config_field_kwargs)
                 attrs['__annotations__'][k] = typing.List[v.config] if v.enforce_element_type else typing.List[typing.Any]
-        return mapper_registry.mapped(dataclass(super().__new__(cls, clsname, bases, attrs)))
+                # the lookups compare many-to-many lists by this digest of the
+                # sorted ids. maintenance.sync_schema adds the column to
+                # databases saved without it, computed from their association rows.
+                attrs[f'{k}_digest'] = field(init=False, repr=False, metadata={
+                    SQLALCHEMY_DATACLASS_METADATA_KEY: ColumnRequired(sa.String(64)),
+                    'omegaconf_ignore': True,
+                })
+                attrs['__annotations__'][f'{k}_digest'] = str
+        if single_table:
+            _share_single_table_columns(clsname, bases[0].__table__, attrs)
+        table = mapper_registry.mapped(dataclass(super().__new__(cls, clsname, bases, attrs)))
+        _TABLE_NAMES[clsname] = table.__table__.name
+        table.__table_plan__ = TablePlan.from_table(table)
+        if len(table.__table_plan__.batch_transforms) > 0:
+            _BATCH_TRANSFORM_TABLES.add(table)
+        _reaches_batch_transforms.cache_clear()
+        if table_options['indexes'] and not table_options['fingerprint']:
+            _add_deduplication_index(table)
+        if _is_hierarchy_root(bases):
+            sa.event.listen(table, 'load', _apply_overrides_on_load, propagate=True)
+            sa.event.listen(table, 'before_insert', _set_many_to_many_digests_before_insert, propagate=True)
+            sa.event.listen(table, 'before_update', _set_many_to_many_digests_before_update, propagate=True)
+        if table_options['fingerprint'] and _is_hierarchy_root(bases):
+            sa.event.listen(table, 'before_insert', _set_fingerprint_before_insert, propagate=True)
+            sa.event.listen(table, 'before_update', _set_fingerprint_before_update, propagate=True)
+        return table
 
 
 class InheritableTableMetaclass(TableMetaclass):
-    def __new__(cls, clsname, bases, attrs):
+    def __new__(cls, clsname, bases, attrs, **table_options):
         if len(bases) == 0:
             return super().__new__(cls, clsname, bases, attrs)
         if '__mapper_args__' not in attrs:
@@ -149,7 +297,7 @@ class InheritableTableMetaclass(TableMetaclass):
                     'omegaconf_ignore': True,
                 })
             )
-        else:
+        elif not _is_single_table_subclass(bases):
             _set_typed_attribute(
                 attrs, 'id', int,
                 field(init=False, metadata={
@@ -158,7 +306,7 @@ class InheritableTableMetaclass(TableMetaclass):
                 })
             )
             attrs['__mapper_args__']['inherit_condition'] = attrs['id'].metadata[SQLALCHEMY_DATACLASS_METADATA_KEY] == bases[0].id
-        return super().__new__(cls, clsname, bases, attrs)
+        return super().__new__(cls, clsname, bases, attrs, **table_options)
 
 
 class Table(metaclass=TableMetaclass):
@@ -169,6 +317,83 @@ class InheritableTable(metaclass=InheritableTableMetaclass):
     pass
 
 
+def deduplication_column_names(table):
+    plan = table.__table_plan__
+    names = [
+        *plan.columns,
+        *(f'{k}_id' for k in plan.one_to_many),
+        *(f'{k}_digest' for k in plan.many_to_many),
+    ]
+    if plan.polymorphic_identity is not None:
+        names.insert(0, f'{SQLALCHEMY_DATACLASS_METADATA_KEY}_inheritance')
+    return names
+
+
+def _deduplication_columns(table):
+    mapper = sa.inspect(table)
+    return [mapper.columns[k] for k in deduplication_column_names(table)]
+
+
+def _add_deduplication_index(table):
+    # the lookup filters of joined-inheritance subclasses span several tables,
+    # so every table gets an index over the deduplication columns it holds.
+    # The classes of a single-table hierarchy each get one on the shared table.
+    columns = [c for c in _deduplication_columns(table) if c.table is table.__table__]
+    if len(columns) > 0:
+        sa.Index(f'ix_{table.__name__}_deduplication', *columns)
+
+
+def _is_hierarchy_root(bases):
+    return bases[0] is Table or bases[0] is InheritableTable
+
+
+def _resolve_table_options(clsname, bases, table_options):
+    unknown_options = set(table_options) - set(TABLE_OPTION_DEFAULTS)
+    if len(unknown_options) > 0:
+        raise ValueError(f'Unknown table options for the table {clsname}: {sorted(unknown_options)}.')
+    if _is_hierarchy_root(bases):
+        table_options = {**TABLE_OPTION_DEFAULTS, **table_options}
+        inheritance_modes = (JOINED_TABLE_INHERITANCE, SINGLE_TABLE_INHERITANCE)
+        if table_options['inheritance'] not in inheritance_modes:
+            raise ValueError(f"Unknown inheritance={table_options['inheritance']!r} for the table {clsname}, expected one of {inheritance_modes}.")
+        if table_options['inheritance'] != JOINED_TABLE_INHERITANCE and bases[0] is not InheritableTable:
+            raise ValueError(f"The table {clsname} sets inheritance={table_options['inheritance']!r}, but only {InheritableTable.__name__} hierarchies can set it.")
+        return table_options
+    if len(table_options) > 0:
+        raise ValueError(
+            f'The table {clsname} inherits its table options from {bases[0].__name__}.'
+            f' Please set {sorted(table_options)} on {bases[0].__name__} instead.'
+        )
+    return dict(bases[0].__table_options__)
+
+
+def _is_single_table_subclass(bases):
+    return not _is_hierarchy_root(bases) and bases[0].__table_options__['inheritance'] == SINGLE_TABLE_INHERITANCE
+
+
+def _share_single_table_columns(clsname, table, attrs):
+    # the columns of a single-table subclass are added to the table of its
+    # root, where the rows of other classes leave them empty. A column that
+    # another class of the hierarchy already added under the same name is
+    # shared if it has the same type and foreign keys.
+    for k, v in attrs.items():
+        if not isinstance(v, dataclasses.Field) or not isinstance(column := v.metadata.get(SQLALCHEMY_DATACLASS_METADATA_KEY), sa.Column):
+            continue
+        existing_column = table.c.get(k if column.name is None else column.name)
+        if existing_column is None:
+            column.nullable = True
+            continue
+        if str(existing_column.type) != str(column.type) or (
+            {fk.target_fullname for fk in existing_column.foreign_keys} != {fk.target_fullname for fk in column.foreign_keys}
+        ):
+            raise ValueError(
+                f'The column {existing_column.name} of {clsname}.{k} is also declared by another class of the'
+                f' single-table hierarchy of {table.name}, but with a different type or foreign key.'
+                ' Please rename one of them.'
+            )
+        v.metadata = types.MappingProxyType({**v.metadata, SQLALCHEMY_DATACLASS_METADATA_KEY: existing_column})
+
+
 def _set_attribute(attrs, attr_name, attr_value):
     if (existing_attr_value := attrs.get(attr_name)) is not None:
         raise ValueError(
@@ -183,6 +408,78 @@ def _set_typed_attribute(attrs, attr_name, attr_type, attr_value):
     attrs['__annotations__'][attr_name] = attr_type
 
 
+def _fingerprint_value(value):
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _row_id(row):
+    if row is None:
+        return None
+    if row.id is None:
+        raise ValueError(
+            f'Cannot hash a row referencing the unflushed row {row!r}.'
+            ' Please flush the referenced row first.'
+        )
+    return row.id
+
+
+def ids_digest(ids):
+    return hashlib.sha256(','.join(map(str, sorted(ids))).encode()).hexdigest()
+
+
+def many_to_many_digest(rows):
+    return ids_digest(_row_id(row) for row in rows)
+
+
+def _set_many_to_many_digests_before_insert(mapper, connection, target):
+    for k in target.__table_plan__.many_to_many:
+        if getattr(target, f'{k}_digest') is None:
+            setattr(target, f'{k}_digest', many_to_many_digest(getattr(target, k)))
+
+
+def _set_many_to_many_digests_before_update(mapper, connection, target):
+    state = sa.inspect(target)
+    for k in target.__table_plan__.many_to_many:
+        if state.attrs[k].history.has_changes():
+            setattr(target, f'{k}_digest', many_to_many_digest(getattr(target, k)))
+
+
+def fingerprint(table, values):
+    # values maps the persisted init fields of table to their values, with
+    # related rows given as rows (one-to-many) or lists of rows (many-to-many).
+    plan = table.__table_plan__
+    payload = {}
+    for k in plan.columns:
+        payload[k] = _fingerprint_value(values.get(k))
+    for k in plan.one_to_many:
+        payload[k] = _row_id(values.get(k))
+    for k in plan.many_to_many:
+        payload[k] = sorted(_row_id(v) for v in values.get(k) or [])
+    if plan.polymorphic_identity is not None:
+        payload[f'{SQLALCHEMY_DATACLASS_METADATA_KEY}_inheritance'] = plan.polymorphic_identity
+    payload = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def row_fingerprint(row):
+    return fingerprint(row.__class__, {k: getattr(row, k) for k in row.__table_plan__.persisted})
+
+
+def _set_fingerprint_before_insert(mapper, connection, target):
+    if getattr(target, FINGERPRINT_COLUMN_NAME, None) is None:
+        setattr(target, FINGERPRINT_COLUMN_NAME, row_fingerprint(target))
+
+
+def _set_fingerprint_before_update(mapper, connection, target):
+    state = sa.inspect(target)
+    if any(state.attrs[k].history.has_changes() for k in target.__table_plan__.persisted):
+        setattr(target, FINGERPRINT_COLUMN_NAME, row_fingerprint(target))
+
+
 def create_all(engine):
     mapper_registry.metadata.create_all(engine)
 
@@ -215,124 +512,1215 @@ class HydraORMDatabaseHasDuplicateRowsError(Exception):
         return res
 
 
-def instantiate_and_insert_config(session, cfg):
-    if not isinstance(cfg, (omegaconf.DictConfig, dict)):
+BULK_QUERY_CHUNK_SIZE = 100
+
+
+ROW_CACHE_SESSION_INFO_KEY = 'hydra_orm_row_cache'
+
+
+class RowCache:
+    def __init__(self, maxsize=10_000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._row_ids = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._row_ids)
+
+    @staticmethod
+    def _key(table, saved_row_filters):
+        return table, tuple(sorted((k, _identity_value(v)) for k, v in saved_row_filters.items()))
+
+    def get(self, table, saved_row_filters):
+        key = self._key(table, saved_row_filters)
+        with self._lock:
+            row_id = self._row_ids.get(key)
+            if row_id is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._row_ids.move_to_end(key)
+            return row_id
+
+    def put(self, table, saved_row_filters, row_id):
+        key = self._key(table, saved_row_filters)
+        with self._lock:
+            self._row_ids[key] = row_id
+            self._row_ids.move_to_end(key)
+            while len(self._row_ids) > self.maxsize:
+                self._row_ids.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._row_ids.clear()
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self), maxsize=self.maxsize)
+
+    def attach(self, session):
+        session.info[ROW_CACHE_SESSION_INFO_KEY] = self
+        if not sa.event.contains(session, 'after_rollback', self._clear_after_rollback):
+            sa.event.listen(session, 'after_rollback', self._clear_after_rollback)
+        return session
+
+    def _clear_after_rollback(self, session):
+        self.clear()
+
+
+ID_ALLOCATOR_SESSION_INFO_KEY = 'hydra_orm_id_allocator'
+
+
+def _reserve_sqlite_ids(connection, table, size):
+    # new ids of an AUTOINCREMENT table come after both its largest id and
+    # its sqlite_sequence entry, so advancing the entry to the end of the
+    # block keeps plain inserts out of the block
+    table_sql = connection.execute(
+        sa.text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), dict(name=table.name)
+    ).scalar()
+    if table_sql is None or 'AUTOINCREMENT' not in table_sql.upper():
+        raise ValueError(
+            f'The table {table.name} was created without AUTOINCREMENT, so rows inserted without an {IdAllocator.__name__}'
+            f' can take the ids it hands out. Please recreate the table to use an {IdAllocator.__name__} with it.'
+        )
+    sequence = connection.execute(sa.text('SELECT seq FROM sqlite_sequence WHERE name = :name'), dict(name=table.name)).scalar()
+    max_id = connection.execute(sa.select(sa.func.max(table.c.id))).scalar()
+    start = max(sequence or 0, max_id or 0) + 1
+    values = dict(name=table.name, seq=start + size - 1)
+    if sequence is None:
+        connection.execute(sa.text('INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)'), values)
+    else:
+        connection.execute(sa.text('UPDATE sqlite_sequence SET seq = :seq WHERE name = :name'), values)
+    return list(range(start, start + size))
+
+
+def _reserve_postgresql_ids(connection, table, size):
+    # nextval hands out every id once, to plain inserts and to reservations
+    # alike, and is not rolled back with the transaction
+    sequence_name = sa.func.pg_get_serial_sequence(connection.dialect.identifier_preparer.format_table(table), 'id')
+    ids = connection.execute(sa.select(sa.func.nextval(sequence_name)).select_from(sa.func.generate_series(1, size))).scalars().all()
+    return sorted(ids)
+
+
+ID_RESERVATIONS = {
+    'postgresql': _reserve_postgresql_ids,
+    'sqlite': _reserve_sqlite_ids,
+}
+
+
+class IdAllocator:
+    # Hands out the ids of new rows client-side, from blocks of ids reserved
+    # from the id counter of each table (hi/lo), so that the new rows of a
+    # config are written with one flush instead of one flush per row. The
+    # counter is the one plain inserts take their ids from, the serial
+    # sequence on PostgreSQL and the AUTOINCREMENT entry in sqlite_sequence
+    # on SQLite, so rows inserted without an IdAllocator never take the ids
+    # of a block. Sequences are not rolled back, so on PostgreSQL the ids of
+    # rolled back rows are skipped. SQLite has one writer at a time, and
+    # there blocks are reserved in the transaction of the session and
+    # dropped on rollback.
+    def __init__(self, block_size=1000):
+        self.block_size = block_size
+        self.blocks_reserved = 0
+        self._blocks = {}
+        self._session_blocks = set()
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _reserve(self, session, table, size):
+        connection = session.connection(bind_arguments=dict(clause=sa.select(table)))
+        reserve = ID_RESERVATIONS.get(connection.dialect.name)
+        if reserve is None:
+            raise ValueError(
+                f'{IdAllocator.__name__} reserves ids on {sorted(ID_RESERVATIONS)},'
+                f' the {connection.dialect.name} database of the table {table.name} is not supported.'
+            )
+        ids = reserve(connection, table, size)
+        if connection.dialect.name == 'sqlite':
+            self._session_blocks.add(table.name)
+        self.blocks_reserved += 1
+        return ids
+
+    def allocate(self, session, table, n=1):
+        # the ids of a hierarchy are the ids of its root table
+        root_table = sa.inspect(table).base_mapper.local_table
+        with self._lock:
+            ids = self._blocks.get(root_table.name, [])
+            if len(ids) < n:
+                ids = self._reserve(session, root_table, max(n, self.block_size))
+            self._blocks[root_table.name] = ids[n:]
+        return ids[:n]
+
+    def attach(self, session):
+        if self._session is not None and self._session is not session:
+            raise ValueError(
+                f'This {IdAllocator.__name__} is attached to another session, whose transaction its blocks may be reserved in.'
+                f' Please attach a new {IdAllocator.__name__} to every session.'
+            )
+        self._session = session
+        session.info[ID_ALLOCATOR_SESSION_INFO_KEY] = self
+        if not sa.event.contains(session, 'after_rollback', self._drop_blocks):
+            sa.event.listen(session, 'after_rollback', self._drop_blocks)
+        return session
+
+    def _drop_blocks(self, session):
+        # only the reservations made in the session's transaction are rolled back
+        with self._lock:
+            for table_name in self._session_blocks:
+                self._blocks.pop(table_name, None)
+            self._session_blocks.clear()
+
+
+INSERT_STATS_SESSION_INFO_KEY = 'hydra_orm_insert_stats'
+
+
+# the branches of inserting a config that InsertStats reports separately
+CACHE = 'cache'
+LOOKUP = 'lookup'
+INSERT = 'insert'
+TRANSFORM = 'transform'
+
+
+@dataclass
+class BranchStats:
+    calls: int = 0
+    statements: int = 0
+    # rows that lookups returned, not the rows the database scanned for them
+    rows_returned: int = 0
+    # rows that inserts, updates and deletes wrote
+    rows_written: int = 0
+    seconds: float = 0.
+
+
+class InsertStats:
+    def __init__(self):
+        self._branches = {}
+        self._stages = []
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _branch(self, table, branch):
+        with self._lock:
+            return self._branches.setdefault((table.__name__, branch), BranchStats())
+
+    @contextlib.contextmanager
+    def measure(self, table, branch):
+        branch_stats = self._branch(table, branch)
+        self._stages.append(branch_stats)
+        self._thread = threading.get_ident()
+        start = time.perf_counter()
+        try:
+            yield branch_stats
+        finally:
+            branch_stats.seconds += time.perf_counter() - start
+            branch_stats.calls += 1
+            self._stages.pop()
+
+    def _count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        # statements are attributed to the innermost stage measured by the
+        # thread inserting configs, other users of the engine are ignored
+        if len(self._stages) == 0 or threading.get_ident() != self._thread:
+            return
+        branch_stats = self._stages[-1]
+        branch_stats.statements += 1
+        if context is not None and (context.isinsert or context.isupdate or context.isdelete) and cursor.rowcount > 0:
+            branch_stats.rows_written += cursor.rowcount
+
+    def attach(self, session):
+        session.info[INSERT_STATS_SESSION_INFO_KEY] = self
+        engine = session.get_bind()
+        if not sa.event.contains(engine, 'after_cursor_execute', self._count_statement):
+            sa.event.listen(engine, 'after_cursor_execute', self._count_statement)
+        return session
+
+    def detach(self, session):
+        if session.info.get(INSERT_STATS_SESSION_INFO_KEY) is self:
+            del session.info[INSERT_STATS_SESSION_INFO_KEY]
+        engine = session.get_bind()
+        if sa.event.contains(engine, 'after_cursor_execute', self._count_statement):
+            sa.event.remove(engine, 'after_cursor_execute', self._count_statement)
+        return session
+
+    def reset(self):
+        with self._lock:
+            self._branches.clear()
+
+    def as_dict(self):
+        with self._lock:
+            res = {}
+            for (table_name, branch), branch_stats in sorted(self._branches.items()):
+                res.setdefault(table_name, {})[branch] = dataclasses.asdict(branch_stats)
+            return res
+
+
+@contextlib.contextmanager
+def instrument(session):
+    # session may also be a sqlalchemy.ext.asyncio.AsyncSession
+    session = getattr(session, 'sync_session', session)
+    insert_stats = InsertStats()
+    insert_stats.attach(session)
+    try:
+        yield insert_stats
+    finally:
+        insert_stats.detach(session)
+
+
+def _measure(session, table, branch):
+    insert_stats = session.info.get(INSERT_STATS_SESSION_INFO_KEY)
+    if insert_stats is None:
+        return contextlib.nullcontext(BranchStats())
+    return insert_stats.measure(table, branch)
+
+
+def _get_cached_row(session, table, saved_row_filters):
+    row_cache = session.info.get(ROW_CACHE_SESSION_INFO_KEY)
+    if row_cache is None or (row_id := row_cache.get(table, saved_row_filters)) is None:
+        return None
+    with _measure(session, table, CACHE):
+        return session.get(table, row_id)
+
+
+def _cache_row(session, table, saved_row_filters, row):
+    row_cache = session.info.get(ROW_CACHE_SESSION_INFO_KEY)
+    if row_cache is not None:
+        row_cache.put(table, saved_row_filters, row.id)
+
+
+def _saved_row_filters(table, record, m2m):
+    if table.__table_options__['fingerprint']:
+        return {FINGERPRINT_COLUMN_NAME: fingerprint(table, {**record, **m2m})}
+    saved_row_filters = {**record, **{f'{k}_digest': many_to_many_digest(v) for k, v in m2m.items()}}
+    if table.__table_plan__.polymorphic_identity is not None:
+        saved_row_filters[f'{SQLALCHEMY_DATACLASS_METADATA_KEY}_inheritance'] = table.__table_plan__.polymorphic_identity
+    return saved_row_filters
+
+
+def _lookup_parameter_names(table):
+    plan = table.__table_plan__
+    if table.__table_options__['fingerprint']:
+        return {FINGERPRINT_COLUMN_NAME: FINGERPRINT_COLUMN_NAME}
+    parameter_names = {k: k for k in plan.columns}
+    parameter_names.update({k: f'{k}_id' for k in plan.one_to_many})
+    parameter_names.update({f'{k}_digest': f'{k}_digest' for k in plan.many_to_many})
+    if plan.polymorphic_identity is not None:
+        k = f'{SQLALCHEMY_DATACLASS_METADATA_KEY}_inheritance'
+        parameter_names[k] = k
+    return parameter_names
+
+
+@functools.lru_cache(maxsize=None)
+def _lookup_statement(table, null_names):
+    # one statement per table and set of None values with a bind parameter
+    # per other deduplication column, so that every lookup reuses the same
+    # compiled SQL. It is built on the first lookup rather than with the
+    # class, since relationships to tables defined later are only resolved
+    # then. None values are compared with IS NULL and the others with =,
+    # which unlike IS NOT DISTINCT FROM can use the indexes on PostgreSQL.
+    conditions = []
+    for name in _lookup_parameter_names(table).values():
+        attr = getattr(table, name)
+        conditions.append(attr.is_(None) if name in null_names else attr == sa.bindparam(name))
+    return sa.select(table).where(*conditions).limit(2)
+
+
+def _lookup_parameters(table, saved_row_filters):
+    parameter_names = _lookup_parameter_names(table)
+    if saved_row_filters.keys() != parameter_names.keys():
+        return None
+    plan = table.__table_plan__
+    return {
+        parameter_names[k]: (None if v is None else _row_id(v)) if k in plan.one_to_many else v
+        for k, v in saved_row_filters.items()
+    }
+
+
+def _find_saved_row(session, table, saved_row_filters):
+    parameters = _lookup_parameters(table, saved_row_filters)
+    if parameters is None:
+        # fields given values of another kind, like None for a many-to-many
+        # field, are compared as filter_by compares them
+        statement, parameters = sa.select(table).filter_by(**saved_row_filters).limit(2), {}
+    else:
+        null_names = frozenset(name for name, v in parameters.items() if v is None)
+        statement = _lookup_statement(table, null_names)
+        parameters = {name: v for name, v in parameters.items() if name not in null_names}
+    with _measure(session, table, LOOKUP) as branch_stats:
+        saved_rows = session.execute(statement, parameters).all()
+        branch_stats.rows_returned += len(saved_rows)
+    if len(saved_rows) > 1:
+        raise HydraORMDatabaseHasDuplicateRowsError(
+            table.__name__,
+            session.execute(statement.with_only_columns(table.id).limit(None), parameters)
+        )
+    if len(saved_rows) == 1:
+        return saved_rows[0][0]
+    return None
+
+
+def _references_new_rows(record, m2m):
+    # a config referencing a row that is not flushed yet has no saved row
+    values = [*record.values(), *(vv for v in m2m.values() for vv in v)]
+    return any(isinstance(v, (Table, InheritableTable)) and sa.inspect(v).pending for v in values)
+
+
+def _deferred_rows(session, upsert):
+    # with an IdAllocator, new rows get their ids before they are flushed,
+    # and are collected here to be flushed together. Upserts rely on the ids
+    # returned by their inserts, so they are flushed right away.
+    if upsert or ID_ALLOCATOR_SESSION_INFO_KEY not in session.info:
+        return None
+    return {}
+
+
+def _allocate_ids(session, table, rows):
+    for row, row_id in zip(rows, session.info[ID_ALLOCATOR_SESSION_INFO_KEY].allocate(session, table, len(rows))):
+        row.id = row_id
+
+
+def _flush_deferred_rows(session, table, deferred_rows):
+    # the flush writes the new rows of every table with one executemany per
+    # table, and is reported as an insert into the table of the config
+    with _measure(session, table, INSERT):
+        session.flush()
+    for row, saved_row_filters in deferred_rows.values():
+        _cache_row(session, row.__class__, saved_row_filters, row)
+
+
+def _new_row(table, record, m2m, saved_row_filters):
+    row = table(**record, **m2m)
+    if table.__table_options__['fingerprint']:
+        setattr(row, FINGERPRINT_COLUMN_NAME, saved_row_filters[FINGERPRINT_COLUMN_NAME])
+    return row
+
+
+UPSERT_INSERTS = {
+    'postgresql': sa.dialects.postgresql.insert,
+    'sqlite': sa.dialects.sqlite.insert,
+}
+
+
+def _column_values(mapper, local_table, row):
+    return {
+        c.key: getattr(row, mapper.get_property_by_column(c).key)
+        for c in local_table.c if not c.primary_key and mapper.columns.contains_column(c)
+    }
+
+
+def _upsert_rows(session, table, rows):
+    if not table.__table_options__['fingerprint']:
+        raise ValueError(
+            f'Upserting rows of the table {table.__name__} relies on its {FINGERPRINT_COLUMN_NAME} column.'
+            f' Please declare {table.__name__} or the root of its hierarchy with fingerprint=True.'
+        )
+    dialect_name = session.get_bind(table).dialect.name
+    if dialect_name not in UPSERT_INSERTS:
+        raise ValueError(f'Upserting rows is not supported for the {dialect_name} dialect, only for {sorted(UPSERT_INSERTS)}.')
+    insert = UPSERT_INSERTS[dialect_name]
+    mapper = sa.inspect(table)
+    connection = session.connection()
+    for row in rows:
+        for k in table.__table_plan__.one_to_many:
+            setattr(row, f'{k}_id', _row_id(getattr(row, k)))
+        mapper.dispatch.before_insert(mapper, connection, sa.inspect(row))
+
+    local_tables = list(dict.fromkeys(m.local_table for m in reversed(list(mapper.iterate_to_root()))))
+    fingerprint_column = local_tables[0].c[FINGERPRINT_COLUMN_NAME]
+    inserted_ids = {}
+    for chunk_start in range(0, len(rows), BULK_QUERY_CHUNK_SIZE):
+        chunk = rows[chunk_start:chunk_start + BULK_QUERY_CHUNK_SIZE]
+        result = session.execute(
+            insert(local_tables[0])
+            .values([_column_values(mapper, local_tables[0], row) for row in chunk])
+            .on_conflict_do_nothing(index_elements=[fingerprint_column])
+            .returning(local_tables[0].c.id, fingerprint_column)
+        )
+        inserted_ids.update({inserted_fingerprint: row_id for row_id, inserted_fingerprint in result})
+
+    # rows whose fingerprint was already saved, possibly by a concurrent
+    # transaction, are left untouched and selected below.
+    inserted_rows = [row for row in rows if getattr(row, FINGERPRINT_COLUMN_NAME) in inserted_ids]
+    if len(inserted_rows) > 0:
+        for local_table in local_tables[1:]:
+            session.execute(sa.insert(local_table), [
+                {**_column_values(mapper, local_table, row), 'id': inserted_ids[getattr(row, FINGERPRINT_COLUMN_NAME)]}
+                for row in inserted_rows
+            ])
+        for k in table.__table_plan__.many_to_many:
+            prop = mapper.relationships[k]
+            owner_column = prop.synchronize_pairs[0][1]
+            member_column = prop.secondary_synchronize_pairs[0][1]
+            associations = [
+                {owner_column.key: inserted_ids[getattr(row, FINGERPRINT_COLUMN_NAME)], member_column.key: _row_id(member)}
+                for row in inserted_rows for member in getattr(row, k)
+            ]
+            if len(associations) > 0:
+                session.execute(sa.insert(prop.secondary), associations)
+
+    fingerprints = [getattr(row, FINGERPRINT_COLUMN_NAME) for row in rows]
+    saved_rows = {
+        getattr(row, FINGERPRINT_COLUMN_NAME): row
+        for row in session.scalars(sa.select(table).where(getattr(table, FINGERPRINT_COLUMN_NAME).in_(fingerprints)))
+    }
+    return [saved_rows[f] for f in fingerprints]
+
+
+def is_row(value):
+    return isinstance(value, (Table, InheritableTable)) and sa.inspect(value).has_identity
+
+
+@functools.lru_cache(maxsize=None)
+def locate_table(target):
+    table = hydra.utils.get_class(target) if isinstance(target, str) else target
+    if not isinstance(table, TableMetaclass):
+        raise ValueError(f'Tried to instantiate {target=}, which is not a {Table.__name__} or {InheritableTable.__name__}.')
+    return table
+
+
+def _to_container(value):
+    if isinstance(value, (omegaconf.DictConfig, omegaconf.ListConfig)):
+        return omegaconf.OmegaConf.to_container(value, resolve=True, throw_on_missing=True)
+    if dataclasses.is_dataclass(value) and not is_row(value):
+        return omegaconf.OmegaConf.to_container(omegaconf.OmegaConf.structured(value), resolve=True, throw_on_missing=True)
+    return value
+
+
+def _field_value(table, cfg, f):
+    if f.name in cfg:
+        value = cfg[f.name]
+    elif f.default is not dataclasses.MISSING:
+        value = f.default
+    elif f.default_factory is not dataclasses.MISSING:
+        value = f.default_factory()
+    else:
+        value = omegaconf.MISSING
+    if isinstance(value, str) and value == omegaconf.MISSING:
+        raise ValueError(f'Missing mandatory value for the field {table.__name__}.{f.name}.')
+    return _to_container(value)
+
+
+def _read_config(cfg):
+    cfg = _to_container(cfg)
+    if not isinstance(cfg, dict) or '_target_' not in cfg:
         raise ValueError(f'Tried to instantiate: {cfg=}')
+    table = locate_table(cfg['_target_'])
+    plan = table.__table_plan__
+    unknown_keys = cfg.keys() - plan.fields.keys() - {'_target_', 'defaults'}
+    if len(unknown_keys) > 0:
+        raise ValueError(f'Unknown fields {sorted(unknown_keys)} for the table {table.__name__}.')
     record = {}
     nonpersisted_fields = {}
+    one_to_many = {}
     m2m = {}
-    instance = hydra.utils.instantiate(cfg, _recursive_=False)
-    table = instance.__class__
-    cfg = dataclasses.asdict(instance)
-    if 'defaults' in cfg:
-        del cfg['defaults']
-    table_fields = {f.name: f for f in dataclasses.fields(table)}
-    for k, v in cfg.items():
-        if isinstance(v, enum.Enum):
+    for k, f in plan.fields.items():
+        v = _field_value(table, cfg, f)
+        kind = plan.kinds[k]
+        if kind == NONPERSISTED:
+            nonpersisted_fields[k] = v
+        elif kind == ONE_TO_MANY and isinstance(v, dict):
+            one_to_many[k] = v
+        elif kind == MANY_TO_MANY and isinstance(v, list):
+            m2m[k] = v
+        else:
             record[k] = v
-        elif isinstance(v, (dict, omegaconf.DictConfig)):
-            row = instantiate_and_insert_config(session, v)
-            record[k] = row
-        elif isinstance(v, (list, omegaconf.ListConfig)):
-            if hasattr(table, f'transform_{k}') and callable(getattr(table, f'transform_{k}')):
-                transform = getattr(table, f'transform_{k}')
-                rows = transform(session, v)
+    return table, record, one_to_many, m2m, nonpersisted_fields
+
+
+def _transformed_values(table, record, m2m):
+    for k, transform in table.__table_plan__.transforms.items():
+        for values in (record, m2m):
+            if k in values:
+                yield values, k, transform
+
+
+@functools.lru_cache(maxsize=None)
+def _reaches_batch_transforms(table):
+    # whether table or a table that its configs can reference, through
+    # relationships to a class or its subclasses, has transform_many_* hooks
+    visited = set()
+    frontier = [sa.inspect(table)]
+    while len(frontier) > 0:
+        mapper = frontier.pop()
+        if mapper in visited:
+            continue
+        visited.add(mapper)
+        if mapper.class_ in _BATCH_TRANSFORM_TABLES:
+            return True
+        for prop in mapper.relationships:
+            frontier.extend(prop.mapper.self_and_descendants)
+    return False
+
+
+def _collect_batch_transforms(cfg, batches):
+    # copies cfg with the values of transform_many_* fields and the configs
+    # under them filled in, and collects the copies to transform per field.
+    # Configs of tables that reach no hooks are left as they are.
+    cfg = _to_container(cfg)
+    if not isinstance(cfg, dict) or '_target_' not in cfg:
+        return cfg
+    table = locate_table(cfg['_target_'])
+    if not _reaches_batch_transforms(table):
+        return cfg
+    plan = table.__table_plan__
+    cfg = dict(cfg)
+    for k, f in plan.fields.items():
+        kind = plan.kinds[k]
+        if k in plan.batch_transforms:
+            cfg[k] = _field_value(table, cfg, f)
+            batches.setdefault((table, k), []).append(cfg)
+        elif kind == ONE_TO_MANY:
+            v = _field_value(table, cfg, f)
+            cfg[k] = _collect_batch_transforms(v, batches) if isinstance(v, dict) else v
+        elif kind == MANY_TO_MANY:
+            v = _field_value(table, cfg, f)
+            cfg[k] = [vv if is_row(vv) else _collect_batch_transforms(vv, batches) for vv in v] if isinstance(v, list) else v
+    return cfg
+
+
+def _batch_key(value):
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def _batch_values(batches):
+    for (table, k), cfgs in batches.items():
+        values = {}
+        for cfg in cfgs:
+            values.setdefault(_batch_key(cfg[k]), cfg[k])
+        yield table, k, cfgs, values
+
+
+def _set_batch_values(table, k, cfgs, values, transformed_values):
+    transformed_values = list(transformed_values)
+    if len(transformed_values) != len(values):
+        raise ValueError(
+            f'{table.__name__}.transform_many_{k} returned {len(transformed_values)} values for {len(values)} values,'
+            ' it has to return one transformed value per value.'
+        )
+    transformed_values = dict(zip(values, transformed_values))
+    for cfg in cfgs:
+        cfg[k] = transformed_values[_batch_key(cfg[k])]
+
+
+def _apply_batch_transforms(session, cfgs):
+    # every distinct value of a transform_many_* field, in all the configs and
+    # their sub-configs, is transformed with one call of the hook
+    if len(_BATCH_TRANSFORM_TABLES) == 0:
+        return cfgs
+    batches = {}
+    cfgs = [_collect_batch_transforms(cfg, batches) for cfg in cfgs]
+    for table, k, batch_cfgs, values in _batch_values(batches):
+        with _measure(session, table, TRANSFORM):
+            transformed_values = table.__table_plan__.batch_transforms[k](session, list(values.values()))
+        _set_batch_values(table, k, batch_cfgs, values, transformed_values)
+    return cfgs
+
+
+async def _apply_batch_transforms_async(session, cfgs):
+    if len(_BATCH_TRANSFORM_TABLES) == 0:
+        return cfgs
+    batches = {}
+    cfgs = [_collect_batch_transforms(cfg, batches) for cfg in cfgs]
+    for table, k, batch_cfgs, values in _batch_values(batches):
+        transform_many = table.__table_plan__.batch_transforms[k]
+        with _measure(session, table, TRANSFORM):
+            if inspect.iscoroutinefunction(transform_many):
+                transformed_values = await transform_many(session, list(values.values()))
             else:
-                rows = [
-                    instantiate_and_insert_config(session, vv) for vv in v
-                ]
-            m2m[k] = rows
-        elif k != '_target_' and table_fields[k].init:
-            if SQLALCHEMY_DATACLASS_METADATA_KEY in table_fields[k].metadata:
-                if hasattr(table, f'transform_{k}') and callable(getattr(table, f'transform_{k}')):
-                    transform = getattr(table, f'transform_{k}')
-                    v = transform(session, v)
-                record[k] = v
-            elif not k.endswith('_id'):
-                nonpersisted_fields[k] = v
-
-    if len(m2m) > 0:
-        if table.__bases__[0] is InheritableTable:
-            table_alias_candidates = sa_orm.aliased(
-                table, sa.select(table).filter_by(**record, sa_inheritance=table.__mapper_args__['polymorphic_identity']).subquery('candidates')
-            )
+                transformed_values = await session.run_sync(transform_many, list(values.values()))
+        _set_batch_values(table, k, batch_cfgs, values, transformed_values)
+    return cfgs
+
+
+def _parse_config(session, cfg, transform=True):
+    table, record, one_to_many, m2m, nonpersisted_fields = _read_config(cfg)
+    if not transform:
+        return table, record, one_to_many, m2m, nonpersisted_fields
+    for values, k, transform_hook in _transformed_values(table, record, m2m):
+        with _measure(session, table, TRANSFORM):
+            values[k] = transform_hook(session, values[k])
+    return table, record, one_to_many, m2m, nonpersisted_fields
+
+
+OVERRIDE_STORE_SESSION_INFO_KEY = 'hydra_orm_override_store'
+
+
+class OverrideStore:
+    # Rows with overridden non-persistent values may be garbage collected once
+    # they are expired, and are then loaded again without the overrides.
+    # Just setting session.expire_on_commit=False works to prevserve the overrides
+    # in the pytests in this project, but it does not work for this project:
+    # https://github.com/Utah-Math-Data-Science/Latent-Dynamics-Data-Assimilation
+    # So the values are kept here, keyed by row, and set again when a row is
+    # loaded. They are released when the config root they were inserted with
+    # is garbage collected.
+    def __init__(self):
+        self._overrides = {}
+
+    def __len__(self):
+        return len(self._overrides)
+
+    def register(self, root, overrides):
+        token = object()
+        keys = []
+        for row, nonpersisted_fields in overrides:
+            if len(nonpersisted_fields) > 0:
+                key = (row.__class__.__name__, row.id)
+                self._overrides.setdefault(key, {})[token] = nonpersisted_fields
+                keys.append(key)
+        if len(keys) > 0:
+            weakref.finalize(root, self._release, token, keys)
+
+    def _release(self, token, keys):
+        for key in keys:
+            nonpersisted_fields = self._overrides.get(key)
+            if nonpersisted_fields is not None:
+                nonpersisted_fields.pop(token, None)
+                if len(nonpersisted_fields) == 0:
+                    del self._overrides[key]
+
+    def apply(self, row):
+        nonpersisted_fields = self._overrides.get((row.__class__.__name__, row.id))
+        if nonpersisted_fields:
+            _set_nonpersisted_fields(row, next(reversed(nonpersisted_fields.values())))
+
+
+def override_store(session):
+    return session.info.setdefault(OVERRIDE_STORE_SESSION_INFO_KEY, OverrideStore())
+
+
+def _apply_overrides_on_load(target, context):
+    store = context.session.info.get(OVERRIDE_STORE_SESSION_INFO_KEY)
+    if store is not None:
+        store.apply(target)
+
+
+def _set_nonpersisted_fields(row, nonpersisted_fields):
+    for k, v in nonpersisted_fields.items():
+        setattr(row, k, v)
+
+
+def _instantiate_and_insert_config(session, cfg, upsert, overrides, deferred_rows):
+    table, record, one_to_many, m2m, nonpersisted_fields = _parse_config(session, cfg)
+    for k, v in one_to_many.items():
+        record[k] = _instantiate_and_insert_config(session, v, upsert, overrides, deferred_rows)
+    for k, v in m2m.items():
+        m2m[k] = [
+            vv if is_row(vv) else _instantiate_and_insert_config(session, vv, upsert, overrides, deferred_rows)
+            for vv in v
+        ]
+
+    saved_row_filters = _saved_row_filters(table, record, m2m)
+    deferred_key = RowCache._key(table, saved_row_filters)
+    if deferred_rows is not None and deferred_key in deferred_rows:
+        row, _ = deferred_rows[deferred_key]
+    elif (row := _get_cached_row(session, table, saved_row_filters)) is None:
+        if not _references_new_rows(record, m2m):
+            row = _find_saved_row(session, table, saved_row_filters)
+        if row is None:
+            row = _new_row(table, record, m2m, saved_row_filters)
+            with _measure(session, table, INSERT):
+                if upsert:
+                    row, = _upsert_rows(session, table, [row])
+                elif deferred_rows is not None:
+                    _allocate_ids(session, table, [row])
+                    session.add(row)
+                else:
+                    session.add(row)
+                    session.flush()
+        if deferred_rows is not None and sa.inspect(row).pending:
+            deferred_rows[deferred_key] = (row, saved_row_filters)
         else:
-            table_alias_candidates = sa_orm.aliased(
-                table, sa.select(table).filter_by(**record).subquery('candidates')
-            )
-        subqueries = []
-        for k, v in m2m.items():
-            if len(v) > 0:
-                table_related = v[0].__class__
-                if (
-                    table_related.__bases__[0] is not Table
-                    and table_related.__bases__[0] is not InheritableTable
-                ):
-                    table_related = table_related.__bases__[0]
-                subquery = (
-                    sa.select(table_alias_candidates.id)
-                    .join(getattr(table_alias_candidates, k))
-                    .group_by(table_alias_candidates.id)
-                    .having(sa.func.sum(table_related.id.in_([vv.id for vv in v])) == len(v))
-                    .having(sa.func.sum(table_related.id.notin_([vv.id for vv in v])) == 0)
-                )
-                subqueries.append(subquery)
+            _cache_row(session, table, saved_row_filters, row)
+
+    _set_nonpersisted_fields(row, nonpersisted_fields)
+    overrides.append((row, nonpersisted_fields))
+    return row
+
+
+def instantiate_and_insert_config(session, cfg, upsert=False):
+    cfg, = _apply_batch_transforms(session, [cfg])
+    overrides = []
+    deferred_rows = _deferred_rows(session, upsert)
+    with contextlib.nullcontext() if deferred_rows is None else session.no_autoflush:
+        row = _instantiate_and_insert_config(session, cfg, upsert, overrides, deferred_rows)
+    if deferred_rows is not None:
+        _flush_deferred_rows(session, row.__class__, deferred_rows)
+    override_store(session).register(row, overrides)
+    return row
+
+
+@dataclass
+class _ConfigNode:
+    table: type
+    record: dict
+    one_to_many: dict
+    m2m: dict
+    height: int
+
+
+def _identity_value(value):
+    # rows waiting for a deferred flush already have their ids
+    if isinstance(value, (Table, InheritableTable)):
+        return _row_id(value)
+    return _fingerprint_value(value)
+
+
+def _node_ref_key(ref):
+    return ('row', _row_id(ref)) if is_row(ref) else ('node', ref)
+
+
+def _add_config_node(session, cfg, nodes, node_indices, overrides, transform):
+    table, record, one_to_many, m2m, nonpersisted_fields = _parse_config(session, cfg, transform=transform)
+    for k, v in one_to_many.items():
+        one_to_many[k] = _add_config_node(session, v, nodes, node_indices, overrides, transform)
+    for k, v in m2m.items():
+        m2m[k] = [
+            vv if is_row(vv) else _add_config_node(session, vv, nodes, node_indices, overrides, transform)
+            for vv in v
+        ]
+    return _register_config_node(table, record, one_to_many, m2m, nonpersisted_fields, nodes, node_indices, overrides)
+
+
+async def _add_config_node_async(session, cfg, nodes, node_indices, overrides):
+    table, record, one_to_many, m2m, nonpersisted_fields = _read_config(cfg)
+    for values, k, transform in _transformed_values(table, record, m2m):
+        with _measure(session, table, TRANSFORM):
+            if inspect.iscoroutinefunction(transform):
+                values[k] = await transform(session, values[k])
             else:
-                m2m_rel = table_fields[k].metadata[SQLALCHEMY_DATACLASS_METADATA_KEY]
-                m2m_table_name = m2m_rel.parent.class_.__name__
-                m2m_table_col = getattr(m2m_rel.secondary.c, m2m_table_name)
-                # m2m_related_col = getattr(m2m_rel.secondary.c, m2m_rel.argument)
-                has_relation = sa.select(m2m_table_col)
-                subquery = (
-                    sa.select(table_alias_candidates.id)
-                    .where(table_alias_candidates.id.notin_(has_relation))
-                )
-                subqueries.append(subquery)
-        query = sa.intersect(*subqueries)
-        candidates_query = sa.select(table_alias_candidates).where(table_alias_candidates.id.in_(query))
-        candidates = session.execute(candidates_query.limit(2)).all()
-        if len(candidates) > 1:
-            raise HydraORMDatabaseHasDuplicateRowsError(
-                table.__name__,
-                session.execute(sa.select(table_alias_candidates.id).where(table_alias_candidates.id.in_(query)))
-            )
-        if len(candidates) == 1:
-            row = candidates[0][0]
-            for k, v in nonpersisted_fields.items():
-                setattr(row, k, v)
-            return row
-
-    # with session.no_autoflush:
-    if len(m2m) == 0:
-        if hasattr(table, '__mapper_args__') and 'polymorphic_identity' in table.__mapper_args__:
-            saved_row_filters = {**record, 'sa_inheritance': table.__mapper_args__['polymorphic_identity']}
+                values[k] = await session.run_sync(transform, values[k])
+    for k, v in one_to_many.items():
+        one_to_many[k] = await _add_config_node_async(session, v, nodes, node_indices, overrides)
+    for k, v in m2m.items():
+        m2m[k] = [
+            vv if is_row(vv) else await _add_config_node_async(session, vv, nodes, node_indices, overrides)
+            for vv in v
+        ]
+    return _register_config_node(table, record, one_to_many, m2m, nonpersisted_fields, nodes, node_indices, overrides)
+
+
+def _register_config_node(table, record, one_to_many, m2m, nonpersisted_fields, nodes, node_indices, overrides):
+    key = (
+        table,
+        tuple(sorted((k, _identity_value(v)) for k, v in record.items())),
+        tuple(sorted(one_to_many.items())),
+        tuple(sorted((k, tuple(sorted(map(_node_ref_key, v)))) for k, v in m2m.items())),
+    )
+    if key not in node_indices:
+        children = [*one_to_many.values(), *(vv for v in m2m.values() for vv in v)]
+        height = 1 + max((nodes[c].height for c in children if not is_row(c)), default=-1)
+        node_indices[key] = len(nodes)
+        nodes.append(_ConfigNode(table, record, one_to_many, m2m, height))
+    overrides.append((node_indices[key], nonpersisted_fields))
+    return node_indices[key]
+
+
+def _select_saved_rows(session, table, filter_names, filters):
+    relationships = sa.inspect(table).relationships
+    saved_rows = {}
+    for chunk_start in range(0, len(filters), BULK_QUERY_CHUNK_SIZE):
+        chunk = filters[chunk_start:chunk_start + BULK_QUERY_CHUNK_SIZE]
+        if len(filter_names) == 1 and filter_names[0] not in relationships:
+            condition = getattr(table, filter_names[0]).in_([f[filter_names[0]] for f in chunk])
         else:
-            saved_row_filters = record
-        saved_rows = session.execute(sa.select(table).filter_by(**saved_row_filters).limit(2)).all()
-        if len(saved_rows) > 1:
-            raise HydraORMDatabaseHasDuplicateRowsError(
-                table.__name__,
-                session.execute(sa.select(table.id).filter_by(**saved_row_filters))
+            condition = sa.or_(*(sa.and_(*(getattr(table, k) == f[k] for k in filter_names)) for f in chunk))
+        with _measure(session, table, LOOKUP) as branch_stats:
+            chunk_rows = session.scalars(sa.select(table).where(condition)).all()
+            branch_stats.rows_returned += len(chunk_rows)
+        for row in chunk_rows:
+            identity = tuple(
+                getattr(row, f'{k}_id') if k in relationships else _fingerprint_value(getattr(row, k))
+                for k in filter_names
             )
-        if len(saved_rows) == 1:
-            row = saved_rows[0][0]
+            if identity in saved_rows:
+                raise HydraORMDatabaseHasDuplicateRowsError(table.__name__, [saved_rows[identity].id, row.id])
+            saved_rows[identity] = row
+    return saved_rows
+
+
+def _group_config_nodes(indices, nodes, rows):
+    groups = {}
+    for i in indices:
+        node = nodes[i]
+        children = [*node.one_to_many.values(), *(c for v in node.m2m.values() for c in v if not is_row(c))]
+        if any(rows[c] is None for c in children):
+            # a sub-config has no row, so neither has this config
+            continue
+        record = {**node.record, **{k: rows[c] for k, c in node.one_to_many.items()}}
+        m2m = {k: [c if is_row(c) else rows[c] for c in v] for k, v in node.m2m.items()}
+        saved_row_filters = _saved_row_filters(node.table, record, m2m)
+        filter_names = tuple(sorted(saved_row_filters))
+        identity = tuple(_identity_value(saved_row_filters[k]) for k in filter_names)
+        pending = groups.setdefault((node.table, filter_names), {})
+        pending.setdefault(identity, (record, m2m, saved_row_filters, []))[3].append(i)
+    return groups
+
+
+def _find_saved_rows(session, table, filter_names, pending):
+    saved_rows = {}
+    for identity, (_, _, saved_row_filters, _) in pending.items():
+        if (row := _get_cached_row(session, table, saved_row_filters)) is not None:
+            saved_rows[identity] = row
+    uncached_filters = [p[2] for identity, p in pending.items() if identity not in saved_rows]
+    if len(uncached_filters) > 0:
+        saved_rows.update(_select_saved_rows(session, table, filter_names, uncached_filters))
+    return saved_rows
+
+
+def _resolve_config_nodes(session, indices, nodes, rows, upsert, deferred_rows):
+    groups = _group_config_nodes(indices, nodes, rows)
+    new_rows = {}
+    resolved_rows = []
+    for (table, filter_names), pending in groups.items():
+        saved_rows = _find_saved_rows(session, table, filter_names, {
+            identity: p for identity, p in pending.items() if not _references_new_rows(p[0], p[1])
+        })
+        for identity, (record, m2m, saved_row_filters, node_indices) in pending.items():
+            row = saved_rows.get(identity)
+            if row is None and deferred_rows is not None:
+                row, _ = deferred_rows.get(RowCache._key(table, saved_row_filters), (None, None))
+            if row is None:
+                row = _new_row(table, record, m2m, saved_row_filters)
+                new_rows.setdefault(table, []).append(row)
+            resolved_rows.append((table, saved_row_filters, row, node_indices))
+
+    # rows of the same height do not reference each other, so flushing them
+    # table by table issues the same statements as one flush
+    upserted_rows = {}
+    for table, table_new_rows in new_rows.items():
+        with _measure(session, table, INSERT):
+            if upsert:
+                upserted_rows.update(zip(map(id, table_new_rows), _upsert_rows(session, table, table_new_rows)))
+            elif deferred_rows is not None:
+                _allocate_ids(session, table, table_new_rows)
+                session.add_all(table_new_rows)
+            else:
+                session.add_all(table_new_rows)
+                session.flush()
+    for table, saved_row_filters, row, node_indices in resolved_rows:
+        row = upserted_rows.get(id(row), row)
+        if deferred_rows is not None and sa.inspect(row).pending:
+            deferred_rows[RowCache._key(table, saved_row_filters)] = (row, saved_row_filters)
         else:
-            row = table(**record)
-            session.add(row)
-            session.flush()
+            _cache_row(session, table, saved_row_filters, row)
+        for i in node_indices:
+            rows[i] = row
+
+
+def _insert_config_nodes(session, nodes, roots, upsert):
+    rows = [None] * len(nodes)
+    deferred_rows = _deferred_rows(session, upsert)
+    with contextlib.nullcontext() if deferred_rows is None else session.no_autoflush:
+        for height in sorted({node.height for node in nodes}):
+            _resolve_config_nodes(session, [i for i, node in enumerate(nodes) if node.height == height], nodes, rows, upsert, deferred_rows)
+    if deferred_rows is not None and len(roots) > 0:
+        _flush_deferred_rows(session, rows[roots[0][0]].__class__, deferred_rows)
+
+    store = override_store(session)
+    for root, overrides in roots:
+        for i, nonpersisted_fields in overrides:
+            _set_nonpersisted_fields(rows[i], nonpersisted_fields)
+        store.register(rows[root], [(rows[i], nonpersisted_fields) for i, nonpersisted_fields in overrides])
+    return [rows[root] for root, _ in roots]
+
+
+def instantiate_and_insert_configs(session, cfgs, upsert=False, transform=True):
+    # transform=False skips the transform_* hooks, for configs whose values
+    # were read back from the database, like exported configs.
+    if transform:
+        cfgs = _apply_batch_transforms(session, cfgs)
+    nodes = []
+    node_indices = {}
+    roots = []
+    for cfg in cfgs:
+        overrides = []
+        roots.append((_add_config_node(session, cfg, nodes, node_indices, overrides, transform), overrides))
+    return _insert_config_nodes(session, nodes, roots, upsert)
+
+
+def _find_config_nodes(session, indices, nodes, rows):
+    for (table, filter_names), pending in _group_config_nodes(indices, nodes, rows).items():
+        saved_rows = _find_saved_rows(session, table, filter_names, pending)
+        for identity, (_, _, _, node_indices) in pending.items():
+            for i in node_indices:
+                rows[i] = saved_rows.get(identity)
+
+
+def find_saved_configs(session, cfgs):
+    # the saved row of each config, or None, found with the same lookups as
+    # instantiate_and_insert_configs but without inserting anything
+    cfgs = _apply_batch_transforms(session, cfgs)
+    nodes = []
+    node_indices = {}
+    roots = [_add_config_node(session, cfg, nodes, node_indices, [], True) for cfg in cfgs]
+    rows = [None] * len(nodes)
+    for height in sorted({node.height for node in nodes}):
+        _find_config_nodes(session, [i for i, node in enumerate(nodes) if node.height == height], nodes, rows)
+    return [rows[root] for root in roots]
+
+
+async def instantiate_and_insert_configs_async(session, cfgs, upsert=False):
+    # session is a sqlalchemy.ext.asyncio.AsyncSession. Coroutine transform_*
+    # hooks are awaited with it, the other hooks run with its synchronous session.
+    cfgs = await _apply_batch_transforms_async(session, cfgs)
+    nodes = []
+    node_indices = {}
+    roots = []
+    for cfg in cfgs:
+        overrides = []
+        roots.append((await _add_config_node_async(session, cfg, nodes, node_indices, overrides), overrides))
+    return await session.run_sync(_insert_config_nodes, nodes, roots, upsert)
+
+
+async def instantiate_and_insert_config_async(session, cfg, upsert=False):
+    rows = await instantiate_and_insert_configs_async(session, [cfg], upsert=upsert)
+    return rows[0]
+
+
+def _relationship_values(row):
+    plan = row.__table_plan__
+    for k in plan.one_to_many:
+        v = getattr(row, k)
+        if v is not None:
+            yield v
+    for k in plan.many_to_many:
+        yield from getattr(row, k)
+
+
+def _row_identity(row):
+    # the id from the identity key, since reading row.id would refresh each
+    # expired row with its own query
+    identity_key = sa.inspect(row).identity_key
+    if identity_key is None:
+        raise ValueError(f'The row {row} has not been flushed, so it cannot be loaded.')
+    return identity_key[1][0]
+
+
+def _has_unloaded_columns(row):
+    state = sa.inspect(row)
+    return len(state.unloaded & set(state.mapper.column_attrs.keys())) > 0
+
+
+def _load_rows(session, mapper, row_ids):
+    # the rows of the hierarchy of mapper by id. Rows that the session holds
+    # loaded are reused, the others are selected with the columns of all
+    # subclasses, one query per chunk.
+    rows = {}
+    missing_ids = []
+    for row_id in row_ids:
+        row = session.identity_map.get(mapper.identity_key_from_primary_key((row_id,)))
+        if row is None or _has_unloaded_columns(row):
+            missing_ids.append(row_id)
+        else:
+            rows[row_id] = row
+    polymorphic = sa_orm.with_polymorphic(mapper.class_, '*')
+    for chunk_start in range(0, len(missing_ids), BULK_QUERY_CHUNK_SIZE):
+        chunk = missing_ids[chunk_start:chunk_start + BULK_QUERY_CHUNK_SIZE]
+        for row in session.scalars(sa.select(polymorphic).where(polymorphic.id.in_(chunk))):
+            rows[_row_identity(row)] = row
+    return rows
+
+
+def load_configs(session, rows):
+    # loads the whole graph of each row level by level: the related rows of a
+    # level are selected with one query per table hierarchy and chunk, and
+    # the associations with one query per many-to-many field and chunk. The
+    # loaded rows are set as the related rows, so no row is selected twice
+    # and nothing is lazy loaded.
+    loaded = set()
+    level = [row for row in rows if _has_unloaded_columns(row)]
+    for mapper in {sa.inspect(row).mapper.base_mapper for row in level}:
+        _load_rows(session, mapper, [_row_identity(row) for row in level if sa.inspect(row).mapper.base_mapper is mapper])
+    level = list(rows)
+    while len(level) > 0:
+        one_to_many = []
+        many_to_many = {}
+        for row in level:
+            row_id = _row_identity(row)
+            identity_key = sa.inspect(row).identity_key
+            if identity_key in loaded:
+                continue
+            loaded.add(identity_key)
+            mapper = sa.inspect(row).mapper
+            plan = row.__table_plan__
+            for k in plan.one_to_many:
+                one_to_many.append((row, k, mapper.relationships[k].mapper.base_mapper, getattr(row, f'{k}_id')))
+            for k in plan.many_to_many:
+                many_to_many.setdefault(mapper.relationships[k], {}).setdefault(row_id, []).append((row, k))
+
+        related_ids = {}
+        for _, _, target, target_id in one_to_many:
+            if target_id is not None:
+                related_ids.setdefault(target, set()).add(target_id)
+        members = {}
+        for prop, owners in many_to_many.items():
+            owner_column = prop.synchronize_pairs[0][1]
+            member_column = prop.secondary_synchronize_pairs[0][1]
+            owner_ids = list(owners)
+            for chunk_start in range(0, len(owner_ids), BULK_QUERY_CHUNK_SIZE):
+                chunk = owner_ids[chunk_start:chunk_start + BULK_QUERY_CHUNK_SIZE]
+                for owner_id, member_id in session.execute(sa.select(owner_column, member_column).where(owner_column.in_(chunk))):
+                    members.setdefault((prop, owner_id), []).append(member_id)
+                    related_ids.setdefault(prop.mapper.base_mapper, set()).add(member_id)
+        related_rows = {target: _load_rows(session, target, sorted(ids)) for target, ids in related_ids.items()}
+
+        level = []
+        for row, k, target, target_id in one_to_many:
+            related_row = None if target_id is None else related_rows[target][target_id]
+            sa_orm.attributes.set_committed_value(row, k, related_row)
+            if related_row is not None:
+                level.append(related_row)
+        for prop, owners in many_to_many.items():
+            for owner_id, owner_rows in owners.items():
+                related = [related_rows[prop.mapper.base_mapper][member_id] for member_id in members.get((prop, owner_id), [])]
+                for row, k in owner_rows:
+                    sa_orm.attributes.set_committed_value(row, k, list(related))
+                level.extend(related)
+
+
+def detach_configs_from_session(rows, session):
+    rows = list(rows)
+    load_configs(session, rows)
+    detached = set()
+    level = list(rows)
+    while len(level) > 0:
+        row = level.pop()
+        if id(row) not in detached:
+            detached.add(id(row))
+            level.extend(_relationship_values(row))
+            if row in session:
+                session.expunge(row)
+    return rows
+
+
+def detach_config_from_session(row, session):
+    return detach_configs_from_session([row], session)[0]
+
+
+def _nested_overrides(overrides):
+    parsed_overrides = OverridesParser.create().parse_overrides(overrides)
+    cfg = {}
+    for override in parsed_overrides:
+        if override.is_sweep_override() or override.is_delete():
+            raise ValueError(f'Only overrides setting one value can be used to select configs, got {override.input_line!r}.')
+        *path, k = override.key_or_group.split('.')
+        values = cfg
+        for kk in path:
+            # a config group choice followed by overrides of its fields
+            if isinstance(values.get(kk), str):
+                values[kk] = {'_target_': values[kk]}
+            values = values.setdefault(kk, {})
+        value = override.value()
+        if isinstance(values.get(k), dict) and isinstance(value, str):
+            values[k]['_target_'] = value
+        else:
+            values[k] = value
+    return cfg
+
+
+def _relation_target(table, k, cfg):
+    relation_target = sa.inspect(table).relationships[k].mapper
+    if isinstance(cfg, str):
+        cfg = {'_target_': cfg}
+    target = cfg.get('_target_')
+    if target is None:
+        return relation_target.class_, cfg
+    # config group choices are stored under the class name by store_config
+    for mapper in relation_target.self_and_descendants:
+        if mapper.class_.__name__ == target:
+            return mapper.class_, cfg
+    target = locate_table(target)
+    if not issubclass(target, relation_target.class_):
+        raise ValueError(f'The field {table.__name__}.{k} cannot reference {target.__name__}, which is not a subclass of {relation_target.class_.__name__}.')
+    return target, cfg
+
+
+def _related_attr(table, k, target):
+    attr = getattr(table, k)
+    if target is not sa.inspect(table).relationships[k].mapper.class_:
+        attr = attr.of_type(target)
+    return attr
+
+
+def _transform_field_value(session, table, k, v):
+    # the value a config holding v for k saves after the transform_* hooks
+    # on insert
+    plan = table.__table_plan__
+    if k in plan.batch_transforms:
+        transform = lambda session, value: plan.batch_transforms[k](session, [value])[0]
+    elif k in plan.transforms and not (plan.kinds[k] == ONE_TO_MANY and isinstance(v, dict)):
+        transform = plan.transforms[k]
     else:
-        for k, v in m2m.items():
-            record[k] = v
-        row = table(**record)
-        session.add(row)
-        session.flush()
+        return v
+    if session is None:
+        raise ValueError(f'The field {table.__name__}.{k} has a transform hook, which needs a session to transform its values.')
+    return transform(session, v)
 
-    for k, v in nonpersisted_fields.items():
-        setattr(row, k, v)
-    # create strong references for all the rows to prevent the objects with
-    # overridden non-persistent values from being garbage collected.
-    # Just setting session.expire_on_commit=False works to prevserve the overrides
-    # in the pytests in this project, but it does not work for this project:
-    # https://github.com/Utah-Math-Data-Science/Latent-Dynamics-Data-Assimilation
-    session.info[(table.__name__, row.id)] = row
-    return row
+
+def field_default(session, table, k):
+    # the value that a config without k saves for it
+    return _transform_field_value(session, table, k, _field_value(table, {}, table.__table_plan__.fields[k]))
+
+
+def _config_conditions(session, table, cfg):
+    plan = table.__table_plan__
+    conditions = []
+    for k, v in cfg.items():
+        if k in ('_target_', 'defaults'):
+            continue
+        if k not in plan.fields:
+            raise ValueError(f'Unknown field {k!r} for the table {table.__name__}.')
+        kind = plan.kinds[k]
+        if kind == NONPERSISTED:
+            raise ValueError(f'The field {table.__name__}.{k} is not saved in the database, so configs cannot be selected by it.')
+        # configs are selected by the values they were saved with
+        v = _transform_field_value(session, table, k, v)
+        if kind == COLUMN:
+            conditions.append(getattr(table, k).is_(None) if v is None else getattr(table, k) == v)
+        elif v is None:
+            conditions.append(getattr(table, k) == None if kind == ONE_TO_MANY else ~getattr(table, k).any())
+        elif kind == ONE_TO_MANY and is_row(v):
+            conditions.append(getattr(table, k) == v)
+        elif kind == ONE_TO_MANY:
+            target, v = _relation_target(table, k, v)
+            conditions.append(_related_attr(table, k, target).has(sa.and_(True, *_config_conditions(session, target, v))))
+        elif len(v) == 0:
+            conditions.append(~getattr(table, k).any())
+        else:
+            # an override replaces the whole list, so every listed config has
+            # to match one of the related rows, and there are no other rows
+            prop = sa.inspect(table).relationships[k]
+            owner_column, association_owner_column = prop.synchronize_pairs[0]
+            conditions.append(
+                sa.select(sa.func.count()).select_from(prop.secondary)
+                .where(association_owner_column == owner_column).scalar_subquery() == len(v)
+            )
+            for vv in v:
+                if is_row(vv):
+                    conditions.append(getattr(table, k).contains(vv))
+                    continue
+                target, vv = _relation_target(table, k, vv)
+                conditions.append(_related_attr(table, k, target).any(sa.and_(True, *_config_conditions(session, target, vv))))
+    return conditions
+
+
+def select_configs(table, cfg, session=None):
+    # cfg is a list of Hydra overrides like ['sub_config.value=3', 'string=STRING2'],
+    # or a partial config. The selected rows match every given value, and
+    # lists match the whole many-to-many list. Related configs are matched
+    # with EXISTS subqueries, so each row is selected once
+    # however many of its many-to-many rows match. Values of fields with
+    # transform_* hooks are transformed like on insert, which needs the
+    # session.
+    if isinstance(cfg, (list, tuple)):
+        cfg = _nested_overrides(cfg)
+    cfg = _to_container(cfg)
+    return sa.select(table).where(*_config_conditions(session, table, cfg)).order_by(table.id)
+
+
+def find_configs(session, table, cfg):
+    return session.scalars(select_configs(table, cfg, session=session)).all()
+
+
+def find_config_ids(session, table, cfg):
+    return session.scalars(select_configs(table, cfg, session=session).with_only_columns(table.id)).all()
@@ -3,10 +3,14 @@ import random
 from dataclasses import field
 
 import sqlalchemy as sa
+import sqlalchemy.orm as sa_orm
+
+
+_system_random = random.SystemRandom()
 
 
 def generate_random_string(k=8, chars=string.ascii_lowercase+string.digits):
-    return ''.join(random.SystemRandom().choices(chars, k=k))
+    return ''.join(_system_random.choices(chars, k=k))
 
 
 def set_attr_to_func_value(table, attr_name, func, unique=True):
@@ -21,5 +25,51 @@ def set_attr_to_func_value(table, attr_name, func, unique=True):
     return _set
 
 
+def set_attr_to_unique_func_values(table, attr_name, func):
+    # Assigns func() to attr_name of every pending row of table in the flush
+    # at once, without querying the database. The values are distinct within
+    # the flush, and a collision with a saved value is left to the unique
+    # index on attr_name, whose IntegrityError retry_on_unique_violation
+    # handles. func should make collisions rare, like generate_random_string.
+    def _set(mapper, connection, target):
+        if getattr(target, attr_name) is not None:
+            return
+        pending = [target]
+        session = sa_orm.object_session(target)
+        if session is not None:
+            pending.extend(
+                row for row in session.new
+                if isinstance(row, table) and row is not target and getattr(row, attr_name) is None
+            )
+        assigned = set()
+        for row in pending:
+            value = func()
+            while value in assigned:
+                value = func()
+            setattr(row, attr_name, value)
+            assigned.add(value)
+    return _set
+
+
+def is_unique_violation(e, table, attr_name):
+    # SQLite names the column as table.column, PostgreSQL and MySQL name the
+    # column or the index in the message
+    column_name = getattr(table, attr_name).property.columns[0].name
+    return isinstance(e, sa.exc.IntegrityError) and column_name in str(e.orig)
+
+
+def retry_on_unique_violation(func, table, attr_name, max_attempts=3):
+    # Calls func until it does not fail because a value generated for
+    # attr_name of table was saved already. func should run a whole
+    # transaction, whose new rows get new values when it is rerun, like the
+    # insert of main.py.
+    for attempt in range(max_attempts):
+        try:
+            return func()
+        except sa.exc.IntegrityError as e:
+            if not is_unique_violation(e, table, attr_name) or attempt == max_attempts - 1:
+                raise
+
+
 def make_defaults_list(defaults_list):
     return field(repr=False, default_factory=lambda: defaults_list)
@@ -0,0 +1,126 @@
+from dataclasses import dataclass, field
+import itertools
+import logging
+import pathlib
+import typing
+
+from hydra.core.config_store import ConfigStore
+from hydra.core.override_parser.overrides_parser import OverridesParser
+from hydra.core.plugins import Plugins
+from hydra.plugins.sweeper import Sweeper
+import omegaconf
+import sqlalchemy.orm as sa_orm
+
+from hydra_orm import db, orm
+
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class HydraORMSweeperConf:
+    _target_: str = 'hydra_plugins.hydra_orm_sweeper.hydra_orm_sweeper.HydraORMSweeper'
+    db_url: str = omegaconf.MISSING
+    # the key of the config to look up in the composed job config, None for the root
+    config_key: typing.Optional[str] = None
+    # if False, jobs whose configs are saved are launched anyway and only logged
+    skip_existing: bool = True
+    max_batch_size: typing.Optional[int] = None
+    params: typing.Optional[typing.Dict[str, str]] = field(default=None)
+
+
+ConfigStore.instance().store(group='hydra/sweeper', name='hydra_orm', node=HydraORMSweeperConf, provider='hydra_orm')
+
+
+class HydraORMSweeper(Sweeper):
+    # sweeps the cartesian product of the overrides like Hydra's basic
+    # sweeper, but first looks up the configs of each batch of jobs with
+    # orm.find_saved_configs and launches only the unsaved ones
+    def __init__(self, db_url, config_key=None, skip_existing=True, max_batch_size=None, params=None):
+        super().__init__()
+        if max_batch_size is not None and max_batch_size <= 0:
+            raise ValueError(f'The max_batch_size of the sweeper has to be positive, got {max_batch_size}.')
+        self.db_url = db_url
+        self.config_key = config_key
+        self.skip_existing = skip_existing
+        self.max_batch_size = max_batch_size
+        self.params = {} if params is None else params
+        self.hydra_context = None
+        self.config = None
+        self.launcher = None
+
+    def setup(self, *, hydra_context, task_function, config):
+        self.hydra_context = hydra_context
+        self.config = config
+        self.launcher = Plugins.instance().instantiate_launcher(hydra_context=hydra_context, task_function=task_function, config=config)
+
+    def _job_batches(self, arguments):
+        parser = OverridesParser.create(config_loader=self.hydra_context.config_loader)
+        overrides = parser.parse_overrides([*(f'{k}={v}' for k, v in self.params.items()), *arguments])
+        # later overrides of a key replace the earlier ones, like the params
+        # replaced by the command line
+        choices = {}
+        for override in overrides:
+            key = override.get_key_element()
+            if not override.is_sweep_override():
+                choices[key] = [f'{key}={override.get_value_element_as_str()}']
+            elif override.is_discrete_sweep():
+                choices[key] = [f'{key}={value}' for value in override.sweep_string_iterator()]
+            else:
+                raise ValueError(f'The hydra_orm sweeper only sweeps over lists of values, got {override.input_line!r}.')
+        jobs = [list(job) for job in itertools.product(*choices.values())]
+        batch_size = len(jobs) if self.max_batch_size is None else self.max_batch_size
+        for batch_start in range(0, len(jobs), batch_size):
+            yield jobs[batch_start:batch_start + batch_size]
+
+    def sweep(self, arguments):
+        sweep_dir = pathlib.Path(self.config.hydra.sweep.dir)
+        sweep_dir.mkdir(parents=True, exist_ok=True)
+        omegaconf.OmegaConf.save(self.config, sweep_dir/'multirun.yaml')
+
+        returns = []
+        initial_job_idx = 0
+        for batch in self._job_batches(arguments):
+            batch = self._unsaved_jobs(batch)
+            if len(batch) == 0:
+                continue
+            # composes every job config before launching, so that errors are
+            # raised before any job runs
+            self.validate_batch_is_legal(batch)
+            results = self.launcher.launch(batch, initial_job_idx=initial_job_idx)
+            for result in results:
+                # raises the exception of a failed job
+                result.return_value
+            initial_job_idx += len(batch)
+            returns.append(results)
+        return returns
+
+    def _job_config(self, overrides):
+        cfg = self.hydra_context.config_loader.load_sweep_config(self.config, list(overrides))
+        if self.config_key is not None:
+            return omegaconf.OmegaConf.select(cfg, self.config_key, throw_on_missing=True)
+        with omegaconf.open_dict(cfg):
+            del cfg['hydra']
+        return cfg
+
+    def _unsaved_jobs(self, batch):
+        engine = db.create_engine(self.db_url)
+        try:
+            # the jobs create the tables too, so a new database is not an error
+            orm.create_all(db.writing(engine))
+            # the lookups only read, so they do not wait for running jobs
+            with sa_orm.Session(engine) as session:
+                saved_rows = orm.find_saved_configs(session, [self._job_config(overrides) for overrides in batch])
+        finally:
+            engine.dispose()
+
+        unsaved_batch = []
+        for overrides, row in zip(batch, saved_rows):
+            if row is None:
+                unsaved_batch.append(overrides)
+            else:
+                log.info(f"The config of the job {' '.join(overrides)} is saved as {row.__class__.__name__}.id={row.id}.")
+        if not self.skip_existing:
+            return batch
+        log.info(f'Skipping {len(batch) - len(unsaved_batch)} of {len(batch)} jobs whose configs are saved.')
+        return unsaved_batch
@@ -0,0 +1,169 @@
+import argparse
+import json
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+
+import sqlalchemy as sa
+import sqlalchemy.orm as sa_orm
+
+from hydra_orm import orm
+
+import cs
+
+
+INHERITANCE_TARGETS = {
+    0: cs.SubConfigOneToManySuperclass,
+    1: cs.SubConfigOneToManyInheritance1,
+}
+LATENCY_TOLERANCE = 0.2
+
+
+def make_config(i, nesting_depth=0, m2m_length=0, inheritance_depth=1):
+    # rng_seed makes every config distinct while the nested rows are shared,
+    # which is the common shape of a sweep
+    if nesting_depth > 0:
+        sub_config = dict(_target_=f'cs.{cs.SubConfigOneToManyReferencingSuperclassOneToMany.__name__}')
+        superclass = sub_config
+        for depth in range(nesting_depth):
+            superclass['superclass'] = dict(
+                _target_=f'cs.{cs.SubConfigOneToManyReferencingSuperclassOneToMany.__name__}' if depth < nesting_depth - 1 else f'cs.{INHERITANCE_TARGETS[inheritance_depth].__name__}',
+                value_superclass=depth,
+            )
+            superclass = superclass['superclass']
+    else:
+        sub_config = dict(_target_=f'cs.{INHERITANCE_TARGETS[inheritance_depth].__name__}')
+    return dict(
+        _target_=f'cs.{cs.Config.__name__}',
+        rng_seed=i,
+        sub_config_one_to_many_superclass=sub_config,
+        sub_config_many_to_many=[dict(_target_=f'cs.{cs.SubConfigManyToMany.__name__}', value=v) for v in range(m2m_length)],
+    )
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.count = 0
+        sa.event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def _session(engine, id_block_size):
+    session = sa_orm.Session(engine)
+    if id_block_size is not None:
+        orm.IdAllocator(block_size=id_block_size).attach(session)
+    return session
+
+
+def _fill(engine, start, stop, batch_size, id_block_size, **config_options):
+    for i in range(start, stop, batch_size):
+        with _session(engine, id_block_size) as session:
+            orm.instantiate_and_insert_configs(session, [
+                make_config(j, **config_options) for j in range(i, min(i + batch_size, stop))
+            ])
+            session.commit()
+
+
+def _measure(engine, counter, configs, id_block_size):
+    latencies = []
+    statements = counter.count
+    with _session(engine, id_block_size) as session:
+        for cfg in configs:
+            start = time.perf_counter()
+            orm.instantiate_and_insert_config(session, cfg)
+            session.commit()
+            latencies.append(time.perf_counter() - start)
+    statements = counter.count - statements
+    latencies.sort()
+    return dict(
+        configs_per_second=len(latencies) / sum(latencies),
+        latency_median=statistics.median(latencies),
+        latency_p95=latencies[int(0.95 * (len(latencies) - 1))],
+        statements_per_config=statements / len(latencies),
+    )
+
+
+def run(sizes, path, samples=100, batch_size=1000, nesting_depth=0, m2m_length=0, inheritance_depth=1, id_block_size=None):
+    engine = sa.create_engine(f'sqlite+pysqlite:///{path}')
+    orm.create_all(engine)
+    counter = StatementCounter(engine)
+    config_options = dict(nesting_depth=nesting_depth, m2m_length=m2m_length, inheritance_depth=inheritance_depth)
+
+    results = {}
+    rows = 0
+    for size in sorted(sizes):
+        _fill(engine, rows, size, batch_size, id_block_size, **config_options)
+        new = [make_config(size + j, **config_options) for j in range(samples)]
+        results[f'{size}/insert'] = _measure(engine, counter, new, id_block_size)
+        results[f'{size}/duplicate'] = _measure(engine, counter, new, id_block_size)
+        rows = size + samples
+    engine.dispose()
+    return dict(options=dict(samples=samples, id_block_size=id_block_size, **config_options), results=results)
+
+
+def compare(report, baseline):
+    regressions = []
+    if report['options'] != baseline['options']:
+        raise ValueError(f'Benchmark options {report["options"]} do not match the baseline options {baseline["options"]}.')
+    for name, result in report['results'].items():
+        saved = baseline['results'].get(name)
+        if saved is None:
+            continue
+        # statements per config are deterministic, so any increase is a regression
+        if result['statements_per_config'] > saved['statements_per_config']:
+            regressions.append(f'{name}: statements_per_config {saved["statements_per_config"]:.2f} -> {result["statements_per_config"]:.2f}')
+        if result['latency_median'] > (1 + LATENCY_TOLERANCE) * saved['latency_median']:
+            regressions.append(f'{name}: latency_median {saved["latency_median"] * 1e3:.2f}ms -> {result["latency_median"] * 1e3:.2f}ms')
+    return regressions
+
+
+def print_report(report):
+    print(f'{"rows/mode":>20} {"configs/s":>10} {"median ms":>10} {"p95 ms":>10} {"stmts/config":>13}')
+    for name, result in report['results'].items():
+        print(
+            f'{name:>20} {result["configs_per_second"]:>10.1f} {result["latency_median"] * 1e3:>10.2f}'
+            f' {result["latency_p95"] * 1e3:>10.2f} {result["statements_per_config"]:>13.2f}'
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark instantiate_and_insert_config on file-backed SQLite.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000, 1_000_000], help='number of Config rows to measure at')
+    parser.add_argument('--samples', type=int, default=100, help='number of configs measured at each size')
+    parser.add_argument('--batch-size', type=int, default=1000, help='number of configs per bulk insert when growing the table')
+    parser.add_argument('--nesting-depth', type=int, default=0)
+    parser.add_argument('--m2m-length', type=int, default=0)
+    parser.add_argument('--inheritance-depth', type=int, default=1, choices=sorted(INHERITANCE_TARGETS))
+    parser.add_argument('--id-block-size', type=int, default=None, help='attach an IdAllocator with this block size, to insert each config with one flush')
+    parser.add_argument('--database', type=pathlib.Path, default=None, help='SQLite file to use, a temporary file by default')
+    parser.add_argument('--save-baseline', type=pathlib.Path, default=None)
+    parser.add_argument('--baseline', type=pathlib.Path, default=None, help='baseline to compare against, exits with 1 on regressions')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.database or pathlib.Path(tmp_dir)/'benchmark.sqlite'
+        if path.exists():
+            raise ValueError(f'Database {path} already exists.')
+        report = run(
+            args.sizes, path, samples=args.samples, batch_size=args.batch_size,
+            nesting_depth=args.nesting_depth, m2m_length=args.m2m_length, inheritance_depth=args.inheritance_depth,
+            id_block_size=args.id_block_size,
+        )
+    print_report(report)
+
+    if args.save_baseline is not None:
+        args.save_baseline.write_text(json.dumps(report, indent=2))
+    if args.baseline is not None:
+        regressions = compare(report, json.loads(args.baseline.read_text()))
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if len(regressions) > 0 else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+import argparse
+import multiprocessing
+import pathlib
+import sys
+import tempfile
+import time
+
+import sqlalchemy as sa
+import sqlalchemy.orm as sa_orm
+
+from hydra_orm import db, orm
+
+from benchmark import make_config
+
+
+ENGINES = ('bare', 'tuned')
+
+
+def _create_engine(engine_kind, db_url):
+    if engine_kind == 'bare':
+        return sa.create_engine(db_url)
+    return db.create_engine(db_url, launcher='joblib')
+
+
+def _write(engine_kind, db_url, configs, config_options):
+    # one writer stands for the jobs that a launcher runs in one worker
+    # process, each inserting its config in its own transaction
+    engine = _create_engine(engine_kind, db_url)
+    failed = 0
+
+    def insert(cfg):
+        with sa_orm.Session(engine if engine_kind == 'bare' else db.writing(engine)) as session:
+            orm.instantiate_and_insert_config(session, cfg)
+            session.commit()
+
+    for i in configs:
+        cfg = make_config(i, **config_options)
+        try:
+            if engine_kind == 'bare':
+                insert(cfg)
+            else:
+                db.retry_on_lock(lambda: insert(cfg))
+        except sa.exc.IntegrityError:
+            # another writer inserted a shared row between the lookup and the insert
+            failed += 1
+        except sa.exc.OperationalError as e:
+            if not db.is_locked_error(e):
+                raise
+            failed += 1
+    engine.dispose()
+    return failed
+
+
+def run(path, engine_kind, writers=4, configs_per_writer=100, nesting_depth=0, m2m_length=0):
+    db_url = f'sqlite+pysqlite:///{path}'
+    engine = _create_engine(engine_kind, db_url)
+    orm.create_all(engine)
+    engine.dispose()
+    config_options = dict(nesting_depth=nesting_depth, m2m_length=m2m_length)
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(writers) as pool:
+        failed = sum(pool.starmap(_write, [
+            (engine_kind, db_url, range(w * configs_per_writer, (w + 1) * configs_per_writer), config_options)
+            for w in range(writers)
+        ]))
+    seconds = time.perf_counter() - start
+    inserted = writers * configs_per_writer - failed
+    return dict(engine=engine_kind, writers=writers, configs_per_second=inserted / seconds, inserted=inserted, failed=failed)
+
+
+def print_report(results):
+    print(f'{"engine":>8} {"writers":>8} {"configs/s":>10} {"inserted":>9} {"failed":>7}')
+    for result in results:
+        print(
+            f'{result["engine"]:>8} {result["writers"]:>8} {result["configs_per_second"]:>10.1f}'
+            f' {result["inserted"]:>9} {result["failed"]:>7}'
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark concurrent writers of instantiate_and_insert_config on file-backed SQLite.')
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=ENGINES, help='bare sqlalchemy.create_engine or hydra_orm.db.create_engine')
+    parser.add_argument('--writers', type=int, nargs='+', default=[1, 4, 8], help='numbers of concurrent writer processes')
+    parser.add_argument('--configs-per-writer', type=int, default=100)
+    parser.add_argument('--nesting-depth', type=int, default=0)
+    parser.add_argument('--m2m-length', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for engine_kind in args.engines:
+            for writers in args.writers:
+                results.append(run(
+                    pathlib.Path(tmp_dir)/f'{engine_kind}-{writers}.sqlite', engine_kind, writers=writers,
+                    configs_per_writer=args.configs_per_writer, nesting_depth=args.nesting_depth, m2m_length=args.m2m_length,
+                ))
+    print_report(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -62,6 +62,54 @@ class SubConfigOneToManyReferencingSuperclassOneToMany(SubConfigOneToManySupercl
     superclass = orm.OneToManyField(SubConfigOneToManySuperclass, default_factory=SubConfigOneToManySuperclass)
 
 
+class SubConfigSingleTableSuperclass(orm.InheritableTable, inheritance=orm.SINGLE_TABLE_INHERITANCE):
+    value_superclass: int = orm.make_field(orm.ColumnRequired(sa.Integer), default=1)
+
+
+class SubConfigSingleTableInheritance1(SubConfigSingleTableSuperclass):
+    value: int = orm.make_field(orm.ColumnRequired(sa.Integer), default=1)
+
+
+class SubConfigSingleTableInheritance2(SubConfigSingleTableSuperclass):
+    value: int = orm.make_field(orm.ColumnRequired(sa.Integer), default=1)
+    many_to_many = orm.ManyToManyField(SubConfigManyToMany, default_factory=list)
+
+
+class SubConfigSingleTableReferencingSuperclass(SubConfigSingleTableSuperclass):
+    superclass = orm.OneToManyField(SubConfigSingleTableSuperclass, default_factory=SubConfigSingleTableSuperclass)
+
+
+# tables looked up by their fingerprint column instead of their deduplication columns
+class FingerprintedSubConfigManyToManySuperclass(orm.InheritableTable, fingerprint=True):
+    value_superclass: int = orm.make_field(orm.ColumnRequired(sa.Integer), default=1)
+
+
+class FingerprintedSubConfigManyToManyInheritance1(FingerprintedSubConfigManyToManySuperclass):
+    value: int = orm.make_field(orm.ColumnRequired(sa.Integer), default=1)
+
+
+class FingerprintedSubConfigManyToManyInheritance2(FingerprintedSubConfigManyToManySuperclass):
+    value: int = orm.make_field(orm.ColumnRequired(sa.Integer), default=1)
+
+
+class FingerprintedSubConfigOneToMany(orm.Table, fingerprint=True):
+    value: int = orm.make_field(orm.ColumnRequired(sa.Integer), default=1)
+    many_to_many = orm.ManyToManyField(SubConfigManyToMany, default_factory=list)
+    many_to_many_superclass = orm.ManyToManyField(FingerprintedSubConfigManyToManySuperclass, default_factory=list)
+
+
+class FingerprintedSubConfigOneToManySuperclass(orm.InheritableTable, fingerprint=True):
+    value_superclass: int = orm.make_field(orm.ColumnRequired(sa.Integer), default=1)
+
+
+class FingerprintedSubConfigOneToManyInheritance1(FingerprintedSubConfigOneToManySuperclass):
+    value: int = orm.make_field(orm.ColumnRequired(sa.Integer), default=1)
+
+
+class FingerprintedSubConfigOneToManyReferencingSuperclassOneToMany(FingerprintedSubConfigOneToManySuperclass):
+    superclass = orm.OneToManyField(FingerprintedSubConfigOneToManySuperclass, default_factory=FingerprintedSubConfigOneToManySuperclass)
+
+
 class Config(orm.Table):
     defaults: typing.List[typing.Any] = hydra_orm.utils.make_defaults_list([
         dict(sub_config_one_to_many_superclass=SubConfigOneToManyInheritance1.__name__),
@@ -75,6 +123,7 @@ class Config(orm.Table):
     sub_config_one_to_many_custom_column_name = orm.OneToManyField(SubConfigOneToMany, default_factory=SubConfigOneToMany, column_name=f'{SubConfigOneToMany.__name__}_custom_column_name')
     sub_config_one_to_many_superclass = orm.OneToManyField(SubConfigOneToManySuperclass, required=True, default=omegaconf.MISSING)
     sub_config_one_to_many_superclass_element_type_not_enforced = orm.OneToManyField(SubConfigOneToManySuperclass, required=False, default=None, enforce_element_type=False, column_name='SubConfigOneToManySuperclass_element_type_not_enforced')
+    sub_config_single_table = orm.OneToManyField(SubConfigSingleTableSuperclass, default_factory=SubConfigSingleTableInheritance1)
     sub_config_many_to_many = orm.ManyToManyField(SubConfigManyToMany, default_factory=list)
     sub_config_many_to_many_custom_m2m_table_name = orm.ManyToManyField(SubConfigManyToMany, default_factory=list, m2m_table_name=f'{SubConfigManyToMany.__name__}_custom_m2m_table_name')
     sub_config_many_to_many_superclass = orm.ManyToManyField(SubConfigManyToManySuperclass, default_factory=list)
@@ -95,8 +144,53 @@ class ReferencingConfig(orm.Table):
         return config[0]
 
 
+class BatchReferencingConfig(orm.Table):
+    config = orm.OneToManyField(Config, required=False, enforce_element_type=False)
+
+    @staticmethod
+    def transform_many_config(session, config_alt_ids):
+        saved_alt_ids = [config_alt_id for config_alt_id in config_alt_ids if config_alt_id is not None]
+        configs = {}
+        if len(saved_alt_ids) > 0:
+            configs = {config.alt_id: config for config in session.scalars(sa.select(Config).where(Config.alt_id.in_(saved_alt_ids)))}
+        for config_alt_id in config_alt_ids:
+            if config_alt_id is not None and config_alt_id not in configs:
+                raise ValueError(f'No Config with Config.alt_id={config_alt_id!r} was found.')
+        return [None if config_alt_id is None else configs[config_alt_id] for config_alt_id in config_alt_ids]
+
+
+class BatchReferences(orm.Table):
+    one_reference = orm.OneToManyField(BatchReferencingConfig, required=False, default=None)
+    list_of_references = orm.ManyToManyField(BatchReferencingConfig, default_factory=list)
+
+
+class AsyncReferencingConfig(orm.Table):
+    config = orm.OneToManyField(Config, required=False, enforce_element_type=False)
+
+    @staticmethod
+    async def transform_config(session, config_alt_id):
+        if config_alt_id is None:
+            return None
+        config = (await session.execute(sa.select(Config).where(Config.alt_id == config_alt_id))).first()
+        if config is None:
+            raise ValueError(f'No Config with Config.alt_id={config_alt_id!r} was found.')
+        return config[0]
+
+
+class ForwardReferencesConfig(orm.Table):
+    sub_config = orm.OneToManyField('ForwardReferencingSubConfig', required=False, default=None)
+
+
+class ForwardReferencingSubConfig(orm.Table):
+    later = orm.OneToManyField('LaterSubConfig', required=False, default=None)
+
+
+class LaterSubConfig(orm.Table):
+    value: int = orm.make_field(orm.ColumnRequired(sa.Integer), default=1)
+
+
 sa.event.listens_for(Config, 'before_insert')(
-    hydra_orm.utils.set_attr_to_func_value(Config, Config.alt_id.key, hydra_orm.utils.generate_random_string)
+    hydra_orm.utils.set_attr_to_unique_func_values(Config, Config.alt_id.key, hydra_orm.utils.generate_random_string)
 )
 
 
@@ -0,0 +1,26 @@
+import json
+
+import benchmark
+import benchmark_writers
+
+
+def test_benchmark_reports_and_compares_against_baseline(tmp_path):
+    baseline = tmp_path/'baseline.json'
+    args = ['--sizes', '5', '10', '--samples', '3', '--nesting-depth', '2', '--m2m-length', '2']
+    assert benchmark.main([*args, '--database', str(tmp_path/'benchmark.sqlite'), '--save-baseline', str(baseline)]) == 0
+
+    report = json.loads(baseline.read_text())
+    assert set(report['results']) == {'5/insert', '5/duplicate', '10/insert', '10/duplicate'}
+    # duplicates are found without inserting anything
+    assert report['results']['10/duplicate']['statements_per_config'] < report['results']['10/insert']['statements_per_config']
+
+    assert benchmark.compare(report, report) == []
+    saved = json.loads(baseline.read_text())
+    report['results']['10/insert']['statements_per_config'] += 1
+    regressions = benchmark.compare(report, saved)
+    assert len(regressions) == 1 and regressions[0].startswith('10/insert: statements_per_config')
+
+
+def test_writers_benchmark_inserts_every_config_with_tuned_engine(tmp_path):
+    result = benchmark_writers.run(tmp_path/'writers.sqlite', 'tuned', writers=2, configs_per_writer=3, nesting_depth=1)
+    assert result['inserted'] == 6 and result['failed'] == 0
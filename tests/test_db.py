@@ -0,0 +1,61 @@
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.orm as sa_orm
+import sqlalchemy.pool
+
+from fixtures import init_hydra_cfg
+import cs
+
+from hydra_orm import db, orm
+
+
+def test_create_engine_sets_pragmas_and_pool_per_launcher(tmp_path):
+    engine = db.create_engine(f'sqlite+pysqlite:///{tmp_path / "runs.sqlite"}', launcher='joblib', pragmas=dict(cache_size=-1000))
+    assert isinstance(engine.pool, sqlalchemy.pool.NullPool)
+    orm.create_all(engine)
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+        assert connection.exec_driver_sql('PRAGMA busy_timeout').scalar() == 30_000
+        assert connection.exec_driver_sql('PRAGMA cache_size').scalar() == -1000
+    with sa_orm.Session(engine) as session:
+        orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', []))
+        session.commit()
+        assert session.scalar(sa.select(sa.func.count()).select_from(cs.Config)) == 1
+    engine.dispose()
+
+    assert not isinstance(db.create_engine(f'sqlite+pysqlite:///{tmp_path / "runs.sqlite"}', launcher='basic').pool, sqlalchemy.pool.NullPool)
+
+
+def test_writing_transactions_take_the_write_lock_when_they_begin(tmp_path):
+    engine = db.create_engine(f'sqlite+pysqlite:///{tmp_path / "runs.sqlite"}', pragmas=dict(busy_timeout=0))
+    orm.create_all(db.writing(engine))
+    with db.writing(engine).connect() as writer, db.writing(engine).connect() as other_writer, engine.connect() as reader:
+        writer.execute(sa.select(cs.Config.id)).all()
+        with pytest.raises(sa.exc.OperationalError) as e:
+            other_writer.execute(sa.select(cs.Config.id)).all()
+        assert db.is_locked_error(e.value)
+        # reading transactions stay deferred, so they go on while a job writes
+        assert reader.execute(sa.select(cs.Config.id)).all() == []
+        with engine.connect() as other_reader:
+            assert other_reader.execute(sa.select(cs.Config.id)).all() == []
+    engine.dispose()
+
+
+def test_retry_on_lock_backs_off_and_reraises_other_errors():
+    locked = sa.exc.OperationalError('BEGIN IMMEDIATE', {}, Exception('database is locked'))
+    calls = []
+    delays = []
+
+    def func():
+        calls.append(None)
+        if len(calls) < 3:
+            raise locked
+        return 'done'
+    assert db.retry_on_lock(func, initial_delay=1., sleep=delays.append) == 'done'
+    assert len(calls) == 3 and len(delays) == 2 and all(0 <= d <= 2 for d in delays)
+
+    with pytest.raises(sa.exc.OperationalError):
+        db.retry_on_lock(lambda: (_ for _ in ()).throw(locked), max_attempts=2, sleep=delays.append)
+    other = sa.exc.OperationalError('SELECT', {}, Exception('no such table: Config'))
+    with pytest.raises(sa.exc.OperationalError):
+        db.retry_on_lock(lambda: (_ for _ in ()).throw(other), sleep=lambda d: pytest.fail('retried'))
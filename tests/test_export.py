@@ -0,0 +1,58 @@
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.orm as sa_orm
+
+from fixtures import init_hydra_cfg, engine
+import cs
+
+from hydra_orm import export, orm
+
+
+@pytest.fixture(params=['.jsonl', '.parquet'])
+def suffix(request):
+    if request.param == '.parquet':
+        pytest.importorskip('pyarrow')
+    return request.param
+
+
+def test_export_then_import_round_trips_configs(engine, tmp_path, suffix):
+    overrides_list = [
+        [],
+        ['string=STRING2'],
+        ['sub_config_one_to_many.value=3'],
+        ['sub_config_one_to_many_superclass=SubConfigOneToManyReferencingSuperclassOneToMany'],
+        ['sub_config_many_to_many=[{value:1},{value:2}]', 'sub_config_many_to_many_superclass=[{_target_:cs.SubConfigManyToManyInheritance1},{_target_:cs.SubConfigManyToManyInheritance2}]'],
+    ]
+    with sa_orm.Session(engine) as session:
+        cfg = orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', []))
+        session.commit()
+        for overrides in [*overrides_list, [f'one_reference.config={cfg.alt_id}']]:
+            orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', overrides))
+        session.commit()
+        assert export.export_configs(session, cs.Config, tmp_path/f'configs{suffix}', chunk_size=2) == 6
+        exported = [export.flatten_config(row) for row in session.scalars(sa.select(cs.Config).order_by(cs.Config.id))]
+
+    engine_import = sa.create_engine('sqlite+pysqlite:///:memory:')
+    orm.create_all(engine_import)
+    with sa_orm.Session(engine_import) as session:
+        for _ in range(2):
+            assert export.import_configs(session, tmp_path/f'configs{suffix}', batch_size=4) == 6
+            session.commit()
+        imported = [export.flatten_config(row) for row in session.scalars(sa.select(cs.Config).order_by(cs.Config.id))]
+    assert imported == exported
+
+
+def test_export_selected_configs(engine, tmp_path):
+    with sa_orm.Session(engine) as session:
+        for overrides in [[], ['string=STRING2']]:
+            orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', overrides))
+        session.commit()
+        assert export.export_configs(session, orm.select_configs(cs.Config, ['string=STRING2']), tmp_path/'configs.jsonl') == 1
+    records = list(export._read_jsonl(tmp_path/'configs.jsonl', batch_size=10))[0]
+    assert export.unflatten_config(records[0])['string'] == 'STRING2'
+
+
+def test_unknown_export_format_raises(engine, tmp_path):
+    with sa_orm.Session(engine) as session:
+        with pytest.raises(ValueError):
+            export.export_configs(session, cs.Config, tmp_path/'configs.csv')
@@ -0,0 +1,62 @@
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.orm as sa_orm
+
+from fixtures import init_hydra_cfg, engine
+import cs
+
+from hydra_orm import orm
+
+np = pytest.importorskip('numpy')
+frame = pytest.importorskip('hydra_orm.frame')
+
+
+def test_load_sweep_frame(engine):
+    with sa_orm.Session(engine) as session:
+        for overrides in [
+            [],
+            ['string=STRING2'],
+            ['sub_config_one_to_many.value=3', 'sub_config_one_to_many_superclass=SubConfigOneToManyInheritance2'],
+            ['sub_config_many_to_many=[{value:1},{value:2}]'],
+        ]:
+            orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', overrides))
+        session.commit()
+
+        statements = []
+        sa.event.listen(engine, 'after_cursor_execute', lambda *args: statements.append(args[2]))
+        sweep_frame = frame.load_sweep_frame(session, cs.Config)
+        assert len(statements) == 1 + len(sweep_frame.many_to_many)
+
+    assert len(sweep_frame) == 4
+    np.testing.assert_array_equal(sweep_frame.ids, [1, 2, 3, 4])
+    np.testing.assert_array_equal(sweep_frame.columns['rng_seed'], [42, 42, 42, 42])
+    assert 'alt_id' not in sweep_frame.columns
+    assert 'not_saved_in_database' not in sweep_frame.columns
+
+    assert sweep_frame.categories['string'] == ('STRING1', 'STRING2')
+    np.testing.assert_array_equal(sweep_frame.columns['string'], [0, 1, 0, 0])
+    np.testing.assert_array_equal(sweep_frame.columns['sub_config_one_to_many.value'], [1, 1, 3, 1])
+
+    targets = sweep_frame.categories['sub_config_one_to_many_superclass._target_']
+    assert [targets[i] for i in sweep_frame.columns['sub_config_one_to_many_superclass._target_']] == [
+        'SubConfigOneToManyInheritance1', 'SubConfigOneToManyInheritance1', 'SubConfigOneToManyInheritance2', 'SubConfigOneToManyInheritance1',
+    ]
+    # value is a column of both subclasses
+    np.testing.assert_array_equal(sweep_frame.columns['sub_config_one_to_many_superclass.value'], [1, 1, 1, 1])
+    assert np.isnan(sweep_frame.columns['sub_config_one_to_many_superclass_element_type_not_enforced.value_superclass']).all()
+    # single-table subclasses are read from the columns of the shared table
+    np.testing.assert_array_equal(sweep_frame.columns['sub_config_single_table.value'], [1, 1, 1, 1])
+
+    offsets, ids = sweep_frame.many_to_many['sub_config_many_to_many']
+    np.testing.assert_array_equal(offsets, [0, 0, 0, 0, 2])
+    np.testing.assert_array_equal(ids, [1, 2])
+
+
+def test_load_sweep_frame_of_selected_configs(engine):
+    with sa_orm.Session(engine) as session:
+        for overrides in [[], ['string=STRING2']]:
+            orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', overrides))
+        session.commit()
+        sweep_frame = frame.load_sweep_frame(session, orm.select_configs(cs.Config, ['string=STRING2']))
+    np.testing.assert_array_equal(sweep_frame.ids, [2])
+    np.testing.assert_array_equal(sweep_frame.columns['string'], [1])
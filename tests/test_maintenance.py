@@ -0,0 +1,298 @@
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.orm as sa_orm
+
+from fixtures import init_hydra_cfg, engine
+import cs
+
+from hydra_orm import maintenance, orm
+
+
+def _add_duplicates(session):
+    # duplicates as left by older concurrent runs, whose lookups missed each other
+    cfg = orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', ['sub_config_many_to_many=[{value:1},{value:2}]']))
+    session.commit()
+    m2m_duplicate = cs.SubConfigManyToMany(value=1)
+    sub_config_duplicate = cs.SubConfigOneToManyInheritance1()
+    session.add_all([m2m_duplicate, sub_config_duplicate])
+    session.flush()
+    cfg_duplicate = cs.Config(**{
+        **{k: getattr(cfg, k) for k in cfg.__table_plan__.persisted},
+        'sub_config_one_to_many_superclass': sub_config_duplicate,
+        'sub_config_many_to_many': [m2m_duplicate, cfg.sub_config_many_to_many[1]],
+    })
+    references = [cs.ReferencingConfig(config=cfg), cs.ReferencingConfig(config=cfg_duplicate)]
+    sub_config_one_to_many = cs.FingerprintedSubConfigOneToMany(value=5, many_to_many=[m2m_duplicate])
+    session.add_all([cfg_duplicate, *references, sub_config_one_to_many])
+    session.commit()
+    return cfg, m2m_duplicate, sub_config_duplicate, cfg_duplicate, references, sub_config_one_to_many
+
+
+def test_find_duplicates_reports_groups_without_changes(engine):
+    with sa_orm.Session(engine) as session:
+        cfg, m2m_duplicate, sub_config_duplicate, *_ = _add_duplicates(session)
+        assert maintenance.find_duplicates(session) == {
+            'SubConfigManyToMany': [(cfg.sub_config_many_to_many[0].id, [m2m_duplicate.id])],
+            'SubConfigOneToManyInheritance1': [(cfg.sub_config_one_to_many_superclass.id, [sub_config_duplicate.id])],
+        }
+        assert session.get(cs.SubConfigManyToMany, m2m_duplicate.id) is not None
+
+
+def test_find_duplicates_compares_many_to_many_rows_instead_of_stored_digests(engine):
+    with sa_orm.Session(engine) as session:
+        sub_configs = [
+            orm.instantiate_and_insert_config(session, {'_target_': 'cs.SubConfigOneToMany', 'many_to_many': [{'_target_': 'cs.SubConfigManyToMany', 'value': value}]})
+            for value in [1, 2]
+        ]
+        session.commit()
+        # a stale digest, as left by an edit of the association table
+        session.execute(
+            sa.update(cs.SubConfigOneToMany).where(cs.SubConfigOneToMany.id == sub_configs[1].id)
+            .values(many_to_many_digest=sub_configs[0].many_to_many_digest)
+        )
+        session.commit()
+
+        assert maintenance.find_duplicates(session) == {}
+        assert maintenance.merge_duplicates(session).duplicates == {}
+
+
+def test_merge_duplicates_repoints_references_until_no_duplicates_are_left(engine):
+    with sa_orm.Session(engine) as session:
+        cfg, m2m_duplicate, sub_config_duplicate, cfg_duplicate, references, sub_config_one_to_many = _add_duplicates(session)
+        m2m_id = cfg.sub_config_many_to_many[0].id
+        ids = dict(
+            cfg=cfg.id, m2m_duplicate=m2m_duplicate.id, sub_config=cfg.sub_config_one_to_many_superclass.id,
+            sub_config_duplicate=sub_config_duplicate.id, cfg_duplicate=cfg_duplicate.id,
+            references=[r.id for r in references], sub_config_one_to_many=sub_config_one_to_many.id,
+        )
+        report = maintenance.merge_duplicates(session)
+        session.commit()
+
+        # Config and ReferencingConfig rows only become duplicates once the rows they reference are merged
+        assert report.duplicates == {
+            'SubConfigManyToMany': [(m2m_id, [ids['m2m_duplicate']])],
+            'SubConfigOneToManyInheritance1': [(ids['sub_config'], [ids['sub_config_duplicate']])],
+            'Config': [(ids['cfg'], [ids['cfg_duplicate']])],
+            'ReferencingConfig': [(ids['references'][0], [ids['references'][1]])],
+        }
+        assert report.deleted['SubConfigOneToManySuperclass'] == report.deleted['SubConfigOneToManyInheritance1'] == 1
+        assert maintenance.find_duplicates(session) == {}
+        assert session.get(cs.Config, ids['cfg_duplicate']) is None
+        assert session.get(cs.SubConfigOneToManySuperclass, ids['sub_config_duplicate']) is None
+
+        # digests and fingerprints of repointed rows match their references again
+        sub_config_one_to_many = session.get(cs.FingerprintedSubConfigOneToMany, ids['sub_config_one_to_many'])
+        assert [v.id for v in sub_config_one_to_many.many_to_many] == [m2m_id]
+        assert sub_config_one_to_many.many_to_many_digest == orm.many_to_many_digest(sub_config_one_to_many.many_to_many)
+        cfg = orm.instantiate_and_insert_config(session, {'_target_': 'cs.FingerprintedSubConfigOneToMany', 'value': 5, 'many_to_many': [{'_target_': 'cs.SubConfigManyToMany', 'value': 1}]})
+        assert cfg is sub_config_one_to_many
+
+
+def test_duplicates_command_merges_database(tmp_path):
+    db_url = f'sqlite+pysqlite:///{tmp_path / "runs.sqlite"}'
+    engine = sa.create_engine(db_url)
+    orm.create_all(engine)
+    with sa_orm.Session(engine) as session:
+        _add_duplicates(session)
+    engine.dispose()
+
+    assert maintenance.main(['--import', 'cs', 'duplicates', db_url]) == 1
+    assert maintenance.main(['--import', 'cs', 'duplicates', db_url, '--merge']) == 0
+    assert maintenance.main(['--import', 'cs', 'duplicates', db_url]) == 0
+
+
+def _delete_config(session, cfg):
+    # as a user would, leaving the rows that the config referenced
+    for association_table in cs.Config.__table__.metadata.tables.values():
+        for c in association_table.primary_key.columns:
+            if any(fk.column.table is cs.Config.__table__ for fk in c.foreign_keys):
+                session.execute(sa.delete(association_table).where(c == cfg.id))
+    session.commit()
+    session.delete(cfg)
+    session.commit()
+    session.expunge_all()
+
+
+@pytest.fixture
+def engine_with_foreign_keys():
+    # SQLite only enforces foreign keys when asked to
+    engine = sa.create_engine('sqlite+pysqlite:///:memory:')
+    sa.event.listen(engine, 'connect', lambda dbapi_connection, _: dbapi_connection.execute('PRAGMA foreign_keys=ON'))
+    orm.create_all(engine)
+    return engine
+
+
+def test_collect_garbage_deletes_rows_unreachable_from_roots(engine_with_foreign_keys):
+    engine = engine_with_foreign_keys
+    with sa_orm.Session(engine) as session:
+        kept = orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', ['sub_config_many_to_many=[{value:1}]']))
+        deleted = orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', [
+            'rng_seed=1', 'sub_config_many_to_many=[{value:2}]',
+            'sub_config_one_to_many_superclass=SubConfigOneToManyReferencingSuperclassOneToMany',
+        ]))
+        session.commit()
+        kept_id = kept.id
+        chain_ids = [deleted.sub_config_one_to_many_superclass.id, deleted.sub_config_one_to_many_superclass.superclass.id]
+        m2m_id = deleted.sub_config_many_to_many[0].id
+        _delete_config(session, deleted)
+
+        report = maintenance.collect_garbage(session, [cs.Config], dry_run=True)
+        assert report.unreachable == {'SubConfigManyToMany': 1, 'SubConfigOneToManySuperclass': 2}
+        assert report.deleted == {}
+        assert session.get(cs.SubConfigManyToMany, m2m_id) is not None
+
+        report = maintenance.collect_garbage(session, [cs.Config], batch_size=1)
+        assert report.deleted == {
+            'SubConfigOneToManyReferencingSuperclassOneToMany': 1,
+            'SubConfigOneToManySuperclass': 2,
+            'SubConfigManyToMany': 1,
+        }
+        # the parent rows of joined-inheritance subclasses go with them
+        for row_id in chain_ids:
+            assert session.get(cs.SubConfigOneToManySuperclass, row_id) is None
+        assert session.get(cs.SubConfigManyToMany, m2m_id) is None
+        assert maintenance.collect_garbage(session, [cs.Config]).unreachable == {}
+        kept = session.get(cs.Config, kept_id)
+        assert [v.value for v in kept.sub_config_many_to_many] == [1]
+
+
+def test_collect_garbage_deletes_referencing_rows_of_tables_defined_first(engine_with_foreign_keys):
+    with sa_orm.Session(engine_with_foreign_keys) as session:
+        cfg = cs.ForwardReferencesConfig(sub_config=cs.ForwardReferencingSubConfig(later=cs.LaterSubConfig(value=2)))
+        session.add(cfg)
+        session.commit()
+        session.delete(cfg)
+        session.commit()
+
+        report = maintenance.collect_garbage(session, [cs.ForwardReferencesConfig])
+        assert report.deleted == {'ForwardReferencingSubConfig': 1, 'LaterSubConfig': 1}
+
+
+def test_collect_garbage_keeps_rows_referenced_from_tables_that_are_not_collected(engine_with_foreign_keys):
+    with sa_orm.Session(engine_with_foreign_keys) as session:
+        orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', []))
+        # the Config rows cannot reach FingerprintedSubConfigOneToMany rows,
+        # which reference SubConfigManyToMany rows
+        sub_config = orm.instantiate_and_insert_config(session, {
+            '_target_': 'cs.FingerprintedSubConfigOneToMany',
+            'many_to_many': [{'_target_': 'cs.SubConfigManyToMany', 'value': 7}],
+        })
+        session.commit()
+        m2m_id = sub_config.many_to_many[0].id
+
+        report = maintenance.collect_garbage(session, [cs.Config])
+        assert 'SubConfigManyToMany' not in report.unreachable
+        assert session.get(cs.SubConfigManyToMany, m2m_id) is not None
+        assert [v.value for v in session.get(cs.FingerprintedSubConfigOneToMany, sub_config.id).many_to_many] == [7]
+
+
+def _create_old_schema(engine, dropped_columns, dropped_tables):
+    # the schema before the fields of dropped_columns and the tables of dropped_tables were added
+    metadata = sa.MetaData()
+    for table in orm.mapper_registry.metadata.tables.values():
+        if table.name in dropped_tables:
+            continue
+        if table.name in dropped_columns:
+            sa.Table(table.name, metadata, *(c._copy() for c in table.columns if c.name not in dropped_columns[table.name]))
+        else:
+            table.to_metadata(metadata)
+    metadata.create_all(engine)
+
+
+def test_sync_schema_adds_fields_that_saved_rows_take_the_defaults_of():
+    engine = sa.create_engine('sqlite+pysqlite:///:memory:')
+    _create_old_schema(
+        engine,
+        dropped_columns={
+            'FingerprintedSubConfigOneToMany': {'value', 'many_to_many_superclass_digest'},
+            'FingerprintedSubConfigOneToManyReferencingSuperclassOneToMany': {'FingerprintedSubConfigOneToManySuperclass'},
+        },
+        dropped_tables={'FingerprintedSubConfigOneToMany__FingerprintedSubConfigManyToManySuperclass'},
+    )
+    with engine.begin() as connection:
+        connection.exec_driver_sql('DROP INDEX "ix_FingerprintedSubConfigOneToMany_sa_fingerprint"')
+        connection.execute(sa.insert(sa.table('FingerprintedSubConfigOneToMany', sa.column('id'), sa.column('sa_fingerprint'), sa.column('many_to_many_digest'))), dict(id=1, sa_fingerprint='old', many_to_many_digest=orm.ids_digest([])))
+        connection.execute(sa.insert(sa.table('FingerprintedSubConfigOneToManySuperclass', sa.column('id'), sa.column('sa_inheritance'), sa.column('value_superclass'), sa.column('sa_fingerprint'))), dict(id=1, sa_inheritance='FingerprintedSubConfigOneToManyReferencingSuperclassOneToMany', value_superclass=1, sa_fingerprint='old'))
+        connection.execute(sa.insert(sa.table('FingerprintedSubConfigOneToManyReferencingSuperclassOneToMany', sa.column('id'))), dict(id=1))
+
+    with sa_orm.Session(engine) as session:
+        report = maintenance.sync_schema(session, batch_size=1)
+        session.commit()
+        assert report.created_tables == ['FingerprintedSubConfigOneToMany__FingerprintedSubConfigManyToManySuperclass']
+        assert sorted(report.added_columns) == [
+            'FingerprintedSubConfigOneToMany.many_to_many_superclass_digest',
+            'FingerprintedSubConfigOneToMany.value',
+            'FingerprintedSubConfigOneToManyReferencingSuperclassOneToMany.FingerprintedSubConfigOneToManySuperclass',
+        ]
+        assert report.created_indexes == ['ix_FingerprintedSubConfigOneToMany_sa_fingerprint']
+        assert report.rehashed == {'FingerprintedSubConfigOneToMany': 1, 'FingerprintedSubConfigOneToManySuperclass': 1}
+
+        # the saved rows are found by the lookups of configs that leave out the new fields
+        assert orm.instantiate_and_insert_config(session, {'_target_': 'cs.FingerprintedSubConfigOneToMany'}).id == 1
+        row = orm.instantiate_and_insert_config(session, {'_target_': 'cs.FingerprintedSubConfigOneToManyReferencingSuperclassOneToMany'})
+        assert row.id == 1 and row.superclass.id == 2
+        assert maintenance.sync_schema(session) == maintenance.SchemaSyncReport()
+
+
+def test_sync_schema_computes_digests_of_saved_many_to_many_rows():
+    # a database of a version without the many-to-many digest columns
+    engine = sa.create_engine('sqlite+pysqlite:///:memory:')
+    _create_old_schema(
+        engine,
+        dropped_columns={
+            table.name: {c.name for c in table.columns if c.name.endswith('_digest')}
+            for table in orm.mapper_registry.metadata.tables.values()
+        },
+        dropped_tables=set(),
+    )
+    members = {1: [1, 2], 2: [2], 3: []}
+    with engine.begin() as connection:
+        connection.execute(sa.insert(sa.table('SubConfigManyToMany', sa.column('id'), sa.column('value'))), [dict(id=1, value=1), dict(id=2, value=2)])
+        for table_name in ['SubConfigOneToMany', 'FingerprintedSubConfigOneToMany']:
+            old_table = sa.table(table_name, sa.column('id'), sa.column('value'), *([sa.column('sa_fingerprint')] if table_name.startswith('Fingerprinted') else []))
+            connection.execute(sa.insert(old_table), [dict(id=owner_id, value=1, sa_fingerprint=f'old{owner_id}') for owner_id in members])
+            association_table = sa.table(f'{table_name}__SubConfigManyToMany', sa.column(table_name), sa.column('SubConfigManyToMany'))
+            connection.execute(sa.insert(association_table), [{table_name: owner_id, 'SubConfigManyToMany': member_id} for owner_id, member_ids in members.items() for member_id in member_ids])
+
+    with sa_orm.Session(engine) as session:
+        maintenance.sync_schema(session)
+        session.commit()
+        for table in [cs.SubConfigOneToMany, cs.FingerprintedSubConfigOneToMany]:
+            for owner_id, member_ids in members.items():
+                row = session.get(table, owner_id)
+                assert row.many_to_many_digest == orm.ids_digest(member_ids)
+                assert row.many_to_many_superclass_digest == orm.ids_digest([])
+                # the lookups of the saved configs find their rows, without duplicates
+                cfg = {'_target_': f'cs.{table.__name__}', 'many_to_many': [{'_target_': 'cs.SubConfigManyToMany', 'value': member_id} for member_id in member_ids]}
+                assert orm.instantiate_and_insert_config(session, cfg) is row
+        assert maintenance.find_duplicates(session) == {}
+
+
+def test_sync_schema_only_backfills_the_rows_of_single_table_subclasses_with_the_fields():
+    engine = sa.create_engine('sqlite+pysqlite:///:memory:')
+    table_name = cs.SubConfigSingleTableSuperclass.__tablename__
+    _create_old_schema(engine, dropped_columns={table_name: {'value', 'many_to_many_digest'}}, dropped_tables=set())
+    old_table = sa.table(table_name, sa.column('id'), sa.column('sa_inheritance'), sa.column('value_superclass'))
+    with engine.begin() as connection:
+        connection.execute(sa.insert(old_table), [
+            dict(id=1, sa_inheritance='SubConfigSingleTableSuperclass', value_superclass=1),
+            dict(id=2, sa_inheritance='SubConfigSingleTableInheritance1', value_superclass=1),
+            dict(id=3, sa_inheritance='SubConfigSingleTableInheritance2', value_superclass=1),
+        ])
+
+    with sa_orm.Session(engine) as session:
+        report = maintenance.sync_schema(session)
+        session.commit()
+        assert sorted(report.added_columns) == [f'{table_name}.many_to_many_digest', f'{table_name}.value']
+        table = cs.SubConfigSingleTableSuperclass.__table__
+        assert session.execute(sa.select(table.c.id, table.c.value, table.c.many_to_many_digest).order_by(table.c.id)).all() == [
+            (1, None, None), (2, 1, None), (3, 1, orm.ids_digest([])),
+        ]
+
+
+def test_sync_schema_rejects_new_columns_without_defaults():
+    engine = sa.create_engine('sqlite+pysqlite:///:memory:')
+    _create_old_schema(engine, dropped_columns={'Config': {'SubConfigOneToManySuperclass'}}, dropped_tables=set())
+    with sa_orm.Session(engine) as session:
+        with pytest.raises(ValueError, match='Config.sub_config_one_to_many_superclass'):
+            maintenance.sync_schema(session)
@@ -1,3 +1,6 @@
+import asyncio
+import gc
+
 import pytest
 from omegaconf import OmegaConf
 import sqlalchemy as sa
@@ -60,6 +63,38 @@ def test_override_value_of_field_not_saved_in_database_is_preserved(engine, over
         assert v == 'overridden'
 
 
+def test_override_value_is_reapplied_when_row_is_reloaded(engine):
+    cfg = init_hydra_cfg('Config', ['sub_config_one_to_many_superclass.not_saved_in_database=overridden'])
+    with sa_orm.Session(engine) as session:
+        cfg = orm.instantiate_and_insert_config(session, cfg)
+        session.commit()
+        sub_config_id = cfg.sub_config_one_to_many_superclass.id
+        session.expunge(cfg.sub_config_one_to_many_superclass)
+        gc.collect()
+
+        sub_config = session.get(cs.SubConfigOneToManySuperclass, sub_config_id)
+        assert sub_config.not_saved_in_database == 'overridden'
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_override_store_is_released_with_config(engine, bulk):
+    cfg = init_hydra_cfg('Config', ['not_saved_in_database=overridden', 'sub_config_one_to_many_superclass.not_saved_in_database=overridden'])
+    with sa_orm.Session(engine) as session:
+        if bulk:
+            cfg, = orm.instantiate_and_insert_configs(session, [cfg])
+        else:
+            cfg = orm.instantiate_and_insert_config(session, cfg)
+        session.commit()
+        store = orm.override_store(session)
+        assert len(store) == 2
+        info_size = len(session.info)
+
+        del cfg
+        gc.collect()
+        assert len(store) == 0
+        assert len(session.info) == info_size
+
+
 @pytest.mark.parametrize('overrides', [
     ['sub_config_one_to_many_superclass=SubConfigOneToManySuperclass'],
     ['sub_config_one_to_many_superclass=SubConfigOneToManyInheritance1'],
@@ -269,3 +304,564 @@ def test_dynamic_fetching_of_list_of_referenced_row(engine):
         cfg = orm.instantiate_and_insert_config(session, cfg)
 
         assert {ref.config.alt_id for ref in cfg.list_of_references} == set(config_alt_ids)
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_transform_many_resolves_all_references_with_one_query(engine, bulk):
+    with sa_orm.Session(engine, expire_on_commit=False) as session:
+        config_alt_ids = [
+            orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', [f'rng_seed={i}'])).alt_id
+            for i in range(3)
+        ]
+        cfgs = [
+            {
+                '_target_': 'cs.BatchReferences',
+                'one_reference': {'_target_': 'cs.BatchReferencingConfig', 'config': config_alt_ids[i]},
+                'list_of_references': [{'_target_': 'cs.BatchReferencingConfig', 'config': c} for c in config_alt_ids],
+            }
+            for i in range(2)
+        ]
+        with orm.instrument(session) as insert_stats:
+            if bulk:
+                cfgs = orm.instantiate_and_insert_configs(session, cfgs)
+            else:
+                cfgs = [orm.instantiate_and_insert_config(session, cfgs[0])]
+
+        transform_stats = insert_stats.as_dict()['BatchReferencingConfig']['transform']
+        assert transform_stats['calls'] == transform_stats['statements'] == 1
+        for i, cfg in enumerate(cfgs):
+            assert cfg.one_reference.config.alt_id == config_alt_ids[i]
+            assert {ref.config.alt_id for ref in cfg.list_of_references} == set(config_alt_ids)
+
+
+def test_batch_transforms_skip_configs_that_reach_no_hooks():
+    assert orm._reaches_batch_transforms(cs.BatchReferences)
+    assert not orm._reaches_batch_transforms(cs.Config)
+    cfg = {'_target_': 'cs.Config', 'sub_config_many_to_many': [{'value': 1}]}
+    assert orm._apply_batch_transforms(None, [cfg])[0] is cfg
+
+
+def test_fingerprint_column_prevents_duplicate_rows(engine):
+    with sa_orm.Session(engine, expire_on_commit=False) as session:
+        row = orm.instantiate_and_insert_config(session, {'_target_': 'cs.FingerprintedSubConfigOneToMany', 'value': 2})
+        session.commit()
+
+        session.add(cs.FingerprintedSubConfigOneToMany(value=row.value))
+        with pytest.raises(sa.exc.IntegrityError):
+            session.commit()
+
+
+@pytest.mark.parametrize('cfg', [
+    {'_target_': 'cs.FingerprintedSubConfigOneToManyReferencingSuperclassOneToMany', 'superclass': {'_target_': 'cs.FingerprintedSubConfigOneToManyInheritance1', 'value': 2}},
+    {'_target_': 'cs.FingerprintedSubConfigOneToMany', 'many_to_many': [{'_target_': 'cs.SubConfigManyToMany', 'value': 1}, {'_target_': 'cs.SubConfigManyToMany', 'value': 2}]},
+    {'_target_': 'cs.FingerprintedSubConfigOneToMany', 'many_to_many_superclass': [{'_target_': 'cs.FingerprintedSubConfigManyToManyInheritance2'}, {'_target_': 'cs.FingerprintedSubConfigManyToManyInheritance1'}]},
+])
+def test_fingerprint_matches_saved_row(engine, cfg):
+    with sa_orm.Session(engine, expire_on_commit=False) as session:
+        row = orm.instantiate_and_insert_config(session, cfg)
+        session.commit()
+
+        for row in (row, getattr(row, 'superclass', None), *getattr(row, 'many_to_many_superclass', [])):
+            if row is not None:
+                values = {k: getattr(row, k) for k in row.__table_plan__.persisted}
+                assert getattr(row, orm.FINGERPRINT_COLUMN_NAME) == orm.fingerprint(row.__class__, values)
+
+
+def test_lookups_reuse_one_statement_per_table_and_null_values(engine):
+    statements = []
+    sa.event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    with sa_orm.Session(engine) as session:
+        for rng_seed in range(2):
+            for overrides in [[], ['sub_config_one_to_many_superclass_element_type_not_enforced={_target_:cs.SubConfigOneToManyInheritance1}']]:
+                orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', [*overrides, f'rng_seed={rng_seed}']))
+    config_lookups = {s for s in statements if s.startswith('SELECT "Config"') and 'LIMIT' in s}
+    assert len(config_lookups) == 2
+    null_names = frozenset({'sub_config_one_to_many_superclass_element_type_not_enforced_id'})
+    assert orm._lookup_statement(cs.Config, null_names) is orm._lookup_statement(cs.Config, null_names)
+    # None values are compared with IS NULL and the others with =, so that
+    # the lookups can use the indexes on PostgreSQL
+    null_lookup, = {s for s in config_lookups if 'IS NULL' in s}
+    assert '"SubConfigOneToManySuperclass_element_type_not_enforced" IS NULL' in null_lookup
+    assert all(' IS ?' not in s and 'DISTINCT' not in s for s in config_lookups)
+
+
+def test_table_options_are_set_on_hierarchy_root():
+    with pytest.raises(ValueError):
+        class SubConfigOneToManyInheritanceWithOptions(cs.FingerprintedSubConfigOneToManySuperclass, fingerprint=False):
+            pass
+
+
+@pytest.mark.parametrize('table_options', [
+    dict(inheritance='unknown'),
+    dict(inheritance=orm.SINGLE_TABLE_INHERITANCE, fingerprint=True),
+])
+def test_single_table_inheritance_is_set_on_inheritable_table(table_options):
+    with pytest.raises(ValueError):
+        class ConfigWithInheritance(orm.Table, **table_options):
+            pass
+
+
+def test_single_table_inheritance_rejects_conflicting_columns():
+    with pytest.raises(ValueError):
+        class SubConfigSingleTableConflictingValue(cs.SubConfigSingleTableSuperclass):
+            value: str = orm.make_field(sa.Column(sa.String(8)), default='1')
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_single_table_inheritance_saves_hierarchy_in_one_table(engine, bulk):
+    cfgs = [
+        {'_target_': 'cs.SubConfigSingleTableSuperclass'},
+        {'_target_': 'cs.SubConfigSingleTableInheritance1', 'value': 2},
+        {'_target_': 'cs.SubConfigSingleTableInheritance2', 'value': 2, 'many_to_many': [{'_target_': 'cs.SubConfigManyToMany', 'value': 2}]},
+        {'_target_': 'cs.SubConfigSingleTableReferencingSuperclass', 'superclass': {'_target_': 'cs.SubConfigSingleTableInheritance2', 'value': 2}},
+    ]
+    insert = (lambda session, cfgs: orm.instantiate_and_insert_configs(session, cfgs)) if bulk else (lambda session, cfgs: [orm.instantiate_and_insert_config(session, cfg) for cfg in cfgs])
+    table_name = cs.SubConfigSingleTableSuperclass.__tablename__
+    assert set(sa.inspect(engine).get_table_names()).isdisjoint({
+        cs.SubConfigSingleTableInheritance1.__name__, cs.SubConfigSingleTableInheritance2.__name__, cs.SubConfigSingleTableReferencingSuperclass.__name__,
+    })
+    with sa_orm.Session(engine) as session:
+        rows = insert(session, cfgs)
+        session.commit()
+        ids = [row.id for row in rows]
+        assert len(set(ids)) == len(cfgs)
+        # the referenced row has the same values as rows[1], but is told apart by the discriminator
+        assert rows[3].superclass.value == rows[1].value and rows[3].superclass.id not in ids
+        assert [row.id for row in insert(session, cfgs)] == ids
+
+    with sa_orm.Session(engine) as session:
+        statements = []
+        sa.event.listen(engine, 'after_cursor_execute', lambda *args: statements.append(args[2]))
+        rows = session.scalars(sa.select(cs.SubConfigSingleTableSuperclass).where(cs.SubConfigSingleTableSuperclass.id.in_(ids))).all()
+        assert [row.__class__.__name__ for row in rows] == [cfg['_target_'].split('.')[1] for cfg in cfgs]
+        assert rows[1].value == 2 and rows[2].many_to_many[0].value == 2
+        assert f'FROM "{table_name}"' in statements[0] and 'JOIN' not in statements[0]
+
+
+def test_many_to_many_digest_is_maintained(engine):
+    with sa_orm.Session(engine, expire_on_commit=False) as session:
+        cfg = orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', ['sub_config_many_to_many=[{value:2},{value:1}]']))
+        session.commit()
+
+        assert cfg.sub_config_many_to_many_digest == orm.many_to_many_digest(reversed(cfg.sub_config_many_to_many))
+        assert cfg.sub_config_many_to_many_custom_m2m_table_name_digest == orm.many_to_many_digest([])
+
+        cfg.sub_config_many_to_many.pop()
+        session.commit()
+        assert cfg.sub_config_many_to_many_digest == orm.many_to_many_digest(cfg.sub_config_many_to_many)
+
+
+def test_bulk_insert_matches_single_insert(engine):
+    overrides_list = [
+        [],
+        ['string=STRING2'],
+        ['sub_config_many_to_many=[{value:1},{value:2}]'],
+        ['sub_config_one_to_many_superclass=SubConfigOneToManyReferencingSuperclassOneToMany'],
+        ['sub_config_one_to_many.many_to_many_superclass=[{_target_:cs.SubConfigManyToManyInheritance1},{_target_:cs.SubConfigManyToManyInheritance2}]'],
+        ['sub_config_one_to_many.many_to_many_superclass=[{_target_:cs.SubConfigManyToManyInheritance1},{_target_:cs.SubConfigManyToManyInheritance3}]'],
+    ]
+    cfg_dicts = [init_hydra_cfg('Config', overrides) for overrides in overrides_list]
+    with sa_orm.Session(engine, expire_on_commit=False) as session:
+        cfgs_single = [orm.instantiate_and_insert_config(session, cfg_dict) for cfg_dict in cfg_dicts[:3]]
+        session.commit()
+        cfgs_bulk = orm.instantiate_and_insert_configs(session, cfg_dicts[::-1])[::-1]
+        session.commit()
+        cfgs_single.extend(orm.instantiate_and_insert_config(session, cfg_dict) for cfg_dict in cfg_dicts[3:])
+        session.commit()
+
+        assert cfgs_bulk == cfgs_single
+        assert session.scalar(sa.select(sa.func.count()).select_from(cs.Config)) == len(overrides_list)
+
+
+def test_bulk_insert_deduplicates_within_batch(engine):
+    cfg_dicts = [
+        init_hydra_cfg('Config', ['sub_config_many_to_many=[{value:1},{value:2}]']),
+        init_hydra_cfg('Config', ['sub_config_many_to_many=[{value:2},{value:1}]']),
+        init_hydra_cfg('Config', ['sub_config_many_to_many=[{value:1},{value:2}]', 'not_saved_in_database=overridden']),
+    ]
+    with sa_orm.Session(engine, expire_on_commit=False) as session:
+        cfgs = orm.instantiate_and_insert_configs(session, cfg_dicts)
+        session.commit()
+
+        assert cfgs[0] is cfgs[1] is cfgs[2]
+        assert cfgs[2].not_saved_in_database == 'overridden'
+        assert session.scalar(sa.select(sa.func.count()).select_from(cs.SubConfigManyToMany)) == 2
+
+
+def test_bulk_insert_applies_transforms(engine):
+    with sa_orm.Session(engine, expire_on_commit=False) as session:
+        config_alt_ids = [
+            cfg.alt_id for cfg in orm.instantiate_and_insert_configs(session, [
+                init_hydra_cfg('Config', [f'sub_config_one_to_many.value={i}']) for i in range(2)
+            ])
+        ]
+        cfg, = orm.instantiate_and_insert_configs(session, [
+            init_hydra_cfg('Config', [f"list_of_references=[{','.join(f'{{config:{c}}}' for c in config_alt_ids)}]"]),
+        ])
+
+        assert {ref.config.alt_id for ref in cfg.list_of_references} == set(config_alt_ids)
+
+
+def test_find_saved_configs_does_not_insert(engine):
+    with sa_orm.Session(engine) as session:
+        saved = orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', ['sub_config_many_to_many=[{value:1}]']))
+        session.commit()
+        n_rows = session.scalar(sa.select(sa.func.count()).select_from(cs.SubConfigManyToMany))
+
+        rows = orm.find_saved_configs(session, [
+            init_hydra_cfg('Config', ['sub_config_many_to_many=[{value:1}]']),
+            init_hydra_cfg('Config', ['sub_config_many_to_many=[{value:2}]']),
+            init_hydra_cfg('Config', ['rng_seed=0']),
+        ])
+
+        assert rows == [saved, None, None]
+        assert len(session.new) == 0
+        assert session.scalar(sa.select(sa.func.count()).select_from(cs.SubConfigManyToMany)) == n_rows
+
+
+def test_row_cache_skips_lookups_of_repeated_subtrees(engine):
+    statements = []
+    sa.event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    row_cache = orm.RowCache()
+    cfg_dict = init_hydra_cfg('Config', ['sub_config_one_to_many.many_to_many=[{value:1},{value:2}]'])
+    with row_cache.attach(sa_orm.Session(engine, expire_on_commit=False)) as session:
+        cfg_a = orm.instantiate_and_insert_config(session, cfg_dict)
+        session.commit()
+        assert row_cache.hits == 0
+
+        statements.clear()
+        cfg_b = orm.instantiate_and_insert_config(session, cfg_dict)
+        cfg_c, = orm.instantiate_and_insert_configs(session, [cfg_dict])
+        assert cfg_a is cfg_b is cfg_c
+        assert row_cache.misses == row_cache.hits // 2 == len(row_cache)
+        assert not any(s.lstrip().startswith('SELECT') for s in statements)
+
+
+def test_row_cache_is_cleared_on_rollback(engine):
+    row_cache = orm.RowCache()
+    with row_cache.attach(sa_orm.Session(engine, expire_on_commit=False)) as session:
+        orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', []))
+        assert len(row_cache) > 0
+        session.rollback()
+        assert len(row_cache) == 0
+
+        cfg = orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', []))
+        session.commit()
+        assert session.get(cs.Config, cfg.id) is cfg
+
+
+def test_row_cache_evicts_least_recently_used():
+    row_cache = orm.RowCache(maxsize=2)
+    for value in range(3):
+        row_cache.put(cs.SubConfigManyToMany, {'value': value}, value)
+    row_cache.get(cs.SubConfigManyToMany, {'value': 1})
+
+    assert row_cache.get(cs.SubConfigManyToMany, {'value': 0}) is None
+    assert row_cache.stats() == dict(hits=1, misses=1, size=2, maxsize=2)
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_id_allocator_inserts_new_rows_with_one_flush(engine, bulk):
+    insert = (lambda session, cfg: orm.instantiate_and_insert_configs(session, [cfg])[0]) if bulk else orm.instantiate_and_insert_config
+    overrides = ['sub_config_many_to_many=[{value:1},{value:2}]', 'sub_config_one_to_many_superclass=SubConfigOneToManyReferencingSuperclassOneToMany']
+    statements = []
+    sa.event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    with orm.IdAllocator().attach(sa_orm.Session(engine, expire_on_commit=False)) as session:
+        cfg = insert(session, init_hydra_cfg('Config', overrides))
+        session.commit()
+        # both new SubConfigManyToMany rows are written by one executemany
+        assert sum(s.startswith(f'INSERT INTO "{cs.SubConfigManyToMany.__tablename__}"') for s in statements) == 1
+        # nothing can reference a new row yet, so the configs above them are not looked up
+        assert not any(s.startswith('SELECT') and f'FROM "{cs.Config.__tablename__}"' in s and 'LIMIT' in s for s in statements)
+
+        assert insert(session, init_hydra_cfg('Config', overrides)) is cfg
+        session.commit()
+
+    with sa_orm.Session(engine) as session:
+        cfg_fetched = session.get(cs.Config, cfg.id)
+        assert sorted(v.value for v in cfg_fetched.sub_config_many_to_many) == [1, 2]
+        assert cfg_fetched.sub_config_one_to_many_superclass.superclass.id == cfg.sub_config_one_to_many_superclass.superclass.id
+
+
+def test_id_allocator_reserves_blocks_after_saved_ids(engine):
+    with sa_orm.Session(engine) as session:
+        cfg = orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', []))
+        session.commit()
+        id_allocator = orm.IdAllocator(block_size=10)
+        id_allocator.attach(session)
+        assert list(id_allocator.allocate(session, cs.Config, 2)) == [cfg.id + 1, cfg.id + 2]
+        assert list(id_allocator.allocate(session, cs.Config, 10)) == list(range(cfg.id + 11, cfg.id + 21))
+        assert id_allocator.blocks_reserved == 2
+
+        # the reservation is rolled back, so its ids are handed out again
+        session.rollback()
+        assert list(id_allocator.allocate(session, cs.Config, 1)) == [cfg.id + 1]
+        # subclasses take their ids from the table of their hierarchy root
+        saved_max_id = session.scalar(sa.select(sa.func.max(cs.SubConfigOneToManySuperclass.id)))
+        sub_config = orm.instantiate_and_insert_config(session, {'_target_': 'cs.SubConfigOneToManyInheritance2', 'value': 3})
+        assert sub_config.id == saved_max_id + 1
+
+        with pytest.raises(ValueError):
+            id_allocator.attach(sa_orm.Session(engine))
+
+
+def test_id_allocator_blocks_are_skipped_by_plain_inserts(tmp_path):
+    engine = sa.create_engine(f'sqlite+pysqlite:///{tmp_path / "runs.sqlite"}')
+    orm.create_all(engine)
+    with sa_orm.Session(engine) as session:
+        id_allocator = orm.IdAllocator(block_size=10)
+        id_allocator.attach(session)
+        assert id_allocator.allocate(session, cs.SubConfigManyToMany, 2) == [1, 2]
+        # rows inserted without the allocator, in the same transaction and
+        # after it is committed, take ids after the block
+        session.add(cs.SubConfigManyToMany(value=1))
+        session.flush()
+        plain_ids = [session.scalar(sa.select(sa.func.max(cs.SubConfigManyToMany.id)))]
+        rows = [cs.SubConfigManyToMany(value=2), cs.SubConfigManyToMany(value=3)]
+        for row, row_id in zip(rows, id_allocator.allocate(session, cs.SubConfigManyToMany, 2)):
+            row.id = row_id
+        session.add_all(rows)
+        session.commit()
+        allocated_ids = [row.id for row in rows]
+    with sa_orm.Session(engine) as session:
+        session.add(cs.SubConfigManyToMany(value=4))
+        session.commit()
+        plain_ids.append(session.scalar(sa.select(sa.func.max(cs.SubConfigManyToMany.id))))
+
+    assert allocated_ids == [3, 4]
+    assert plain_ids == [11, 12]
+    engine.dispose()
+
+
+def test_id_allocator_refuses_tables_without_autoincrement(engine):
+    with engine.begin() as connection:
+        connection.execute(sa.text(f'DROP TABLE "{cs.LaterSubConfig.__tablename__}"'))
+        connection.execute(sa.text(f'CREATE TABLE "{cs.LaterSubConfig.__tablename__}" (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)'))
+    with sa_orm.Session(engine) as session:
+        id_allocator = orm.IdAllocator()
+        id_allocator.attach(session)
+        with pytest.raises(ValueError):
+            id_allocator.allocate(session, cs.LaterSubConfig)
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_instrument_reports_statements_per_table_and_branch(engine, bulk):
+    def insert(session, cfg):
+        if bulk:
+            return orm.instantiate_and_insert_configs(session, [cfg])[0]
+        return orm.instantiate_and_insert_config(session, cfg)
+
+    with sa_orm.Session(engine) as session:
+        cfg = insert(session, init_hydra_cfg('Config', []))
+        session.commit()
+        with orm.instrument(session) as insert_stats:
+            insert(session, init_hydra_cfg('Config', [f'one_reference.config={cfg.alt_id}']))
+            session.commit()
+        stats = insert_stats.as_dict()
+        assert stats['ReferencingConfig']['transform']['calls'] == 1
+        assert stats['ReferencingConfig']['transform']['statements'] == 1
+        assert stats['ReferencingConfig']['insert']['rows_written'] == 1
+        assert stats['ReferencingConfig']['insert']['rows_returned'] == 0
+        # each lookup of the saved SubConfigOneToMany returns its one row
+        assert stats['SubConfigOneToMany']['lookup']['rows_returned'] == stats['SubConfigOneToMany']['lookup']['calls']
+        assert 'insert' not in stats['SubConfigOneToMany']
+        assert stats['Config']['insert']['statements'] > 0
+
+        insert(session, init_hydra_cfg('Config', ['rng_seed=0']))
+        assert insert_stats.as_dict() == stats
+        assert orm.INSERT_STATS_SESSION_INFO_KEY not in session.info
+
+
+def test_detach_configs_loads_whole_graph_with_constant_number_of_queries(engine):
+    overrides = [
+        'sub_config_one_to_many_superclass=SubConfigOneToManyReferencingSuperclassOneToMany',
+        'sub_config_many_to_many_superclass=[{_target_:cs.SubConfigManyToManyInheritance1},{_target_:cs.SubConfigManyToManyInheritance2}]',
+    ]
+    statements = []
+    for n_configs in [1, 3]:
+        with sa_orm.Session(engine) as session:
+            cfgs = [
+                orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', [*overrides, f'rng_seed={n_configs}{i}', f'sub_config_many_to_many=[{{value:{i}}}]']))
+                for i in range(n_configs)
+            ]
+            session.commit()
+            statements.append(0)
+            count_statement = lambda *args: statements.__setitem__(-1, statements[-1] + 1)
+            sa.event.listen(engine, 'after_cursor_execute', count_statement)
+            cfgs = orm.detach_configs_from_session(cfgs, session)
+            sa.event.remove(engine, 'after_cursor_execute', count_statement)
+
+        for i, cfg in enumerate(cfgs):
+            assert sa.inspect(cfg).detached
+            assert cfg.sub_config_one_to_many_superclass.superclass.value_superclass == 1
+            assert [v.value for v in cfg.sub_config_many_to_many_superclass] == [1, 1]
+            assert [v.value for v in cfg.sub_config_many_to_many] == [i]
+            assert cfg.sub_config_one_to_many.many_to_many == []
+            assert cfg.one_reference.config is None
+    assert statements[0] == statements[1]
+
+
+def test_detach_configs_reuses_rows_loaded_in_session(engine):
+    association_tables = {
+        prop.secondary
+        for mapper in sa.inspect(cs.Config).registry.mappers
+        for prop in mapper.relationships
+        if prop.secondary is not None
+    }
+    with sa_orm.Session(engine) as session:
+        cfg = orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', ['sub_config_many_to_many=[{value:1}]']))
+        session.flush()
+        statements = []
+        record_statement = lambda conn, cursor, statement, *args: statements.append(statement)
+        sa.event.listen(engine, 'after_cursor_execute', record_statement)
+        [cfg] = orm.detach_configs_from_session([cfg], session)
+        sa.event.remove(engine, 'after_cursor_execute', record_statement)
+
+    # only the associations are selected, the rows are already loaded
+    assert len(statements) > 0
+    assert all(
+        any(f'FROM "{table.name}"' in statement for table in association_tables)
+        for statement in statements
+    )
+    assert [v.value for v in cfg.sub_config_many_to_many] == [1]
+
+
+@pytest.mark.parametrize('query,expected', [
+    (['string=STRING2'], [2]),
+    (['sub_config_one_to_many.value=3'], [3]),
+    (['sub_config_one_to_many_superclass=SubConfigOneToManyInheritance2'], [4]),
+    (['sub_config_one_to_many_superclass=SubConfigOneToManyInheritance1', 'sub_config_one_to_many_superclass.value=1'], [1, 2, 3, 5, 6]),
+    (['sub_config_one_to_many_superclass={_target_:cs.SubConfigOneToManyInheritance2,value_superclass:1}'], [4]),
+    # lists match exactly, so the superset [1, 2] of config 5 does not match [1]
+    (['sub_config_many_to_many=[{value:1}]'], [6]),
+    (['sub_config_many_to_many=[{value:2}]'], []),
+    (['sub_config_many_to_many=[{value:2},{value:1}]'], [5]),
+    (['sub_config_many_to_many=[]'], [1, 2, 3, 4]),
+    ({'string': 'STRING1', 'sub_config_one_to_many': {'value': 1}}, [1, 4, 5, 6]),
+])
+def test_select_configs_by_overrides(engine, query, expected):
+    with sa_orm.Session(engine) as session:
+        for overrides in [[], ['string=STRING2'], ['sub_config_one_to_many.value=3'], ['sub_config_one_to_many_superclass=SubConfigOneToManyInheritance2'], ['sub_config_many_to_many=[{value:1},{value:2}]'], ['sub_config_many_to_many=[{value:1}]']]:
+            orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', overrides))
+        session.commit()
+
+        assert orm.find_config_ids(session, cs.Config, query) == expected
+        assert [cfg.id for cfg in orm.find_configs(session, cs.Config, query)] == expected
+
+
+@pytest.mark.parametrize('query', [
+    ['not_saved_in_database=value'],
+    ['unknown=1'],
+    ['string=STRING1,STRING2'],
+    ['sub_config_one_to_many_superclass={_target_:cs.SubConfigManyToManyInheritance1}'],
+])
+def test_select_configs_by_invalid_overrides_raises(query):
+    with pytest.raises(ValueError):
+        orm.select_configs(cs.Config, query)
+
+
+def test_select_configs_by_transformed_fields(engine):
+    with sa_orm.Session(engine) as session:
+        alt_ids = [orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', [f'rng_seed={i}'])).alt_id for i in range(2)]
+        referencing_id = orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', ['rng_seed=2', f'one_reference.config={alt_ids[0]}'])).id
+        batch_referencing_id = orm.instantiate_and_insert_config(session, {
+            '_target_': 'cs.BatchReferences',
+            'list_of_references': [{'_target_': 'cs.BatchReferencingConfig', 'config': alt_id} for alt_id in alt_ids],
+        }).id
+        session.commit()
+
+        assert orm.find_config_ids(session, cs.Config, [f'one_reference.config={alt_ids[0]}']) == [referencing_id]
+        assert orm.find_config_ids(session, cs.Config, [f'one_reference.config={alt_ids[1]}']) == []
+        assert orm.find_config_ids(session, cs.ReferencingConfig, [f'config={alt_ids[0]}']) == [session.get(cs.Config, referencing_id).one_reference.id]
+        assert orm.find_config_ids(session, cs.BatchReferences, [f"list_of_references=[{','.join(f'{{config:{c}}}' for c in alt_ids)}]"]) == [batch_referencing_id]
+        assert orm.find_config_ids(session, cs.BatchReferences, [f'list_of_references=[{{config:{alt_ids[0]}}}]']) == []
+        with pytest.raises(ValueError):
+            orm.select_configs(cs.Config, [f'one_reference.config={alt_ids[0]}'])
+
+
+def test_insert_plain_dict_config_uses_field_defaults(engine):
+    with sa_orm.Session(engine, expire_on_commit=False) as session:
+        cfg = orm.instantiate_and_insert_config(session, OmegaConf.to_container(init_hydra_cfg('Config', ['sub_config_one_to_many.many_to_many=[{value:2}]'])))
+        sub_config = orm.instantiate_and_insert_config(session, {'_target_': 'cs.SubConfigOneToMany', 'many_to_many': [cs.SubConfigManyToMany(value=2)]})
+        session.commit()
+
+        assert sub_config is cfg.sub_config_one_to_many
+        assert sub_config.many_to_many[0].not_saved_in_database == cs.SubConfigManyToMany().not_saved_in_database
+
+
+@pytest.mark.parametrize('cfg', [
+    {'value': 1},
+    {'_target_': 'cs.SubConfigOneToMany', 'unknown_field': 1},
+    {'_target_': 'cs.StringEnum'},
+    {'_target_': 'cs.Config'},
+])
+def test_invalid_config_raises(engine, cfg):
+    with sa_orm.Session(engine) as session:
+        with pytest.raises(ValueError):
+            orm.instantiate_and_insert_config(session, cfg)
+
+
+def test_async_insert_matches_sync_insert(tmp_path):
+    pytest.importorskip('aiosqlite')
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    async def insert():
+        engine = create_async_engine(f'sqlite+aiosqlite:///{tmp_path / "runs.sqlite"}')
+        async with engine.begin() as conn:
+            await conn.run_sync(orm.create_all)
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            cfg = await orm.instantiate_and_insert_config_async(session, init_hydra_cfg('Config', ['sub_config_many_to_many=[{value:1},{value:2}]']))
+            ref_overrides = [f'one_reference.config={cfg.alt_id}']
+            cfg_ref, cfg_again = await orm.instantiate_and_insert_configs_async(session, [
+                init_hydra_cfg('Config', ref_overrides),
+                init_hydra_cfg('Config', ['sub_config_many_to_many=[{value:2},{value:1}]']),
+            ])
+            async_ref = await orm.instantiate_and_insert_config_async(session, {'_target_': 'cs.AsyncReferencingConfig', 'config': cfg.alt_id})
+            await session.commit()
+        await engine.dispose()
+        return cfg, cfg_ref, cfg_again, async_ref
+
+    cfg, cfg_ref, cfg_again, async_ref = asyncio.run(insert())
+    assert cfg_again.id == cfg.id
+    assert cfg_ref.one_reference.config.id == cfg.id
+    assert async_ref.config.id == cfg.id
+
+
+@pytest.mark.parametrize('cfg', [
+    {'_target_': 'cs.FingerprintedSubConfigOneToManyReferencingSuperclassOneToMany', 'superclass': {'_target_': 'cs.FingerprintedSubConfigOneToManyInheritance1', 'value': 3}},
+    {'_target_': 'cs.FingerprintedSubConfigOneToMany', 'many_to_many_superclass': [{'_target_': 'cs.FingerprintedSubConfigManyToManyInheritance1'}, {'_target_': 'cs.FingerprintedSubConfigManyToManyInheritance2'}]},
+])
+@pytest.mark.parametrize('bulk', [False, True])
+def test_upsert_resolves_rows_inserted_concurrently(engine, monkeypatch, cfg, bulk):
+    # emulate another transaction saving the rows between the lookup and the insert
+    monkeypatch.setattr(orm, '_find_saved_row', lambda *args: None)
+    monkeypatch.setattr(orm, '_select_saved_rows', lambda *args: {})
+    insert = (lambda session, cfg, upsert: orm.instantiate_and_insert_configs(session, [cfg], upsert=upsert)[0]) if bulk else orm.instantiate_and_insert_config
+    with sa_orm.Session(engine, expire_on_commit=False) as session:
+        row_a = insert(session, cfg, upsert=True)
+        session.commit()
+        row_b = insert(session, cfg, upsert=True)
+        session.commit()
+        assert row_a is row_b
+        session.expire(row_b)
+        values = {k: getattr(row_b, k) for k in row_b.__table_plan__.persisted}
+        assert getattr(row_b, orm.FINGERPRINT_COLUMN_NAME) == orm.fingerprint(row_b.__class__, values)
+
+        with pytest.raises(sa.exc.IntegrityError):
+            insert(session, cfg, upsert=False)
+
+
+def test_upsert_requires_fingerprint(engine):
+    with sa_orm.Session(engine) as session:
+        with pytest.raises(ValueError):
+            orm.instantiate_and_insert_config(session, {'_target_': 'cs.SubConfigManyToMany'}, upsert=True)
+
+
+def test_deduplication_and_association_indexes_are_created(engine):
+    inspector = sa.inspect(engine)
+    indexes = {index['name']: index['column_names'] for index in inspector.get_indexes(cs.SubConfigManyToMany.__tablename__)}
+    assert indexes[f'ix_{cs.SubConfigManyToMany.__tablename__}_deduplication'] == ['value']
+
+    m2m_table = cs.Config.sub_config_many_to_many.property.secondary
+    indexes = {index['name']: index['column_names'] for index in inspector.get_indexes(m2m_table.name)}
+    assert list(indexes.values()) == [[cs.SubConfigManyToMany.__tablename__]]
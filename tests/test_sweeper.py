@@ -0,0 +1,50 @@
+import pathlib
+import subprocess
+import sys
+
+
+APP = '''
+import sys
+sys.path.insert(0, {tests_dir!r})
+
+import hydra
+import sqlalchemy as sa
+import sqlalchemy.orm as sa_orm
+
+from hydra_orm import orm
+
+import cs
+
+
+@hydra.main(version_base=None, config_path={config_path!r}, config_name='Config')
+def main(cfg):
+    engine = sa.create_engine({db_url!r})
+    orm.create_all(engine)
+    with sa_orm.Session(engine) as session:
+        orm.instantiate_and_insert_config(session, cfg)
+        session.commit()
+    print('launched', cfg.rng_seed)
+
+
+if __name__ == '__main__':
+    main()
+'''
+
+
+def test_sweeper_launches_only_unsaved_configs(tmp_path):
+    tests_dir = pathlib.Path(__file__).parent
+    db_url = f'sqlite:///{tmp_path}/runs.sqlite'
+    app = tmp_path/'app.py'
+    app.write_text(APP.format(tests_dir=str(tests_dir), config_path=str(tests_dir/'conf_yaml'), db_url=db_url))
+
+    def sweep(*overrides):
+        res = subprocess.run(
+            [sys.executable, str(app), '--multirun', 'hydra/sweeper=hydra_orm', f'hydra.sweeper.db_url={db_url}', *overrides],
+            cwd=tmp_path, capture_output=True, text=True, check=True,
+        )
+        return sorted(line for line in res.stdout.splitlines() if line.startswith('launched'))
+
+    assert sweep('rng_seed=1,2') == ['launched 1', 'launched 2']
+    assert sweep('rng_seed=1,2,3') == ['launched 3']
+    assert sweep('rng_seed=1,2,3', 'hydra.sweeper.skip_existing=false') == ['launched 1', 'launched 2', 'launched 3']
+    assert sweep('rng_seed=3,4,5', 'hydra.sweeper.max_batch_size=1') == ['launched 4', 'launched 5']
@@ -0,0 +1,74 @@
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.orm as sa_orm
+
+from fixtures import init_hydra_cfg, engine
+import cs
+
+import hydra_orm.utils
+from hydra_orm import orm
+
+
+def test_unique_func_values_cost_no_statements(engine):
+    statements = []
+    sa.event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    with sa_orm.Session(engine, expire_on_commit=False) as session:
+        cfg = orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', []))
+        cfgs = orm.instantiate_and_insert_configs(session, [
+            init_hydra_cfg('Config', [f'rng_seed={i}']) for i in range(4)
+        ])
+        session.commit()
+
+    assert len({c.alt_id for c in [cfg, *cfgs]}) == 5
+    # no statement looks the generated values up
+    assert not any('alt_id' in s.partition('WHERE')[2] for s in statements)
+
+
+def test_unique_func_values_are_distinct_within_a_flush(engine):
+    values = iter(['a', 'a', 'b'])
+    set_alt_id = hydra_orm.utils.set_attr_to_unique_func_values(cs.Config, cs.Config.alt_id.key, lambda: next(values))
+    with sa_orm.Session(engine) as session:
+        cfgs = [cs.Config(sub_config_one_to_many_superclass=None, one_reference=None, rng_seed=i) for i in range(2)]
+        session.add_all(cfgs)
+        set_alt_id(None, session.connection(), cfgs[0])
+
+        assert {cfg.alt_id for cfg in cfgs} == {'a', 'b'}
+
+
+def test_retry_on_unique_violation_reruns_the_transaction(engine):
+    with sa_orm.Session(engine) as session:
+        saved_alt_id = orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', [])).alt_id
+        session.commit()
+
+    # the first attempt collides with the saved alt_id
+    alt_ids = iter([saved_alt_id, None])
+
+    def insert():
+        with sa_orm.Session(engine) as session:
+            cfg = orm.instantiate_and_insert_config(session, init_hydra_cfg('Config', ['rng_seed=1']))
+            session.flush()
+            cfg.alt_id = next(alt_ids) or cfg.alt_id
+            session.commit()
+            return cfg.id
+    assert hydra_orm.utils.retry_on_unique_violation(insert, cs.Config, cs.Config.alt_id.key) is not None
+
+    # other violations are not retried, and the last one is raised
+    calls = []
+
+    def insert_colliding():
+        calls.append(None)
+        raise sa.exc.IntegrityError('INSERT', {}, Exception(f'UNIQUE constraint failed: Config.{cs.Config.alt_id.key}'))
+    with pytest.raises(sa.exc.IntegrityError):
+        hydra_orm.utils.retry_on_unique_violation(insert_colliding, cs.Config, cs.Config.alt_id.key, max_attempts=3)
+    assert len(calls) == 3
+
+    def insert_duplicate():
+        calls.append(None)
+        with sa_orm.Session(engine) as session:
+            session.add(cs.FingerprintedSubConfigOneToMany(value=1))
+            session.add(cs.FingerprintedSubConfigOneToMany(value=1))
+            session.commit()
+    calls.clear()
+    with pytest.raises(sa.exc.IntegrityError):
+        hydra_orm.utils.retry_on_unique_violation(insert_duplicate, cs.Config, cs.Config.alt_id.key, max_attempts=3)
+    assert len(calls) == 1